@@ -0,0 +1,107 @@
+"""
+Admission-control benchmark for the ``/`` AG-UI endpoint.
+
+Starts ``example_server.serve`` as a subprocess with tight admission limits
+and fires a burst of simultaneous chats from a few callers (``X-Tenant-Id``)
+at it, against a local fake OpenAI-compatible upstream. Prints how many chats
+were admitted or rejected and why, how quickly rejections were answered, and
+the peak number of concurrent upstream streams, which must stay within the
+global limit.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_admission
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+from .bench_concurrency import run_input
+from .bench_workers import start_server, stop_server
+from .fake_openai import FakeOpenAI, free_port, serve_in_thread
+
+
+async def one_chat(client: httpx.AsyncClient, url: str, i: int, tenants: int) -> tuple[int, float]:
+    start = time.perf_counter()
+    headers = {"accept": "text/event-stream", "x-tenant-id": f"tenant-{i % tenants}"}
+    async with client.stream("POST", url, json=run_input(i), headers=headers) as response:
+        async for _ in response.aiter_bytes():
+            pass
+    return response.status_code, time.perf_counter() - start
+
+
+async def one_get(client: httpx.AsyncClient, url: str) -> float:
+    start = time.perf_counter()
+    response = await client.get(url)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def burst(url: str, chats: int, tenants: int) -> tuple[list, list]:
+    """Chat results, after the same burst of ``GET /metrics`` as a latency baseline."""
+    limits = httpx.Limits(max_connections=chats, max_keepalive_connections=chats)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        baseline = await asyncio.gather(*(one_get(client, url + "metrics") for _ in range(chats)))
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        results = await asyncio.gather(*(one_chat(client, url, i, tenants) for i in range(chats)))
+    return results, baseline
+
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--tenants", type=int, default=4)
+    parser.add_argument("--max-concurrent", type=int, default=16)
+    parser.add_argument("--max-concurrent-per-key", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--max-wait", type=float, default=1.0)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(tokens=args.tokens, token_delay=args.token_delay)
+    fake_port = free_port()
+    serve_in_thread(fake.app, fake_port)
+
+    os.environ["ADMISSION_MAX_CONCURRENT"] = str(args.max_concurrent)
+    os.environ["ADMISSION_MAX_CONCURRENT_PER_KEY"] = str(args.max_concurrent_per_key)
+    os.environ["ADMISSION_MAX_QUEUE"] = str(args.max_queue)
+    os.environ["ADMISSION_MAX_WAIT_SECONDS"] = str(args.max_wait)
+    server, url = start_server(1, fake_port)
+    try:
+        results, baseline = asyncio.run(burst(url, args.chats, args.tenants))
+        metrics = httpx.get(url + "metrics").text
+    finally:
+        stop_server(server)
+    statuses = Counter(status for status, _ in results)
+    admitted = [seconds for status, seconds in results if status == 200]
+    rejected = [seconds for status, seconds in results if status == 429]
+
+    print(f"single chat upstream time ~{args.tokens * args.token_delay:.2f}s")
+    print(f"chats {args.chats}, statuses {dict(statuses)}")
+    for reason in ("rate_limited", "queue_full", "deadline"):
+        match = re.search(rf'admission_rejections_total{{reason="{reason}"}} (\S+)', metrics)
+        print(f"  rejected {reason:<13} {float(match.group(1)) if match else 0:>5.0f}")
+    if admitted:
+        print(f"admitted   p50 {statistics.median(admitted) * 1000:8.1f} ms  p99 {percentile(admitted, 0.99) * 1000:8.1f} ms")
+    if rejected:
+        print(f"429        p50 {statistics.median(rejected) * 1000:8.1f} ms  p99 {percentile(rejected, 0.99) * 1000:8.1f} ms")
+    print(f"baseline   p50 {statistics.median(baseline) * 1000:8.1f} ms  p99 {percentile(baseline, 0.99) * 1000:8.1f} ms  (same burst of GET /metrics)")
+    print(f"peak upstream streams {fake.peak_streams} (limit {args.max_concurrent})")
+
+
+if __name__ == "__main__":
+    main()
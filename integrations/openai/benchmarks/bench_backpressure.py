@@ -0,0 +1,125 @@
+"""
+Memory per stream with slow clients, for each slow-consumer policy.
+
+Drives ``cancel_on_disconnect`` directly: a fake upstream produces AG-UI
+chunk frames at a fixed token rate while deliberately slow readers take each
+frame with a delay (slower than the upstream) and stall once mid-stream. For
+each ``StreamBuffer`` policy it prints how many streams completed or were
+dropped, when the upstream had been fully read (``block`` stalls it with the
+client), the mean peak of the per-stream buffer, frames written to the
+client, and the Python memory allocated per stream (tracemalloc peak).
+
+Over a real socket the kernel send buffer and the server's transport buffer
+absorb a few hundred KiB per connection before any of this applies; these
+numbers are what the server holds beyond that.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_backpressure
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from ag_ui.encoder import EventEncoder
+
+from example_server.backpressure import StreamBuffer
+from example_server.disconnect import cancel_on_disconnect
+from example_server.streaming import ChunkBatcher
+
+
+class ConnectedRequest:
+    """Stands in for a request whose client never disconnects."""
+
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+async def upstream(tokens: int, token_delay: float, token_text: str, done: list):
+    """Frames of one answer, one chunk event per token, as with batching disabled."""
+    batcher = ChunkBatcher(EventEncoder(), "message", max_chars=0, max_delay=0)
+    for _ in range(tokens):
+        await asyncio.sleep(token_delay)
+        for frame in batcher.text(token_text):
+            yield frame
+    done.append(time.perf_counter())
+
+
+async def slow_reader(buffer: StreamBuffer, args, started: float) -> dict:
+    done: list = []
+    frames = 0
+    stalled = False
+    stream = cancel_on_disconnect(
+        ConnectedRequest(),
+        upstream(args.tokens, args.token_delay, args.token_text, done),
+        poll_interval=1.0,
+        buffer=buffer,
+        stats=None,
+    )
+    async for _ in stream:
+        frames += 1
+        if not stalled and frames == args.tokens // 4:
+            stalled = True
+            await asyncio.sleep(args.stall)
+        await asyncio.sleep(args.read_delay)
+    return {
+        "completed": bool(done),
+        "upstream_done": (done[0] - started) if done else None,
+        "peak_bytes": buffer.peak_bytes,
+        "frames": frames,
+    }
+
+
+async def run_policy(policy: str, args) -> tuple[list, float]:
+    buffers = [
+        StreamBuffer(policy, args.max_frames, args.max_bytes, args.drop_after)
+        for _ in range(args.streams)
+    ]
+    tracemalloc.start()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(slow_reader(buffer, args, started) for buffer in buffers))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return results, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--token-text", default="lorem ipsum dolor sit amet, " * 4)
+    parser.add_argument("--token-delay", type=float, default=0.001)
+    parser.add_argument("--read-delay", type=float, default=0.003)
+    parser.add_argument("--stall", type=float, default=1.5)
+    parser.add_argument("--max-frames", type=int, default=16)
+    parser.add_argument("--max-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--drop-after", type=float, default=1.0)
+    parser.add_argument("--policies", default="block,coalesce,drop")
+    args = parser.parse_args()
+    # One warning per dropped client would drown the table
+    logging.getLogger("example_server").setLevel(logging.ERROR)
+
+    print(f"{args.streams} streams of {args.tokens} tokens every {args.token_delay * 1000:g} ms, "
+          f"read every {args.read_delay * 1000:g} ms with a {args.stall:g}s stall")
+    print(f"{'policy':>9} {'completed':>9} {'dropped':>7} {'upstream read s':>15} "
+          f"{'buffer peak KiB':>15} {'frames':>7} {'KiB/stream':>10}")
+    for policy in args.policies.split(","):
+        results, peak = asyncio.run(run_policy(policy, args))
+        completed = [result for result in results if result["completed"]]
+        upstream_done = [result["upstream_done"] for result in completed]
+        print(
+            f"{policy:>9} {len(completed):>9} {len(results) - len(completed):>7} "
+            f"{(sum(upstream_done) / len(upstream_done)) if upstream_done else 0:>15.2f} "
+            f"{sum(result['peak_bytes'] for result in results) / len(results) / 1024:>15.1f} "
+            f"{sum(result['frames'] for result in results) / len(results):>7.0f} "
+            f"{peak / len(results) / 1024:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
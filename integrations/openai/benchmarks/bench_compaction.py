@@ -0,0 +1,103 @@
+"""
+Prompt size and time to first token on long threads, with and without
+history compaction.
+
+Starts ``example_server.serve`` as a subprocess, once with compaction
+disabled and once enabled, against a local fake OpenAI-compatible upstream
+whose first token is delayed in proportion to the prompt size (standing in
+for prompt processing). Each server gets the same synthetic thread of
+``--turns`` turns, every turn with a tool call and a large tool output, for
+a few consecutive runs. Prints the prompt the upstream received (size and
+estimated tokens) and the time to the first text delta at the client.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_compaction
+"""
+
+import argparse
+import json
+import os
+import time
+
+import httpx
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from example_server.compaction import CHARS_PER_TOKEN
+
+from .bench_workers import start_server, stop_server
+from .fake_openai import FakeOpenAI, free_port, serve_in_thread
+
+
+def thread_messages(turns: int, tool_chars: int) -> list:
+    messages = [{"id": "system", "role": "system", "content": "You are a helpful assistant."}]
+    for turn in range(turns):
+        messages += [
+            {"id": f"user-{turn}", "role": "user",
+             "content": f"What is the weather in city {turn}? Please also compare it with yesterday."},
+            {"id": f"call-{turn}", "role": "assistant", "content": "", "toolCalls": [{
+                "id": f"tool-{turn}", "type": "function",
+                "function": {"name": "get_weather", "arguments": json.dumps({"city": f"city {turn}"})},
+            }]},
+            {"id": f"result-{turn}", "role": "tool", "toolCallId": f"tool-{turn}",
+             "content": json.dumps({"hourly": ["sunny, 21C, wind 5 km/h"] * (tool_chars // 30)})},
+            {"id": f"reply-{turn}", "role": "assistant",
+             "content": f"It is sunny in city {turn}, 21C. Yesterday was two degrees cooler. " * 3},
+        ]
+    return messages
+
+
+def first_delta_seconds(client: httpx.Client, url: str, payload: dict) -> float:
+    started = time.perf_counter()
+    first = None
+    with client.stream("POST", url, json=payload, headers={"accept": "text/event-stream"}) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if first is None and '"delta"' in line:
+                first = time.perf_counter() - started
+    return first if first is not None else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--tool-chars", type=int, default=4000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--prefill-ms-per-kib", type=float, default=1.0)
+    parser.add_argument("--max-tokens", type=int, default=32000)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(tokens=5, token_delay=0.001, prefill_per_kib=args.prefill_ms_per_kib / 1000)
+    fake_port = free_port()
+    serve_in_thread(fake.app, fake_port)
+    history = thread_messages(args.turns, args.tool_chars)
+
+    print(f"{args.turns}-turn thread, {len(json.dumps(history)) / 1024:.0f} KiB of AG-UI messages, "
+          f"prefill {args.prefill_ms_per_kib:g} ms/KiB")
+    print(f"{'compaction':>10} {'run':>3} {'prompt KiB':>10} {'~tokens':>8} {'TTFT ms':>8}")
+    os.environ["COMPACTION_MAX_TOKENS"] = str(args.max_tokens)
+    for enabled in (False, True):
+        os.environ["COMPACTION_ENABLED"] = str(enabled).lower()
+        server, url = start_server(1, fake_port)
+        try:
+            with httpx.Client(timeout=None) as client:
+                for run in range(args.runs):
+                    # Each run adds a turn, as a chat would
+                    messages = history + [
+                        {"id": f"next-{i}", "role": "user" if i % 2 == 0 else "assistant", "content": f"And then {i}?"}
+                        for i in range(2 * run + 1)
+                    ]
+                    payload = {
+                        "threadId": f"thread-{enabled}", "runId": f"run-{run}", "state": {},
+                        "messages": messages, "tools": [], "context": [], "forwardedProps": {},
+                    }
+                    ttft = first_delta_seconds(client, url, payload)
+                    prompt = fake.last_request_bytes
+                    print(f"{'on' if enabled else 'off':>10} {run + 1:>3} {prompt / 1024:>10.1f} "
+                          f"{prompt // CHARS_PER_TOKEN:>8} {ttft * 1000:>8.1f}")
+        finally:
+            stop_server(server)
+
+
+if __name__ == "__main__":
+    main()
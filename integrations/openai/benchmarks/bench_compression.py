@@ -0,0 +1,153 @@
+"""
+Bytes on the wire and CPU per frame of compressed SSE streams.
+
+Builds the frames of a synthetic run the way the streaming loop writes them
+(``ChunkBatcher``): a ``--tokens`` token answer, unbatched and batched,
+followed by a tool call whose arguments carry ``--tool-kib`` KiB of JSON, as
+a search or retrieval tool would. Each encoding compresses the frames one by
+one with a flush after every frame, as ``ResponseCompression`` does, and the
+script reports the bytes written, the ratio to the uncompressed stream and
+CPU per frame. The same frames compressed as one body (no flushes) show
+what per-frame flushing costs in size.
+
+Then it starts ``example_server.serve`` with compression on against the fake
+upstream and streams runs with and without ``Accept-Encoding``, checking
+that the decoded text matches and reporting bytes downloaded and TTFT.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_compression
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+import httpx
+from ag_ui.encoder import EventEncoder
+
+from example_server.compression import BrotliCompressor, GzipCompressor, available_encodings
+from example_server.streaming import ChunkBatcher
+from .bench_concurrency import run_input
+from .bench_workers import start_server, stop_server
+from .fake_openai import FakeOpenAI, free_port, serve_in_thread
+
+WORDS = (
+    "the model streams tokens to the client as soon as they arrive and every "
+    "frame carries its event type message id and a short delta of text while "
+    "tool calls send their arguments in pieces"
+).split()
+
+
+def run_frames(tokens: int, tool_kib: int, batched: bool) -> list:
+    """Frames of one run: a streamed answer and a tool call with large arguments."""
+    rng = random.Random(0)
+    batcher = ChunkBatcher(
+        EventEncoder(), "5f0c2a4e-8d1b-4c3e-9a6f-2b7d1e0c9a84",
+        max_chars=512 if batched else 0, max_delay=0.02 if batched else 0,
+    )
+    frames = []
+    for _ in range(tokens):
+        frames.extend(batcher.text(rng.choice(WORDS) + " "))
+    arguments = json.dumps({"results": [
+        {"title": " ".join(rng.choices(WORDS, k=6)), "url": f"https://example.com/{i}",
+         "snippet": " ".join(rng.choices(WORDS, k=30))}
+        for i in range(tool_kib * 4)
+    ]})
+    frames.extend(batcher.tool_call_start("call_0", "search"))
+    for start in range(0, len(arguments), 64):
+        frames.extend(batcher.tool_call_args("call_0", arguments[start:start + 64]))
+    frames.extend(batcher.tool_call_end("call_0"))
+    frames.extend(batcher.flush())
+    return [frame.encode() if isinstance(frame, str) else frame for frame in frames]
+
+
+def compressors() -> list:
+    """Name and factory of every compressor measured."""
+    measured = [(f"gzip-{level}", lambda level=level: GzipCompressor(level)) for level in (1, 6, 9)]
+    if "br" in available_encodings():
+        measured += [(f"br-{quality}", lambda quality=quality: BrotliCompressor(quality)) for quality in (4, 5, 8)]
+    return measured
+
+
+def measure(frames: list, make, repeat: int) -> tuple[int, int, float]:
+    """Bytes per-frame flushed, bytes as one body and CPU microseconds per frame."""
+    start = time.process_time()
+    for _ in range(repeat):
+        compressor = make()
+        flushed = sum(len(compressor.compress(frame)) for frame in frames) + len(compressor.finish())
+    cpu = (time.process_time() - start) / repeat / len(frames) * 1e6
+    whole = make()
+    body = len(whole.compress(b"".join(frames))) + len(whole.finish())
+    return flushed, body, cpu
+
+
+async def stream(url: str, i: int, accept_encoding: str) -> tuple[float, int, str, str]:
+    """TTFT, bytes downloaded, decoded text and content encoding of one run."""
+    headers = {"accept": "text/event-stream", "accept-encoding": accept_encoding}
+    started = time.perf_counter()
+    ttft = None
+    text = ""
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream("POST", url, json=run_input(i), headers=headers) as response:
+            response.raise_for_status()
+            encoding = response.headers.get("content-encoding", "identity")
+            async for line in response.aiter_lines():
+                if '"TEXT_MESSAGE_CHUNK"' in line:
+                    ttft = ttft if ttft is not None else time.perf_counter() - started
+                    text += json.loads(line[len("data: "):])["delta"]
+            return ttft, response.num_bytes_downloaded, text, encoding
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--tool-kib", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{args.tokens} tokens and a tool call with {args.tool_kib} KiB of arguments")
+    print(f"{'frames':>9} {'encoding':>9} {'frames':>6} {'bytes':>8} {'ratio':>6} {'as body':>8} {'CPU us/frame':>12}")
+    for batched in (False, True):
+        frames = run_frames(args.tokens, args.tool_kib, batched)
+        size = sum(len(frame) for frame in frames)
+        label = "batched" if batched else "unbatched"
+        print(f"{label:>9} {'identity':>9} {len(frames):>6} {size:>8} {1:>6.2f} {size:>8} {0:>12.2f}")
+        for name, make in compressors():
+            flushed, body, cpu = measure(frames, make, args.repeat)
+            print(f"{label:>9} {name:>9} {len(frames):>6} {flushed:>8} {flushed / size:>6.2f} {body:>8} {cpu:>12.2f}")
+    if "br" not in available_encodings():
+        print("(br not measured: the brotli package is not installed)")
+
+    fake = FakeOpenAI(tokens=200, token_delay=0.002)
+    fake_port = free_port()
+    serve_in_thread(fake.app, fake_port)
+    os.environ["COMPRESSION_ENABLED"] = "true"
+    server, url = start_server(1, fake_port)
+    failed = False
+    print(f"\nserver, {args.runs} runs of {fake.tokens} tokens")
+    print(f"{'accept-encoding':>15} {'content-encoding':>16} {'bytes/run':>9} {'TTFT p50 ms':>11} {'ok':>4}")
+    try:
+        for accept_encoding in ("identity", *available_encodings()):
+            results = [asyncio.run(stream(url, i, accept_encoding)) for i in range(args.runs)]
+            ok = all(text == fake.token_text * fake.tokens for _, _, text, _ in results)
+            ok &= all(encoding == accept_encoding for _, _, _, encoding in results)
+            failed |= not ok
+            ttfts = sorted(ttft for ttft, _, _, _ in results)
+            print(f"{accept_encoding:>15} {results[0][3]:>16} "
+                  f"{sum(size for _, size, _, _ in results) // len(results):>9} "
+                  f"{ttfts[len(ttfts) // 2] * 1000:>11.1f} {'yes' if ok else 'NO':>4}")
+    finally:
+        stop_server(server)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
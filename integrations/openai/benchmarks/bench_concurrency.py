@@ -0,0 +1,81 @@
+"""
+Concurrency benchmark for the ``/`` AG-UI endpoint.
+
+Runs the example server against a local fake OpenAI-compatible upstream and
+fires increasing numbers of simultaneous chats. Each chat takes roughly
+``tokens * token_delay`` seconds upstream, so if the event loop is never
+blocked the wall time of a batch stays close to that single-chat duration and
+the "concurrent chats" column tracks the batch size.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_concurrency
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from .fake_openai import FakeOpenAI, free_port, serve_in_thread
+
+
+def run_input(i: int) -> dict:
+    return {
+        "threadId": f"thread-{i}",
+        "runId": f"run-{i}",
+        "state": {},
+        "messages": [{"id": f"msg-{i}", "role": "user", "content": "Hello"}],
+        "tools": [],
+        "context": [],
+        "forwardedProps": {},
+    }
+
+
+async def one_chat(client: httpx.AsyncClient, url: str, i: int) -> float:
+    start = time.perf_counter()
+    async with client.stream("POST", url, json=run_input(i), headers={"accept": "text/event-stream"}) as response:
+        response.raise_for_status()
+        async for _ in response.aiter_bytes():
+            pass
+    return time.perf_counter() - start
+
+
+async def run_level(url: str, concurrency: int) -> tuple[float, float]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        start = time.perf_counter()
+        durations = await asyncio.gather(*(one_chat(client, url, i) for i in range(concurrency)))
+        wall = time.perf_counter() - start
+    return wall, sum(durations) / wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--levels", default="1,8,32,128")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(tokens=args.tokens, token_delay=args.token_delay)
+    fake_port = free_port()
+    serve_in_thread(fake.app, fake_port)
+
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{fake_port}/"
+    from example_server import app
+
+    app_port = free_port()
+    serve_in_thread(app, app_port)
+    url = f"http://127.0.0.1:{app_port}/"
+
+    print(f"single chat upstream time ~{args.tokens * args.token_delay:.2f}s")
+    print(f"{'chats':>6} {'wall s':>8} {'concurrent chats':>17}")
+    for level in (int(x) for x in args.levels.split(",")):
+        wall, concurrent = asyncio.run(run_level(url, level))
+        print(f"{level:>6} {wall:>8.2f} {concurrent:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Checks that an abandoned ``/`` stream cancels its upstream completion.
+
+A client reads the first few frames from a deliberately slow fake upstream
+and then drops the connection. The script reports how long it took for the
+fake upstream to see its stream aborted and fails if that exceeds
+``--bound`` seconds.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_disconnect
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+from .bench_concurrency import run_input
+from .fake_openai import FakeOpenAI, free_port, serve_in_thread
+
+
+async def abandon(url: str, frames: int) -> float:
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream("POST", url, json=run_input(0)) as response:
+            seen = 0
+            async for _ in response.aiter_lines():
+                seen += 1
+                if seen >= frames:
+                    break
+    return time.monotonic()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--token-delay", type=float, default=0.2)
+    parser.add_argument("--bound", type=float, default=1.0)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(tokens=1000, token_delay=args.token_delay)
+    fake_port = free_port()
+    serve_in_thread(fake.app, fake_port)
+
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{fake_port}/"
+    os.environ["AGUI_BATCH_MAX_DELAY_MS"] = "0"
+    os.environ["AGUI_BATCH_MAX_CHARS"] = "0"
+    from example_server import app
+    from example_server.disconnect import stats
+
+    app_port = free_port()
+    serve_in_thread(app, app_port)
+    url = f"http://127.0.0.1:{app_port}/"
+
+    worst = 0.0
+    for run in range(args.runs):
+        aborted_before = fake.aborted_streams
+        dropped_at = asyncio.run(abandon(url, frames=6))
+        while fake.aborted_streams == aborted_before:
+            if time.monotonic() - dropped_at > args.bound * 5:
+                sys.exit(f"run {run}: upstream stream was never cancelled")
+            time.sleep(0.005)
+        latency = max(0.0, fake.last_abort - dropped_at)
+        worst = max(worst, latency)
+        print(f"run {run}: upstream cancelled {latency * 1000:.0f} ms after disconnect")
+
+    print("disconnect stats:", stats.as_dict())
+    if worst > args.bound:
+        sys.exit(f"worst cancellation latency {worst:.3f}s exceeds bound {args.bound}s")
+    print(f"ok: worst cancellation latency {worst * 1000:.0f} ms <= {args.bound * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+CPU per streamed token of AG-UI event encoding in the OpenAI streaming loop.
+
+Feeds pre-parsed ``ChatCompletionChunk`` objects through the per-chunk
+encoding path the endpoint used before batching and through
+``ChunkBatcher`` with and without the ``model_construct`` fast path.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_encoding
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from ag_ui.core import EventType
+from ag_ui.core.events import TextMessageChunkEvent
+from ag_ui.encoder import EventEncoder
+from openai.types.chat import ChatCompletionChunk
+
+from example_server.flush_deadline import iter_with_flush_deadline
+from example_server.streaming import ChunkBatcher
+
+
+def make_chunks(tokens: int) -> list[ChatCompletionChunk]:
+    return [
+        ChatCompletionChunk.model_validate({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "bench",
+            "choices": [{"index": 0, "delta": {"content": "tok "}, "finish_reason": None}],
+        })
+        for _ in range(tokens)
+    ]
+
+
+async def aiter(items):
+    for item in items:
+        yield item
+
+
+async def per_chunk(chunks) -> int:
+    encoder = EventEncoder()
+    frames = 0
+    async for chunk in aiter(chunks):
+        encoder.encode(
+            TextMessageChunkEvent(
+                type=EventType.TEXT_MESSAGE_CHUNK,
+                message_id="msg-1",
+                delta=chunk.choices[0].delta.content,
+            )
+        )
+        frames += 1
+    return frames
+
+
+def batched(max_chars: int, max_delay: float, validate: bool):
+    async def run(chunks) -> int:
+        batcher = ChunkBatcher(EventEncoder(), "msg-1", max_chars, max_delay, validate)
+        source = aiter(chunks)
+        stream = iter_with_flush_deadline(source, batcher) if max_delay else source
+        frames = 0
+        async for chunk in stream:
+            if chunk is None:
+                frames += len(batcher.flush())
+                continue
+            frames += len(batcher.text(chunk.choices[0].delta.content))
+        frames += len(batcher.flush())
+        return frames
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=50_000)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.tokens)
+    cases = [
+        ("per-chunk (previous)", per_chunk),
+        ("batched, validated", batched(512, 0.02, True)),
+        ("batched, fast path", batched(512, 0.02, False)),
+        ("unbatched, fast path", batched(0, 0.0, False)),
+    ]
+    print(f"{'mode':>22} {'frames':>8} {'CPU us/token':>13}")
+    for name, run in cases:
+        start = time.process_time()
+        frames = asyncio.run(run(chunks))
+        cpu = time.process_time() - start
+        print(f"{name:>22} {frames:>8} {cpu / args.tokens * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
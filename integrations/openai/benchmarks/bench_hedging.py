@@ -0,0 +1,110 @@
+"""
+Time to first token with and without hedged upstream requests.
+
+Starts ``example_server.serve`` as a subprocess against a local fake
+OpenAI-compatible upstream where a ``--slow-fraction`` of completions, drawn
+at random, take ``--slow-delay`` extra seconds before their first token. A
+closed loop of ``--concurrency`` clients streams ``--streams`` runs with
+hedging off, on against the same upstream, and on against an alternate
+upstream that is never slow (``HEDGE_BASE_URL``). Reports TTFT p50/p95/p99,
+upstream requests per run, and the hedges, hedge wins and wasted tokens
+counted on ``/metrics``.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_hedging
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import re
+
+import httpx
+
+from .bench_concurrency import run_input
+from .bench_workers import start_server, stop_server
+from .fake_openai import FakeOpenAI, free_port, serve_in_thread
+from .loadgen import drive, percentile
+
+TEXT_MARKERS = ('"TEXT_MESSAGE_CHUNK"', '"TEXT_MESSAGE_CONTENT"')
+
+HEDGE_METRICS = (
+    "upstream_hedges_total",
+    "upstream_hedge_wins_total",
+    "upstream_hedge_wasted_tokens_total",
+    "upstream_hedge_wasted_prompt_tokens_total",
+)
+
+
+def scrape(url: str) -> dict:
+    text = httpx.get(url + "metrics").text
+    values = {}
+    for name in HEDGE_METRICS:
+        match = re.search(rf"^{name} (\S+)$", text, re.MULTILINE)
+        values[name] = int(float(match.group(1))) if match else 0
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--streams", type=int, default=600)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--slow-fraction", type=float, default=0.05)
+    parser.add_argument("--slow-delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    fakes = []
+    for slow_fraction in (args.slow_fraction, 0.0):
+        fake = FakeOpenAI(
+            tokens=args.tokens, token_delay=args.token_delay,
+            slow_fraction=slow_fraction, slow_delay=args.slow_delay,
+        )
+        port = free_port()
+        serve_in_thread(fake.app, port)
+        fakes.append((fake, port))
+    (fake, fake_port), (alternate, alternate_port) = fakes
+    headers = {"accept": "text/event-stream"}
+    ids = itertools.count()
+
+    def make_body(_: int) -> dict:
+        return run_input(next(ids))
+
+    print(f"{args.streams} runs, {args.concurrency} concurrent, {args.slow_fraction:.0%} of completions "
+          f"{args.slow_delay * 1000:g} ms slow to start")
+    print(f"{'hedging':>9} {'TTFT p50 ms':>11} {'p95':>7} {'p99':>7} {'req/run':>7} "
+          f"{'hedges':>6} {'wins':>5} {'wasted tok':>10} {'prompt tok':>10}")
+    for name, env in (
+        ("off", {"HEDGE_ENABLED": "false"}),
+        ("on", {"HEDGE_ENABLED": "true"}),
+        ("alternate", {"HEDGE_ENABLED": "true", "HEDGE_BASE_URL": f"http://127.0.0.1:{alternate_port}/"}),
+    ):
+        os.environ.pop("HEDGE_BASE_URL", None)
+        os.environ.update(env)
+        server, url = start_server(1, fake_port)
+        try:
+            # Fills the server's latency window before the measured runs
+            asyncio.run(drive(url, make_body, args.concurrency, 100, TEXT_MARKERS, headers))
+            before = scrape(url)
+            requests = fake.requests + alternate.requests
+            _, timings, errors = asyncio.run(drive(
+                url, make_body, args.concurrency, args.streams, TEXT_MARKERS, headers
+            ))
+            requests = fake.requests + alternate.requests - requests
+            after = scrape(url)
+        finally:
+            stop_server(server)
+        counted = {metric: after[metric] - before[metric] for metric in HEDGE_METRICS}
+        ttfts = [timing.ttft for timing in timings]
+        print(f"{name:>9} {percentile(ttfts, 50) * 1000:>11.1f} {percentile(ttfts, 95) * 1000:>7.1f} "
+              f"{percentile(ttfts, 99) * 1000:>7.1f} {requests / len(timings):>7.3f} "
+              f"{counted['upstream_hedges_total']:>6} {counted['upstream_hedge_wins_total']:>5} "
+              f"{counted['upstream_hedge_wasted_tokens_total']:>10} "
+              f"{counted['upstream_hedge_wasted_prompt_tokens_total']:>10}"
+              + (f"  ({errors} errors)" if errors else ""))
+
+
+if __name__ == "__main__":
+    main()
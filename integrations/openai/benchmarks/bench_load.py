@@ -0,0 +1,90 @@
+"""
+End-to-end load and latency of the ``/`` endpoint.
+
+Starts ``example_server.serve`` as a subprocess (``--workers`` workers)
+against a fake OpenAI-compatible upstream in its own process, which streams
+``--tokens`` tokens ``--token-delay`` seconds apart followed by
+``--tool-calls`` parallel tool calls. At each ``--concurrency`` level a
+closed loop of clients streams ``--streams`` runs and the script reports:
+
+- time to the first text frame (TTFT) and the gap between text frames,
+  p50/p99 (frames may carry several tokens when batching is on)
+- streams per second
+- server CPU per upstream token (launcher and workers, from ``/proc``)
+- resident memory per in-flight stream: peak during the level minus idle,
+  divided by the concurrency
+
+``--output`` writes the results with the commit and parameters as JSON, so
+runs of different commits can be compared.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_load --output load.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+
+from .bench_concurrency import run_input
+from .bench_workers import start_server, start_upstream, stop_server
+from .loadgen import ProcessTree, RssSampler, drive, level_result, write_report
+
+TEXT_MARKERS = ('"TEXT_MESSAGE_CHUNK"', '"TEXT_MESSAGE_CONTENT"')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--tool-calls", type=int, default=0)
+    parser.add_argument("--concurrency", default="1,16,64")
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    upstream, upstream_port = start_upstream(args.tokens, args.token_delay, args.tool_calls)
+    server, url = start_server(args.workers, upstream_port)
+    tree = ProcessTree(server.pid)
+    headers = {"accept": "text/event-stream"}
+    # Fresh ids for every stream, so no run is replayed or resumed from an
+    # earlier one
+    ids = itertools.count()
+
+    def make_body(_: int) -> dict:
+        return run_input(next(ids))
+
+    results = []
+    try:
+        # Warm up connections and every worker's imports
+        asyncio.run(drive(url, make_body, 4, 8, TEXT_MARKERS, headers))
+        time.sleep(0.5)
+        print(f"{'endpoint':>8} {'clients':>7} {'streams/s':>9} {'TTFT p50':>9} {'p99':>8} "
+              f"{'ITL p50':>8} {'p99':>8} {'CPU us/tok':>10} {'RSS MiB/stream':>14} {'errors':>6}")
+        for concurrency in (int(x) for x in args.concurrency.split(",")):
+            rss_idle = tree.rss_bytes()
+            cpu_before = tree.cpu_seconds()
+            with RssSampler(tree) as rss:
+                wall, timings, errors = asyncio.run(drive(
+                    url, make_body, concurrency, max(args.streams, concurrency), TEXT_MARKERS, headers
+                ))
+            result = {"endpoint": "/", **level_result(
+                concurrency, wall, timings, errors, tree.cpu_seconds() - cpu_before,
+                args.tokens, rss_idle, rss.peak,
+            )}
+            results.append(result)
+            print(f"{'/':>8} {concurrency:>7} {result['streams_per_second']:>9} "
+                  f"{result['ttft_ms']['p50']:>9} {result['ttft_ms']['p99']:>8} "
+                  f"{result['inter_token_ms']['p50']:>8} {result['inter_token_ms']['p99']:>8} "
+                  f"{result['cpu_us_per_token']:>10} {result['rss_mib_per_stream']:>14} {errors:>6}")
+    finally:
+        stop_server(server)
+        upstream.terminate()
+
+    if args.output:
+        write_report(args.output, "openai", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Cost of the hot-path instrumentation.
+
+Times ``StreamMeter.tick`` (one histogram observation per model token), a
+labelled histogram observation, a ``Timer`` block and rendering ``/metrics``,
+so the per-token overhead can be compared with the per-token budget of a
+stream.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_metrics
+"""
+
+import argparse
+import os
+import timeit
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from example_server import metrics
+from example_server.disconnect import StreamMeter
+
+
+def per_call_ns(stmt, number: int) -> float:
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=200_000)
+    args = parser.parse_args()
+
+    meter = StreamMeter()
+    meter.tick()
+    series = metrics.stage_seconds.labels("bench")
+
+    def timed_block():
+        with metrics.Timer(series):
+            pass
+
+    print(f"{'operation':<28} {'ns/call':>9}")
+    print(f"{'StreamMeter.tick':<28} {per_call_ns(meter.tick, args.number):>9.0f}")
+    print(f"{'histogram observe':<28} {per_call_ns(lambda: series.observe(0.003), args.number):>9.0f}")
+    print(f"{'Timer block':<28} {per_call_ns(timed_block, args.number):>9.0f}")
+    print(f"{'registry.render':<28} {per_call_ns(metrics.registry.render, 1000):>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Decoding cost of large ``RunAgentInput`` bodies.
+
+Builds threads of about 1 MB and 10 MB of messages and times, per body:
+
+- ``loads+validate``: ``json.loads`` then ``RunAgentInput.model_validate``
+  (the previous request path)
+- ``one-pass``: ``decode_run_input`` without a thread cache
+  (``model_validate_json`` on the raw bytes)
+- ``next turn``: ``decode_run_input`` with a ``ThreadPrefixCache`` holding
+  the previous turn of the thread, for a body that appends a user message
+  and an assistant reply
+
+plus converting the messages to OpenAI's format, from scratch and through
+the thread cache.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_run_input
+"""
+
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from ag_ui.core import RunAgentInput
+
+from example_server import to_openai_message
+from example_server.run_input import ThreadPrefixCache, decode_run_input
+
+
+def thread_messages(target_bytes: int) -> list:
+    messages = []
+    size = 0
+    while size < target_bytes:
+        i = len(messages)
+        message = {"id": f"msg-{i}", "role": "user" if i % 2 == 0 else "assistant",
+                   "content": "lorem ipsum dolor sit amet " * 20}
+        if i % 6 == 1:
+            message["toolCalls"] = [{
+                "id": f"call-{i}",
+                "type": "function",
+                "function": {"name": "get_weather", "arguments": json.dumps({"city": "Paris"})},
+            }]
+        messages.append(message)
+        size += len(json.dumps(message))
+    return messages
+
+
+def body(messages: list, run: int) -> bytes:
+    return json.dumps({
+        "threadId": "thread-1",
+        "runId": f"run-{run}",
+        "state": {"items": list(range(100))},
+        "messages": messages,
+        "tools": [{"name": "get_weather", "description": "Weather for a city",
+                   "parameters": {"type": "object", "properties": {"city": {"type": "string"}}}}],
+        "context": [],
+        "forwardedProps": {},
+    }).encode()
+
+
+def best_of(repeat: int, function) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes-mb", default="1,10")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'body':>8} {'messages':>8} {'loads+validate ms':>17} {'one-pass ms':>11} "
+          f"{'next turn ms':>12} {'convert ms':>10} {'convert cached ms':>17}")
+    for size_mb in (float(x) for x in args.sizes_mb.split(",")):
+        history = thread_messages(int(size_mb * 1024 * 1024))
+        previous = body(history, 1)
+        turn = history + [
+            {"id": "msg-new-user", "role": "user", "content": "And tomorrow?"},
+            {"id": "msg-new-reply", "role": "assistant", "content": "Sunny."},
+        ]
+        current = body(turn, 2)
+
+        baseline = best_of(args.repeat, lambda: RunAgentInput.model_validate(json.loads(current)))
+        one_pass = best_of(args.repeat, lambda: decode_run_input(current))
+
+        def next_turn():
+            cache = ThreadPrefixCache(max_bytes=1 << 30)
+            decode_run_input(previous, cache)
+            started = time.perf_counter()
+            decode_run_input(current, cache)
+            return time.perf_counter() - started
+
+        cached = min(next_turn() for _ in range(args.repeat)) * 1000
+
+        run_input = decode_run_input(current)
+        convert = best_of(args.repeat, lambda: [to_openai_message(m) for m in run_input.messages])
+
+        def convert_next_turn():
+            cache = ThreadPrefixCache(max_bytes=1 << 30)
+            first = decode_run_input(previous, cache)
+            cache.derive(first.thread_id, first.messages, to_openai_message)
+            second = decode_run_input(current, cache)
+            started = time.perf_counter()
+            cache.derive(second.thread_id, second.messages, to_openai_message)
+            return time.perf_counter() - started
+
+        convert_cached = min(convert_next_turn() for _ in range(args.repeat)) * 1000
+        print(f"{len(current) / 1024 / 1024:>6.1f}MB {len(turn):>8} {baseline:>17.1f} {one_pass:>11.1f} "
+              f"{cached:>12.1f} {convert:>10.1f} {convert_cached:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
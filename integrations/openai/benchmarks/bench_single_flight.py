@@ -0,0 +1,134 @@
+"""
+Upstream streams opened for bursts of identical requests, with and without
+single-flight sharing.
+
+Starts ``example_server.serve`` as a subprocess against a local fake
+OpenAI-compatible upstream and sends ``--clients`` identical runs, spread
+over the first ``--spread`` seconds of the first run's stream so that later
+ones join a run in progress. Reports the upstream requests opened, wall time
+and time to first text frame, and checks that every client received the
+whole answer under its own message id. Finally it checks that a client that
+disconnects leaves the shared stream running for the others, and that the
+upstream stream is aborted once every client is gone.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_single_flight
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+from .bench_concurrency import run_input
+from .bench_workers import start_server, stop_server
+from .fake_openai import FakeOpenAI, free_port, serve_in_thread
+from .loadgen import percentile
+
+
+async def one_run(client: httpx.AsyncClient, url: str, i: int, delay: float) -> tuple[float, str, set]:
+    await asyncio.sleep(delay)
+    started = time.perf_counter()
+    ttft = None
+    text = ""
+    message_ids = set()
+    async with client.stream("POST", url, json=run_input(i), headers={"accept": "text/event-stream"}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if '"TEXT_MESSAGE_CHUNK"' in line:
+                ttft = ttft if ttft is not None else time.perf_counter() - started
+                event = json.loads(line[len("data: "):])
+                text += event["delta"]
+                message_ids.add(event["messageId"])
+    return ttft, text, message_ids
+
+
+async def burst(url: str, clients: int, spread: float) -> tuple[float, list]:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            one_run(client, url, i, spread * i / max(1, clients - 1)) for i in range(clients)
+        ))
+        return time.perf_counter() - started, results
+
+
+async def abandon(url: str, clients: int, after: float, fake: FakeOpenAI) -> bool:
+    """
+    Start identical runs, disconnect all but one after ``after`` seconds and
+    the last one ``after`` seconds later. Returns whether the upstream stream
+    was still running before the last disconnect.
+    """
+    async def read(client: httpx.AsyncClient, i: int):
+        async with client.stream("POST", url, json=run_input(i), headers={"accept": "text/event-stream"}) as response:
+            async for _ in response.aiter_bytes():
+                pass
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        tasks = [asyncio.create_task(read(client, i)) for i in range(clients)]
+        await asyncio.sleep(after)
+        for task in tasks[1:]:
+            task.cancel()
+        await asyncio.sleep(after)
+        running = fake.active_streams == 1
+        tasks[0].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return running
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--spread", type=float, default=0.5)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(tokens=args.tokens, token_delay=args.token_delay)
+    fake_port = free_port()
+    serve_in_thread(fake.app, fake_port)
+    expected = fake.token_text * args.tokens
+
+    failed = False
+    print(f"{args.clients} identical runs over {args.spread:g}s, {args.tokens} tokens "
+          f"{args.token_delay * 1000:g} ms apart")
+    print(f"{'single flight':>13} {'upstream':>8} {'wall s':>7} {'TTFT p50 ms':>11} {'p99':>7} {'ok':>4}")
+    for enabled in (False, True):
+        os.environ["SINGLE_FLIGHT_ENABLED"] = str(enabled).lower()
+        server, url = start_server(1, fake_port)
+        try:
+            before = fake.requests
+            wall, results = asyncio.run(burst(url, args.clients, args.spread))
+            upstream = fake.requests - before
+            ttfts = [ttft for ttft, _, _ in results if ttft is not None]
+            message_ids = [ids for _, _, ids in results]
+            ok = (
+                all(text == expected for _, text, _ in results)
+                and all(len(ids) == 1 for ids in message_ids)
+                and len(set().union(*message_ids)) == args.clients
+            )
+            failed |= not ok
+            print(f"{'on' if enabled else 'off':>13} {upstream:>8} {wall:>7.2f} "
+                  f"{percentile(ttfts, 50) * 1000:>11.1f} {percentile(ttfts, 99) * 1000:>7.1f} "
+                  f"{'yes' if ok else 'NO':>4}")
+
+            if enabled:
+                aborted = fake.aborted_streams
+                survived = asyncio.run(abandon(url, 4, args.tokens * args.token_delay / 4, fake))
+                time.sleep(0.5)
+                cancelled = survived and fake.aborted_streams - aborted == 1 and fake.active_streams == 0
+                failed |= not cancelled
+                print(f"shared stream survived early disconnects and was aborted after the last: "
+                      f"{'yes' if cancelled else 'NO'}")
+        finally:
+            stop_server(server)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Thread store benchmark: resending the full history vs. only new messages.
+
+Starts ``example_server.serve`` as a subprocess with the thread store enabled
+(once per backend) against a local fake OpenAI-compatible upstream, and plays
+one long conversation twice: once resending the whole thread every turn, once
+sending only the new messages after the ``X-Thread-Version`` of the previous
+response. Prints, at a few turn counts, the request body size and the time
+until the response headers arrive (reading and decoding the body, and
+merging it with the stored history).
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_thread_store
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+import httpx
+
+from .bench_workers import start_server, stop_server
+from .fake_openai import FakeOpenAI, free_port, serve_in_thread
+
+
+def turn_messages(turn: int, chars: int) -> list:
+    """The assistant reply to the previous turn (if any) and the next user message."""
+    messages = []
+    if turn:
+        messages.append({"id": f"reply-{turn - 1}", "role": "assistant", "content": "lorem " * (chars // 6)})
+    messages.append({"id": f"user-{turn}", "role": "user", "content": "ipsum " * (chars // 6)})
+    return messages
+
+
+def body(thread_id: str, turn: int, messages: list) -> dict:
+    return {
+        "threadId": thread_id,
+        "runId": f"run-{turn}",
+        "state": {},
+        "messages": messages,
+        "tools": [],
+        "context": [],
+        "forwardedProps": {},
+    }
+
+
+def play(client: httpx.Client, url: str, thread_id: str, turns: int, chars: int, delta: bool) -> list:
+    """Per-turn ``(body bytes, seconds to headers)`` of one conversation."""
+    history: list = []
+    version = None
+    results = []
+    for turn in range(turns):
+        new = turn_messages(turn, chars)
+        history.extend(new)
+        headers = {"accept": "text/event-stream"}
+        if delta and version is not None:
+            headers["x-thread-version"] = version
+            content = httpx.Request("POST", url, json=body(thread_id, turn, new)).content
+        else:
+            content = httpx.Request("POST", url, json=body(thread_id, turn, history)).content
+        headers["content-type"] = "application/json"
+        started = time.perf_counter()
+        with client.stream("POST", url, content=content, headers=headers) as response:
+            elapsed = time.perf_counter() - started
+            response.read()
+        if response.status_code != 200:
+            raise RuntimeError(f"turn {turn}: {response.status_code} {response.text}")
+        version = response.headers["x-thread-version"]
+        results.append((len(content), elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=300)
+    parser.add_argument("--message-chars", type=int, default=2000)
+    parser.add_argument("--backends", default="memory,sqlite")
+    parser.add_argument("--report", default="10,100,200,300")
+    args = parser.parse_args()
+    checkpoints = [int(turn) for turn in args.report.split(",")]
+
+    fake = FakeOpenAI(tokens=1, token_delay=0)
+    fake_port = free_port()
+    serve_in_thread(fake.app, fake_port)
+
+    os.environ["THREAD_STORE_ENABLED"] = "true"
+    os.environ["THREAD_STORE_PATH"] = f"/tmp/bench_thread_store_{os.getpid()}.sqlite3"
+    print(f"{'backend':>8} {'turn':>5} {'full KiB':>9} {'full ms':>8} {'delta KiB':>9} {'delta ms':>8}")
+    for backend in args.backends.split(","):
+        os.environ["THREAD_STORE_BACKEND"] = backend
+        server, url = start_server(1, fake_port)
+        try:
+            with httpx.Client(timeout=None) as client:
+                full = play(client, url, f"full-{backend}", args.turns, args.message_chars, delta=False)
+                delta = play(client, url, f"delta-{backend}", args.turns, args.message_chars, delta=True)
+        finally:
+            stop_server(server)
+        for turn in checkpoints:
+            if turn > args.turns:
+                continue
+            # Median of the few turns up to the checkpoint smooths out noise
+            window = slice(max(0, turn - 5), turn)
+            print(
+                f"{backend:>8} {turn:>5} {full[turn - 1][0] / 1024:>9.1f} "
+                f"{statistics.median(seconds for _, seconds in full[window]) * 1000:>8.2f} "
+                f"{delta[turn - 1][0] / 1024:>9.1f} "
+                f"{statistics.median(seconds for _, seconds in delta[window]) * 1000:>8.2f}"
+            )
+    if os.path.exists(os.environ["THREAD_STORE_PATH"]):
+        os.remove(os.environ["THREAD_STORE_PATH"])
+
+
+if __name__ == "__main__":
+    main()
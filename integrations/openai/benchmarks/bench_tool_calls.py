@@ -0,0 +1,184 @@
+"""
+Correctness and CPU cost of tool-call streaming in the OpenAI streaming loop.
+
+Replays the recorded upstream streams in ``recorded/tool_calls.jsonl``
+(parallel calls one after the other, interleaved calls with several deltas
+per chunk, Gemini's OpenAI compatibility without ``index``, and an id that
+arrives after the arguments) through ``ToolCallAssembler`` and checks the
+AG-UI events it writes: every call is started once with its id and name, its
+arguments arrive between its start and end, and they join to the recorded
+arguments. The previous loop, which read only the first tool-call delta of a
+chunk, is replayed too for comparison. Exits with status 1 on a mismatch.
+
+Then measures CPU per chunk on synthetic streams of ``--calls`` calls, one
+after the other and interleaved, with and without batching and with
+validated events.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_tool_calls
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from ag_ui.encoder import EventEncoder
+from openai.types.chat import ChatCompletionChunk
+
+from example_server.streaming import ChunkBatcher, ToolCallAssembler
+
+RECORDED = Path(__file__).parent / "recorded" / "tool_calls.jsonl"
+
+
+def to_chunks(choices: list) -> list:
+    # construct() builds the models without validation, as the SDK does for
+    # streamed chunks, so deltas without an ``index`` load as they arrive
+    return [
+        ChatCompletionChunk.construct(
+            id="chatcmpl-recorded", object="chat.completion.chunk", created=0, model="recorded",
+            choices=[{"index": 0, "finish_reason": None, **choice}],
+        )
+        for choice in choices
+    ]
+
+
+def stream_frames(chunks: list, validate: bool = False, batched: bool = True) -> list:
+    """The frames the streaming loop writes for ``chunks``."""
+    batcher = ChunkBatcher(
+        EventEncoder(), "msg-1",
+        max_chars=512 if batched else 0, max_delay=0.02 if batched else 0, validate=validate,
+    )
+    tool_calls = ToolCallAssembler(batcher)
+    frames = []
+    for chunk in chunks:
+        choice = chunk.choices[0]
+        delta = choice.delta
+        if delta.content:
+            frames.extend(batcher.text(delta.content))
+        if delta.tool_calls:
+            frames.extend(tool_calls.add(delta.tool_calls))
+        if choice.finish_reason is not None:
+            frames.extend(tool_calls.finish())
+    frames.extend(tool_calls.finish())
+    frames.extend(batcher.flush())
+    return frames
+
+
+def check(frames: list, expected: dict) -> list:
+    """Problems in the AG-UI events ``frames``, compared with the recorded stream."""
+    problems = []
+    calls = {}
+    text = ""
+    for frame in frames:
+        event = json.loads(frame[len("data: "):])
+        kind = event["type"]
+        if kind == "TEXT_MESSAGE_CHUNK":
+            text += event["delta"]
+        elif kind == "TOOL_CALL_START":
+            if event["toolCallId"] in calls:
+                problems.append(f"{event['toolCallId']} started twice")
+            calls[event["toolCallId"]] = {"name": event["toolCallName"], "arguments": "", "ended": False}
+        elif kind == "TOOL_CALL_ARGS":
+            call = calls.get(event["toolCallId"])
+            if call is None or call["ended"]:
+                problems.append(f"arguments of {event['toolCallId']} outside its start and end")
+            else:
+                call["arguments"] += event["delta"]
+        elif kind == "TOOL_CALL_END":
+            calls.get(event["toolCallId"], {})["ended"] = True
+    if text != expected["text"]:
+        problems.append(f"text {text!r}, expected {expected['text']!r}")
+    for call in expected["calls"]:
+        got = calls.pop(call["id"], None)
+        if got is None:
+            problems.append(f"{call['id']} missing")
+        elif (got["name"], got["arguments"], got["ended"]) != (call["name"], call["arguments"], True):
+            problems.append(f"{call['id']}: {got}")
+    problems.extend(f"unexpected call {tool_call_id}" for tool_call_id in calls)
+    return problems
+
+
+def previous_calls(chunks: list) -> list:
+    """The calls the previous loop recovered: the first delta of each chunk only."""
+    calls = []
+    for chunk in chunks:
+        tool_calls = chunk.choices[0].delta.tool_calls
+        if not tool_calls:
+            continue
+        tool_call = tool_calls[0]
+        if tool_call.id is not None or not calls:
+            calls.append({"id": tool_call.id, "name": None, "arguments": ""})
+        function = tool_call.function
+        if function is not None:
+            calls[-1]["name"] = calls[-1]["name"] or function.name
+            calls[-1]["arguments"] += function.arguments or ""
+    return calls
+
+
+def synthetic_chunks(calls: int, deltas: int, interleaved: bool) -> list:
+    choices = []
+    for i in range(calls):
+        choices.append({"delta": {"tool_calls": [
+            {"index": i, "id": f"call_{i}", "type": "function", "function": {"name": "search", "arguments": ""}}
+        ]}})
+    order = [(j, i) for j in range(deltas) for i in range(calls)]
+    if not interleaved:
+        order.sort(key=lambda item: item[1])
+    choices += [{"delta": {"tool_calls": [{"index": i, "function": {"arguments": '"abcdef", '}}]}}
+                for _, i in order]
+    choices.append({"delta": {}, "finish_reason": "tool_calls"})
+    return to_chunks(choices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=8)
+    parser.add_argument("--deltas", type=int, default=2_000)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'recorded stream':>16} {'calls':>5} {'previous loop':>13} {'assembler':>9}")
+    for line in RECORDED.read_text().splitlines():
+        recorded = json.loads(line)
+        chunks = to_chunks(recorded["chunks"])
+        expected = {(call["id"], call["name"], call["arguments"]) for call in recorded["calls"]}
+        previous = sum(
+            (call["id"], call["name"], call["arguments"]) in expected for call in previous_calls(chunks)
+        )
+        problems = []
+        for validate in (False, True):
+            for batched in (True, False):
+                problems += check(stream_frames(chunks, validate, batched), recorded)
+        correct = sum(
+            not any(call["id"] in problem for problem in problems) for call in recorded["calls"]
+        )
+        print(f"{recorded['name']:>16} {len(expected):>5} {previous:>13} {correct:>9}")
+        for problem in dict.fromkeys(problems):
+            print(f"    {problem}")
+        failed |= bool(problems)
+
+    print(f"\n{args.calls} calls of {args.deltas} argument deltas each")
+    print(f"{'calls':>11} {'mode':>20} {'frames':>8} {'CPU us/chunk':>13}")
+    for interleaved in (False, True):
+        chunks = synthetic_chunks(args.calls, args.deltas, interleaved)
+        for name, validate, batched in (
+            ("batched, fast path", False, True),
+            ("unbatched, fast path", False, False),
+            ("batched, validated", True, True),
+        ):
+            start = time.process_time()
+            frames = stream_frames(chunks, validate, batched)
+            cpu = time.process_time() - start
+            print(f"{'interleaved' if interleaved else 'sequential':>11} {name:>20} {len(frames):>8} "
+                  f"{cpu / len(chunks) * 1e6:>13.2f}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Connection reuse and time to first token through ``UpstreamTransport``.
+
+Streams completions from a local fake OpenAI-compatible endpoint (its own
+process, reached as ``localhost``) in waves of concurrent requests, once
+with a transport that opens a connection per request and resolves the host
+every time, and once with the shared pool settings the server uses. For
+each it reports the connection reuse rate, DNS lookups and p50/p99 time to
+first token.
+
+Loopback connections are nearly free, so every new connection is delayed by
+``--handshake-ms`` (TCP + TLS round trips to a remote provider) and every
+DNS query by ``--dns-ms``. The fake endpoint shares the machine's CPUs with
+the client, so a ``--concurrency`` that saturates it measures the fake, not
+the transport.
+
+HTTP/2 is used when the ``h2`` package is installed and the endpoint
+supports it; the local fake speaks HTTP/1.1 only.
+
+Usage (from integrations/openai):
+    poetry run python -m benchmarks.bench_transport
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpcore
+import httpx
+from openai import AsyncOpenAI
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from example_server.transport import CachingResolver, UpstreamTransport
+from .bench_workers import start_upstream
+
+
+class SlowResolver(CachingResolver):
+    def __init__(self, ttl: float, delay: float):
+        super().__init__(ttl)
+        self.delay = delay
+
+    async def lookup(self, host: str, port: int):
+        await asyncio.sleep(self.delay)
+        return await super().lookup(host, port)
+
+
+class SlowNetwork(httpcore.AsyncNetworkBackend):
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        await asyncio.sleep(self.delay)
+        return await self._backend.connect_tcp(
+            host, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+        )
+
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+
+async def first_token_time(client: AsyncOpenAI) -> float:
+    start = time.perf_counter()
+    stream = await client.chat.completions.create(
+        model="fake-model",
+        stream=True,
+        messages=[{"role": "user", "content": "Hello"}],
+    )
+    ttft = None
+    async with stream:
+        async for chunk in stream:
+            if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+                ttft = time.perf_counter() - start
+    return ttft
+
+
+async def run_config(base_url: str, transport: UpstreamTransport, waves: int, concurrency: int) -> dict:
+    async with httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(60.0, connect=5.0)) as http_client:
+        client = AsyncOpenAI(api_key="fake", base_url=base_url, http_client=http_client)
+        ttfts = []
+        for _ in range(waves):
+            ttfts.extend(await asyncio.gather(*(first_token_time(client) for _ in range(concurrency))))
+    ttfts.sort()
+    return {
+        "requests": transport.requests,
+        "connections": transport.connections_opened,
+        "reuse": transport.reuse_rate,
+        "dns": transport.network_backend.resolver.misses,
+        "p50": statistics.median(ttfts),
+        "p99": ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--waves", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--handshake-ms", type=float, default=60.0)
+    parser.add_argument("--dns-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    upstream, port = start_upstream(args.tokens, 0.001)
+    base_url = f"http://localhost:{port}/"
+    handshake = args.handshake_ms / 1000
+    dns = args.dns_ms / 1000
+
+    configs = {
+        "connection per request": lambda: UpstreamTransport(
+            max_keepalive_connections=0,
+            resolver=SlowResolver(0, dns),
+            backend=SlowNetwork(handshake),
+        ),
+        "shared pool": lambda: UpstreamTransport(
+            max_keepalive_connections=args.concurrency,
+            resolver=SlowResolver(60.0, dns),
+            backend=SlowNetwork(handshake),
+        ),
+    }
+    print(f"{'transport':<24} {'requests':>8} {'conns':>6} {'reuse':>6} {'dns':>5} {'p50 ms':>7} {'p99 ms':>7}")
+    for label, make_transport in configs.items():
+        result = asyncio.run(run_config(base_url, make_transport(), args.waves, args.concurrency))
+        print(
+            f"{label:<24} {result['requests']:>8} {result['connections']:>6} "
+            f"{result['reuse']:>6.0%} {result['dns']:>5} "
+            f"{result['p50'] * 1000:>7.1f} {result['p99'] * 1000:>7.1f}"
+        )
+    upstream.terminate()
+
+
+if __name__ == "__main__":
+    main()
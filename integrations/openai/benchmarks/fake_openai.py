@@ -0,0 +1,131 @@
+"""
+Fake OpenAI-compatible SSE server used by the benchmarks.
+
+It answers ``POST /chat/completions`` with a deterministic stream of
+``chat.completion.chunk`` objects, sleeping ``token_delay`` seconds between
+tokens to imitate a real model, optionally followed by parallel tool calls
+streamed the way OpenAI does (one call after the other, arguments in
+pieces). A fraction of completions can be made slow to start, standing in
+for the occasional slow upstream response. Nothing here talks to the network
+beyond localhost.
+"""
+
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+
+class FakeOpenAI:
+    """Configurable fake upstream.
+
+    Args:
+        tokens: Number of text tokens streamed per completion
+        token_delay: Seconds to sleep between tokens
+        token_text: Text of every streamed token
+        prefill_per_kib: Extra seconds before the first token per KiB of
+            request body, standing in for prompt processing
+        tool_calls: Number of tool calls streamed after the text
+        slow_fraction: Fraction of completions, drawn at random, whose first
+            token takes ``slow_delay`` extra seconds
+        slow_delay: Extra seconds before the first token of a slow completion
+        seed: Seed of the draws of slow completions
+    """
+
+    def __init__(
+        self,
+        tokens: int = 50,
+        token_delay: float = 0.01,
+        token_text: str = "lorem ",
+        prefill_per_kib: float = 0.0,
+        tool_calls: int = 0,
+        slow_fraction: float = 0.0,
+        slow_delay: float = 0.0,
+        seed: int = 0,
+    ):
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.token_text = token_text
+        self.prefill_per_kib = prefill_per_kib
+        self.tool_calls = tool_calls
+        self.slow_fraction = slow_fraction
+        self.slow_delay = slow_delay
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.last_request_bytes = 0
+        self.active_streams = 0
+        self.peak_streams = 0
+        self.aborted_streams = 0
+        self.last_abort = 0.0
+        self.app = Starlette(routes=[Route("/chat/completions", self.completions, methods=["POST"])])
+
+    def _chunk(self, delta: dict, finish_reason=None) -> str:
+        return "data: {}\n\n".format(json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "fake-model",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }))
+
+    async def completions(self, request: Request):
+        body = await request.body()
+        self.requests += 1
+        self.last_request_bytes = len(body)
+        prefill = self.prefill_per_kib * len(body) / 1024
+        if self.slow_fraction and self.random.random() < self.slow_fraction:
+            prefill += self.slow_delay
+
+        async def stream():
+            self.active_streams += 1
+            self.peak_streams = max(self.peak_streams, self.active_streams)
+            completed = False
+            try:
+                yield self._chunk({"role": "assistant", "content": ""})
+                if prefill:
+                    await asyncio.sleep(prefill)
+                for _ in range(self.tokens):
+                    await asyncio.sleep(self.token_delay)
+                    yield self._chunk({"content": self.token_text})
+                for index in range(self.tool_calls):
+                    yield self._chunk({"tool_calls": [{
+                        "index": index, "id": f"call_{index}", "type": "function",
+                        "function": {"name": "get_weather", "arguments": ""},
+                    }]})
+                    for piece in ('{"city": ', f'"city {index}"', "}"):
+                        await asyncio.sleep(self.token_delay)
+                        yield self._chunk({"tool_calls": [{"index": index, "function": {"arguments": piece}}]})
+                yield self._chunk({}, finish_reason="tool_calls" if self.tool_calls else "stop")
+                yield "data: [DONE]\n\n"
+                completed = True
+            finally:
+                self.active_streams -= 1
+                if not completed:
+                    self.aborted_streams += 1
+                    self.last_abort = time.monotonic()
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def free_port() -> int:
+    """Return a free localhost TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    """Start ``app`` with uvicorn on a daemon thread and wait until it accepts requests."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
@@ -0,0 +1,236 @@
+"""
+Streaming load generator and process statistics for the load benchmarks.
+
+``drive`` runs a closed loop of concurrent clients, each posting streaming
+requests back to back and timing the frames of every response: time to the
+first content frame and the gaps between content frames. ``ProcessTree``
+reads the CPU time and resident memory of a server and its worker processes
+from ``/proc`` (Linux only); ``RssSampler`` records the peak while a load
+runs. ``level_result`` condenses one load level into a JSON-ready dict and
+``write_report`` saves a run's levels with the commit and parameters.
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import httpx
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class StreamTiming(NamedTuple):
+    ttft: float
+    gaps: List[float]
+    duration: float
+
+
+async def timed_stream(
+    client: httpx.AsyncClient,
+    url: str,
+    body: dict,
+    markers: Sequence[str],
+    headers: Optional[Dict[str, str]] = None,
+) -> StreamTiming:
+    """Post ``body`` and time the lines of the response that contain one of ``markers``."""
+    started = time.perf_counter()
+    first = None
+    last = None
+    gaps = []
+    async with client.stream("POST", url, json=body, headers=headers) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not any(marker in line for marker in markers):
+                continue
+            now = time.perf_counter()
+            if first is None:
+                first = now - started
+            else:
+                gaps.append(now - last)
+            last = now
+    duration = time.perf_counter() - started
+    return StreamTiming(first if first is not None else duration, gaps, duration)
+
+
+async def drive(
+    url: str,
+    make_body: Callable[[int], dict],
+    concurrency: int,
+    streams: int,
+    markers: Sequence[str],
+    headers: Optional[Dict[str, str]] = None,
+) -> tuple[float, List[StreamTiming], int]:
+    """
+    Run ``streams`` requests with ``concurrency`` in flight.
+
+    Returns:
+        Wall time in seconds, the timings of the streams that completed and
+        the number that failed
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    counter = iter(range(streams))
+    timings: List[StreamTiming] = []
+    errors = 0
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal errors
+        for i in counter:
+            try:
+                timings.append(await timed_stream(client, url, make_body(i), markers, headers))
+            except httpx.HTTPError:
+                errors += 1
+
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        return time.perf_counter() - started, timings, errors
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """The ``q``-th percentile (0-100) of ``values``, nearest rank; None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class ProcessTree:
+    """
+    A process and its descendants, read from ``/proc``.
+
+    Args:
+        pid: Root process, e.g. the server launcher
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def pids(self) -> List[int]:
+        parents: Dict[int, int] = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                stat = _read_stat(int(entry))
+                if stat is not None:
+                    parents[int(entry)] = int(stat[1])
+        tree = [self.pid]
+        for pid in tree:
+            tree.extend(child for child, parent in parents.items() if parent == pid)
+        return tree
+
+    def cpu_seconds(self) -> float:
+        """User and system CPU time of the live processes."""
+        total = 0
+        for pid in self.pids():
+            stat = _read_stat(pid)
+            if stat is not None:
+                total += int(stat[11]) + int(stat[12])
+        return total / CLOCK_TICKS
+
+    def rss_bytes(self) -> int:
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/statm") as statm:
+                    total += int(statm.read().split()[1]) * PAGE_SIZE
+            except (OSError, IndexError):
+                pass
+        return total
+
+
+def _read_stat(pid: int) -> Optional[List[str]]:
+    # Fields after the parenthesized command name, which may contain spaces
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            content = stat.read()
+    except OSError:
+        return None
+    return content[content.rindex(")") + 2:].split()
+
+
+class RssSampler:
+    """
+    Records the peak resident memory of ``tree`` while in use.
+
+    Args:
+        tree: Processes to sample
+        interval: Seconds between samples
+    """
+
+    def __init__(self, tree: ProcessTree, interval: float = 0.05):
+        self.tree = tree
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "RssSampler":
+        self.peak = self.tree.rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.tree.rss_bytes())
+
+
+def level_result(
+    concurrency: int,
+    wall: float,
+    timings: List[StreamTiming],
+    errors: int,
+    cpu_seconds: float,
+    tokens_per_stream: int,
+    rss_idle: int,
+    rss_peak: int,
+) -> dict:
+    """Summary of one load level; times in milliseconds."""
+    gaps = [gap for timing in timings for gap in timing.gaps]
+    ttfts = [timing.ttft for timing in timings]
+    tokens = len(timings) * tokens_per_stream
+    return {
+        "concurrency": concurrency,
+        "streams": len(timings),
+        "errors": errors,
+        "streams_per_second": round(len(timings) / wall, 2),
+        "ttft_ms": {"p50": _ms(ttfts, 50), "p99": _ms(ttfts, 99)},
+        "inter_token_ms": {"p50": _ms(gaps, 50), "p99": _ms(gaps, 99)},
+        "cpu_us_per_token": round(cpu_seconds / tokens * 1e6, 2) if tokens else None,
+        "rss_mib_per_stream": round(max(0, rss_peak - rss_idle) / concurrency / 2 ** 20, 3),
+    }
+
+
+def _ms(values: Sequence[float], q: float) -> Optional[float]:
+    value = percentile(values, q)
+    return None if value is None else round(value * 1000, 3)
+
+
+def git_commit() -> Optional[str]:
+    """The checked-out commit, to label results."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(path: str, server: str, parameters: dict, results: List[dict]) -> None:
+    """Write the results of a run as JSON, labelled with the commit and parameters."""
+    with open(path, "w") as output:
+        json.dump({
+            "benchmark": "bench_load",
+            "server": server,
+            "commit": git_commit(),
+            "parameters": parameters,
+            "results": results,
+        }, output, indent=2)
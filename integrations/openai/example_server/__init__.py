@@ -2,12 +2,18 @@
 Example server for the AG-UI protocol.
 """
 
+import json
+import logging
 import os
 import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
 import uvicorn
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
+from openai import AsyncStream
 from ag_ui.core import (
     RunAgentInput,
     EventType,
@@ -15,12 +21,57 @@ from ag_ui.core import (
     RunFinishedEvent,
     RunErrorEvent,
 )
-from ag_ui.core.events import ToolCallChunkEvent, TextMessageChunkEvent
 from ag_ui.encoder import EventEncoder
-from openai import OpenAI
+from pydantic import ValidationError
+from .admission import (
+    AdmissionController,
+    AdmissionRejected,
+    AdmittedStreamingResponse,
+    admission_key,
+    hold_permit,
+)
+from .backpressure import StreamBuffer
+from .compaction import (
+    SUMMARY_PROMPT,
+    ChatMessageFormat,
+    HistoryCompactor,
+    SummaryCache,
+    estimate_tokens,
+    resolve_summarizer,
+)
+from .compression import ResponseCompression
 from .config import settings
+from .disconnect import StreamMeter, cancel_on_disconnect, stats as disconnect_stats
+from .flush_deadline import iter_with_flush_deadline
+from .hedging import Hedger
+from .logs import configure_logging
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Timer, registry, stage_seconds
+from .response_cache import cache_key, create_response_cache
+from .run_input import ThreadPrefixCache, decode_run_input, decode_thread_run_input
+from .single_flight import SingleFlight
+from .streaming import ChunkBatcher, ToolCallAssembler
+from .thread_store import (
+    VERSION_HEADER,
+    ThreadVersionConflict,
+    ThreadWrite,
+    commit_on_success,
+    create_thread_store,
+    parse_thread_version,
+)
+from . import upstream
+
+
+configure_logging(settings.log_level, settings.log_json, settings.log_token_sample_every)
+logger = logging.getLogger(__name__)
+
 
-app = FastAPI(title="AG-UI Endpoint")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await upstream.aclose()
+
+
+app = FastAPI(title="AG-UI Endpoint", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -29,25 +80,410 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[VERSION_HEADER],
+)
+
+response_cache = (
+    create_response_cache(
+        settings.response_cache_backend,
+        settings.response_cache_path,
+        settings.response_cache_ttl_seconds,
+        settings.response_cache_max_entries,
+        settings.response_cache_max_bytes,
+    )
+    if settings.response_cache_enabled
+    else None
+)
+
+single_flight = SingleFlight(settings.single_flight_max_bytes) if settings.single_flight_enabled else None
+
+compression = (
+    ResponseCompression(
+        encodings=[encoding.strip() for encoding in settings.compression_encodings.split(",") if encoding.strip()],
+        gzip_level=settings.compression_gzip_level,
+        brotli_quality=settings.compression_brotli_quality,
+    )
+    if settings.compression_enabled
+    else None
+)
+
+hedger = (
+    Hedger(
+        percentile=settings.hedge_percentile,
+        min_delay=settings.hedge_min_delay_ms / 1000,
+        max_delay=settings.hedge_max_delay_ms / 1000,
+        min_samples=settings.hedge_min_samples,
+        window=settings.hedge_window,
+        max_ratio=settings.hedge_max_ratio,
+    )
+    if settings.hedge_enabled
+    else None
 )
 
-client = OpenAI(
-    api_key=settings.gemini_api_key,
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
+admission = (
+    AdmissionController(
+        max_concurrent=settings.admission_max_concurrent,
+        max_concurrent_per_key=settings.admission_max_concurrent_per_key,
+        rate=settings.admission_rate_per_second,
+        burst=settings.admission_burst,
+        rate_per_key=settings.admission_key_rate_per_second,
+        burst_per_key=settings.admission_key_burst,
+        max_queue=settings.admission_max_queue,
+        max_wait=settings.admission_max_wait_seconds,
+    )
+    if settings.admission_enabled
+    else None
 )
 
+def stream_buffer() -> StreamBuffer:
+    """Buffer between the upstream and the client for one stream."""
+    return StreamBuffer(
+        policy=settings.stream_buffer_policy,
+        max_frames=settings.stream_buffer_max_frames,
+        max_bytes=settings.stream_buffer_max_bytes,
+        drop_after=settings.stream_slow_consumer_timeout_seconds,
+    )
+
+
+stream_buffer()  # reject an unknown policy at startup rather than per request
+
+thread_cache = (
+    ThreadPrefixCache(
+        max_threads=settings.thread_cache_max_threads,
+        max_bytes=settings.thread_cache_max_bytes,
+    )
+    if settings.thread_cache_enabled
+    else None
+)
+
+thread_store = (
+    create_thread_store(
+        settings.thread_store_backend,
+        settings.thread_store_path,
+        settings.thread_store_ttl_seconds,
+        settings.thread_store_max_threads,
+        settings.thread_store_max_bytes,
+        settings.thread_store_max_messages,
+    )
+    if settings.thread_store_enabled
+    else None
+)
+
+
+async def summarize_with_model(transcript: str) -> str:
+    """Summarize older turns of a thread with the upstream model."""
+    response = await upstream.client.chat.completions.create(
+        model=settings.openai_model,
+        messages=[{"role": "user", "content": SUMMARY_PROMPT + transcript}],
+    )
+    return response.choices[0].message.content or ""
+
+
+compactor = (
+    HistoryCompactor(
+        ChatMessageFormat(),
+        max_tokens=settings.compaction_max_tokens,
+        keep_recent_turns=settings.compaction_keep_recent_turns,
+        max_tool_output_chars=settings.compaction_max_tool_output_chars,
+        summarizer=resolve_summarizer(settings.compaction_summarizer, summarize_with_model),
+        summary_block_turns=settings.compaction_summary_block_turns,
+        summary_cache=SummaryCache(settings.compaction_summary_cache_entries),
+    )
+    if settings.compaction_enabled
+    else None
+)
+
+
+# Stands in for the per-run message id inside cached frames
+MESSAGE_ID_PLACEHOLDER = "00000000-0000-0000-0000-cached-msg-id"
+
+if settings.metrics_worker_label:
+    # Each worker answers /metrics with its own series
+    registry.labels["worker"] = str(os.getpid())
+
+for _name, _help, _field in (
+    ("streams_completed_total", "Streams that ran to completion", "completed_streams"),
+    ("streams_cancelled_total", "Streams cancelled before completion", "cancelled_streams"),
+    ("stream_tokens_saved_total", "Estimated upstream tokens saved by cancelling streams", "estimated_tokens_saved"),
+):
+    registry.counter(_name, _help).set_function(
+        lambda field=_field: getattr(disconnect_stats, field)
+    )
+for _name, _help, _function in (
+    ("upstream_requests_total", "Requests sent to the upstream", lambda: upstream.transport.requests),
+    ("upstream_connections_opened_total", "Upstream connections opened", lambda: upstream.transport.connections_opened),
+    ("upstream_dns_cache_hits_total", "Upstream DNS lookups answered from the cache", lambda: upstream.transport.network_backend.resolver.hits),
+    ("upstream_dns_cache_misses_total", "Upstream DNS lookups sent to the resolver", lambda: upstream.transport.network_backend.resolver.misses),
+):
+    registry.counter(_name, _help).set_function(_function)
+if thread_cache is not None:
+    registry.counter("thread_cache_hits_total", "Runs that reused validated thread history").set_function(lambda: thread_cache.hits)
+    registry.counter("thread_cache_misses_total", "Runs validated in full").set_function(lambda: thread_cache.misses)
+    registry.counter("thread_cache_reused_messages_total", "Messages reused without validation").set_function(lambda: thread_cache.reused_messages)
+    registry.gauge("thread_cache_bytes", "Approximate size of cached threads").set_function(lambda: thread_cache.total_bytes)
+if thread_store is not None:
+    registry.counter("thread_store_merged_total", "Runs that sent only new messages").set_function(lambda: thread_store.merged)
+    registry.counter("thread_store_replaced_total", "Runs that sent the full history").set_function(lambda: thread_store.replaced)
+    registry.counter("thread_store_conflicts_total", "Runs answered 409 for a stale history version").set_function(lambda: thread_store.conflicts)
+    registry.counter("thread_store_messages_not_resent_total", "Stored messages clients did not resend").set_function(lambda: thread_store.messages_not_resent)
+if compactor is not None:
+    for _name, _help, _function in (
+        ("compaction_tokens_before_total", "Estimated prompt tokens before history compaction", lambda: compactor.tokens_before),
+        ("compaction_tokens_after_total", "Estimated prompt tokens after history compaction", lambda: compactor.tokens_after),
+        ("compaction_elided_tool_outputs_total", "Tool outputs elided from older turns", lambda: compactor.elided_outputs),
+        ("compaction_dropped_turns_total", "Turns dropped to fit the token budget", lambda: compactor.dropped_turns),
+        ("compaction_summary_cache_hits_total", "Summaries of older turns reused", lambda: compactor.summary_cache.hits),
+        ("compaction_summary_cache_misses_total", "Summaries of older turns computed", lambda: compactor.summary_cache.misses),
+    ):
+        registry.counter(_name, _help).set_function(_function)
+if response_cache is not None:
+    registry.counter("response_cache_hits_total", "Response cache hits").set_function(
+        lambda: response_cache.hits
+    )
+    registry.counter("response_cache_misses_total", "Response cache misses").set_function(
+        lambda: response_cache.misses
+    )
+if single_flight is not None:
+    registry.counter("single_flight_started_total", "Upstream runs started").set_function(lambda: single_flight.started)
+    registry.counter("single_flight_joined_total", "Requests that joined an identical run in flight").set_function(lambda: single_flight.joined)
+    registry.gauge("single_flight_runs", "Runs in flight").set_function(lambda: len(single_flight))
+if compression is not None:
+    _compressed_streams = registry.counter("compressed_streams_total", "Streams compressed", ("encoding",))
+    for _encoding in compression.encodings:
+        _compressed_streams.labels(_encoding).set_function(lambda encoding=_encoding: compression.streams[encoding])
+    registry.counter("compression_bytes_in_total", "Bytes of streamed frames before compression").set_function(lambda: compression.bytes_in)
+    registry.counter("compression_bytes_out_total", "Bytes of streamed frames after compression").set_function(lambda: compression.bytes_out)
+if hedger is not None:
+    for _name, _help, _function in (
+        ("upstream_hedges_total", "Hedged upstream requests sent", lambda: hedger.hedges),
+        ("upstream_hedge_wins_total", "Runs whose hedged request streamed a token first", lambda: hedger.hedge_wins),
+        ("upstream_hedges_over_budget_total", "Slow runs not hedged because of the hedge budget", lambda: hedger.budget_exhausted),
+        ("upstream_hedge_wasted_tokens_total", "Tokens streamed by losing requests before they were cancelled", lambda: hedger.wasted_tokens),
+        ("upstream_hedge_wasted_prompt_tokens_total", "Estimated prompt tokens of losing requests", lambda: hedger.wasted_prompt_tokens),
+    ):
+        registry.counter(_name, _help).set_function(_function)
+    registry.gauge("upstream_hedge_delay_seconds", "Current delay before hedging").set_function(hedger.delay)
+
+
+async def parse_run_input(request: Request, body: bytes) -> Tuple[RunAgentInput, Optional[ThreadWrite]]:
+    """
+    Parse and validate a request body, timing both stages.
+
+    With the thread store enabled the body's messages are merged onto the
+    thread's stored history.
+
+    Returns:
+        The run input and the pending write of the body's messages, to commit
+        once the run completed (None without a thread store)
+
+    Raises:
+        RequestValidationError: The body is not valid JSON or not a valid
+            ``RunAgentInput``, answered with FastAPI's usual 422 response
+        ThreadVersionConflict: The body follows a stale history version
+    """
+    version = parse_thread_version(request.headers.get(VERSION_HEADER))
+    if thread_store is None and version is not None:
+        # Only new messages, and no history to put them after
+        raise ThreadVersionConflict()
+    try:
+        if thread_store is None:
+            return decode_run_input(body, thread_cache), None
+        return await decode_thread_run_input(body, thread_store, version, thread_cache)
+    except json.JSONDecodeError as error:
+        raise RequestValidationError([{
+            "type": "json_invalid",
+            "loc": ("body", error.pos),
+            "msg": "JSON decode error",
+            "input": {},
+            "ctx": {"error": error.msg},
+        }])
+    except ValidationError as error:
+        raise RequestValidationError([
+            {**detail, "loc": ("body", *detail["loc"])}
+            for detail in error.errors(include_url=False)
+        ])
+
+
+def to_openai_message(message) -> dict:
+    """Transform an AG-UI message to OpenAI's message format."""
+    return {
+        "role": message.role,
+        "content": message.content or "",
+        # Include tool calls if this is an assistant message with tools
+        **({"tool_calls": message.tool_calls} if message.role == "assistant" and hasattr(message, 'tool_calls') and message.tool_calls else {}),
+        # Include tool call ID if this is a tool result message
+        **({"tool_call_id": message.tool_call_id} if message.role == "tool" and hasattr(message, 'tool_call_id') else {}),
+    }
+
+
+def estimate_prompt_tokens(messages) -> int:
+    """Estimated prompt tokens of OpenAI chat messages."""
+    message_format = ChatMessageFormat()
+    return sum(estimate_tokens(len(message_format.text(message))) for message in messages)
+
+
+def has_token(chunk) -> bool:
+    """Whether a completion chunk carries content, tool calls or the end of the answer."""
+    if not chunk.choices:
+        return False
+    choice = chunk.choices[0]
+    return bool(choice.delta.content or choice.delta.tool_calls or choice.finish_reason is not None)
+
+
+async def open_completion(client, model: str, tools, messages) -> Tuple[AsyncStream, List]:
+    """
+    Open a completion stream and read it up to its first token.
+
+    Returns:
+        The stream and the chunks read from it, the last of which carries the
+        first token unless the stream ended without one
+    """
+    stream = await client.chat.completions.create(
+        model=model,
+        stream=True,
+        tools=tools,
+        messages=messages,
+    )
+    head = []
+    try:
+        async for chunk in stream:
+            head.append(chunk)
+            if has_token(chunk):
+                break
+    except BaseException:
+        await stream.close()
+        raise
+    return stream, head
+
+
+async def discard_completion(opened: Tuple[AsyncStream, List]) -> None:
+    """Close the stream of a hedged attempt that lost, counting its tokens."""
+    stream, head = opened
+    hedger.wasted_tokens += sum(
+        bool(chunk.choices and (chunk.choices[0].delta.content or chunk.choices[0].delta.tool_calls))
+        for chunk in head
+    )
+    await stream.close()
+
+
+async def resume_completion(head: List, stream: AsyncStream):
+    """The chunks of an opened completion stream, from its first."""
+    for chunk in head:
+        yield chunk
+    async for chunk in stream:
+        yield chunk
+
+
+async def stream_completion(encoder: EventEncoder, message_id: str, tools, messages, meter: StreamMeter):
+    """Stream one upstream completion as encoded AG-UI chunk events."""
+    # Call OpenAI's API with streaming enabled
+    with Timer(stage_seconds.labels("upstream_request")):
+        if hedger is not None:
+            # Waits for the first token, racing a second request if it is slow
+            (stream, head), _ = await hedger.race(
+                lambda attempt: open_completion(
+                    upstream.hedge_client if attempt else upstream.client,
+                    (settings.hedge_model or settings.openai_model) if attempt else settings.openai_model,
+                    tools,
+                    messages,
+                ),
+                discard_completion,
+                lambda: estimate_prompt_tokens(messages),
+            )
+        else:
+            stream = await upstream.client.chat.completions.create(
+                model=settings.openai_model,
+                stream=True,
+                tools=tools,
+                messages=messages,
+            )
+            head = []
+
+    batcher = ChunkBatcher(
+        encoder,
+        message_id,
+        max_chars=settings.agui_batch_max_chars,
+        max_delay=settings.agui_batch_max_delay_ms / 1000,
+        validate=not settings.agui_fast_events,
+    )
+    tool_calls = ToolCallAssembler(batcher)
+    chunks = resume_completion(head, stream) if head else stream
+    if batcher.max_delay:
+        chunks = iter_with_flush_deadline(chunks, batcher)
+
+    # Close the upstream stream when done, cancelled or failed so its
+    # connection goes back to the pool instead of draining a response
+    async with stream:
+        # Stream each chunk from OpenAI's response
+        async for chunk in chunks:
+            # print(chunk.choices)
+
+            if chunk is None:
+                # Flush window expired while waiting for the upstream
+                for encoded in batcher.flush():
+                    yield encoded
+                continue
+
+            if not chunk.choices:
+                # Usage-only chunk
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if delta.content or delta.tool_calls:
+                meter.tick()
+            # Handle text content chunks
+            if delta.content:
+                for encoded in batcher.text(delta.content):
+                    yield encoded
+            # Handle tool call chunks; one chunk may carry deltas of several calls
+            if delta.tool_calls:
+                for encoded in tool_calls.add(delta.tool_calls):
+                    yield encoded
+            if choice.finish_reason is not None:
+                for encoded in tool_calls.finish():
+                    yield encoded
+
+    for encoded in tool_calls.finish():
+        yield encoded
+    for encoded in batcher.flush():
+        yield encoded
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics"""
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.post("/")
-async def agentic_chat_endpoint(input_data: RunAgentInput, request: Request):
-    print("Input data: ", input_data)
+async def agentic_chat_endpoint(request: Request):
+    """Agentic chat endpoint"""
+    meter = StreamMeter()
+
+    with Timer(stage_seconds.labels("read_body")):
+        body = await request.body()
+    try:
+        input_data, thread_write = await parse_run_input(request, body)
+    except ThreadVersionConflict as conflict:
+        return conflict.to_response()
+
+    logger.debug("Input data: %r", input_data)
     # print("Request: ", request)
 
-    """Agentic chat endpoint"""
     # Get the accept header from the request
     accept_header = request.headers.get("accept")
 
     # Create an event encoder to properly format SSE events
     encoder = EventEncoder(accept=accept_header)
 
+    # Wait for a run slot, or answer 429 before any upstream work is done
+    permit = None
+    if admission is not None:
+        try:
+            permit = await admission.acquire(admission_key(request, settings.admission_key_header))
+        except AdmissionRejected as rejected:
+            return rejected.to_response()
+
     async def event_generator():
         try:
             # Send run started event
@@ -59,12 +495,9 @@ async def agentic_chat_endpoint(input_data: RunAgentInput, request: Request):
             ),
             )
 
-            # Call OpenAI's API with streaming enabled
-            stream = client.chat.completions.create(
-                model="gemini-2.5-flash",
-                stream=True,
+            with Timer(stage_seconds.labels("convert")):
                 # Convert AG-UI tools format to OpenAI's expected format
-                tools=[
+                tools = [
                     {
                         "type": "function",
                         "function": {
@@ -74,49 +507,62 @@ async def agentic_chat_endpoint(input_data: RunAgentInput, request: Request):
                         }
                     }
                     for tool in input_data.tools
-                ] if input_data.tools else None,
-                # Transform AG-UI messages to OpenAI's message format
-                messages=[
-                    {
-                        "role": message.role,
-                        "content": message.content or "",
-                        # Include tool calls if this is an assistant message with tools
-                        **({"tool_calls": message.tool_calls} if message.role == "assistant" and hasattr(message, 'tool_calls') and message.tool_calls else {}),
-                        # Include tool call ID if this is a tool result message
-                        **({"tool_call_id": message.tool_call_id} if message.role == "tool" and hasattr(message, 'tool_call_id') else {}),
-                    }
-                    for message in input_data.messages
-                ],
-            )
+                ] if input_data.tools else None
+                # Transform AG-UI messages to OpenAI's message format,
+                # reusing those converted for earlier runs of the thread
+                if thread_cache is not None:
+                    messages = thread_cache.derive(
+                        input_data.thread_id, input_data.messages, to_openai_message
+                    )
+                else:
+                    messages = [to_openai_message(message) for message in input_data.messages]
+            if compactor is not None:
+                with Timer(stage_seconds.labels("compact")):
+                    messages = await compactor.compact(messages)
 
             message_id = str(uuid.uuid4())
+            substitutions = {MESSAGE_ID_PLACEHOLDER: message_id}
+            key = None
+            if response_cache is not None or single_flight is not None:
+                # Messages carry any system prompt, so they complete the key.
+                # Frames are recorded in the accepted event encoding and
+                # compressed only on the way out, so the content type is
+                # part of the key and Accept-Encoding is not
+                key = cache_key(
+                    content_type=encoder.get_content_type(),
+                    model=settings.openai_model,
+                    tools=tools,
+                    messages=messages,
+                )
 
-            # Stream each chunk from OpenAI's response
-            for chunk in stream:
-                # print(chunk.choices)
-
-                # Handle text content chunks
-                if chunk.choices[0].delta.content:
-                    yield encoder.encode(
-                        TextMessageChunkEvent(
-                            type=EventType.TEXT_MESSAGE_CHUNK,
-                            message_id=message_id,
-                            delta=chunk.choices[0].delta.content,
-                        )
-                    )
-                # Handle tool call chunks
-                elif chunk.choices[0].delta.tool_calls:
-                    tool_call = chunk.choices[0].delta.tool_calls[0]
-
-                    yield encoder.encode(
-                        ToolCallChunkEvent(
-                            type=EventType.TOOL_CALL_CHUNK,
-                            tool_call_id=tool_call.id,
-                            tool_call_name=tool_call.function.name if tool_call.function else None,
-                            parent_message_id=message_id,
-                            delta=tool_call.function.arguments if tool_call.function else None,
-                        )
+            def start_completion():
+                frames = stream_completion(encoder, message_id, tools, messages, meter)
+                if response_cache is not None:
+                    frames = response_cache.record(key, frames, substitutions)
+                return frames
+
+            cached = await response_cache.lookup(key, substitutions) if response_cache is not None else None
+            if cached is not None:
+                yield cached
+            else:
+                if single_flight is not None:
+                    # Identical runs in progress share one upstream stream.
+                    # The upstream run holds the admission slot, a follower none
+                    frames = single_flight.subscribe(
+                        key,
+                        start_completion,
+                        substitutions,
+                        lease=permit.transfer() if permit is not None else None,
                     )
+                    try:
+                        async for encoded in frames:
+                            yield encoded
+                    finally:
+                        # Also when this generator is closed mid-iteration
+                        frames.release()
+                else:
+                    async for encoded in start_completion():
+                        yield encoded
 
             yield encoder.encode(
                 RunFinishedEvent(
@@ -135,9 +581,32 @@ async def agentic_chat_endpoint(input_data: RunAgentInput, request: Request):
             )
             raise error
 
-    return StreamingResponse(
-        event_generator(),
-        media_type=encoder.get_content_type()
+    events = event_generator()
+    if thread_write is not None:
+        # Stored once this client was sent the whole run; a failed run raises
+        events = commit_on_success(events, thread_write, lambda frame: False)
+    if permit is not None:
+        # The slot is held until the run ends, fails or is cancelled
+        events = hold_permit(permit, events)
+
+    frames = cancel_on_disconnect(
+        request,
+        events,
+        meter=meter,
+        poll_interval=settings.disconnect_poll_interval_ms / 1000,
+        buffer=stream_buffer(),
+    )
+    headers = {VERSION_HEADER: thread_write.version} if thread_write is not None else {}
+    if compression is not None:
+        frames, compression_headers = compression.wrap(request.headers.get("accept-encoding"), frames)
+        headers.update(compression_headers)
+
+    # Releases the permit even if the client leaves before the body is read
+    return AdmittedStreamingResponse(
+        frames,
+        lease=permit,
+        media_type=encoder.get_content_type(),
+        headers=headers or None,
     )
 
 # @app.post("/copilotkit")
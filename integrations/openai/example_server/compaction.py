@@ -0,0 +1,332 @@
+"""
+History compaction before each model request.
+
+Every run sends the whole thread to the model, so prompt tokens, upstream
+latency and cost grow with the thread. ``HistoryCompactor`` shrinks the
+history in three steps, each of which can be disabled:
+
+1. Tool outputs longer than ``max_tool_output_chars`` are elided (head and
+   tail are kept) outside the most recent ``keep_recent_turns`` turns.
+2. Older turns are summarized in blocks of ``summary_block_turns`` turns
+   counted from the start of the thread, so a block's content does not change
+   as the thread grows. Summaries are cached by that content: each block of a
+   thread is summarized once and later runs reuse it.
+3. While the estimated prompt exceeds ``max_tokens``, the oldest summaries
+   and then the oldest turns are dropped. The latest turn is always kept.
+
+A turn starts with a user message and holds the replies and tool calls that
+follow it, so a tool call is never separated from its result. Leading system
+messages are kept as they are.
+
+Tokens are estimated from character counts (about four per token), which is
+cheap and close enough to budget by. The engine works on any message type
+through a ``MessageFormat``; ``ChatMessageFormat`` handles OpenAI-style
+message dicts.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Summarizer = Callable[[str], Awaitable[str]]
+
+CHARS_PER_TOKEN = 4
+# Role markers and separators the provider adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+SUMMARY_PROMPT = (
+    "Summarize this part of a conversation in a few sentences. Keep names, "
+    "numbers, decisions and open questions; leave out pleasantries.\n\n"
+)
+
+
+def estimate_tokens(chars: int) -> int:
+    """Estimate the tokens of a message with ``chars`` characters of content."""
+    return chars // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def elide(text: str, max_chars: int) -> str:
+    """Shorten ``text`` to about ``max_chars`` characters, keeping its head and tail."""
+    if len(text) <= max_chars:
+        return text
+    keep = max_chars // 2
+    return f"{text[:keep]}\n[... {len(text) - 2 * keep} characters elided ...]\n{text[-keep:]}"
+
+
+class MessageFormat:
+    """
+    Adapter between the compactor and one message type.
+
+    Roles are ``"system"``, ``"user"``, ``"assistant"`` or ``"tool"``.
+    """
+
+    def role(self, message: Any) -> str:
+        raise NotImplementedError
+
+    def text(self, message: Any) -> str:
+        """Content of the message as plain text, for token estimates and summaries."""
+        raise NotImplementedError
+
+    def elide_tool_output(self, message: Any, max_chars: int) -> Any:
+        """Return the message with tool outputs elided to ``max_chars``, or itself."""
+        raise NotImplementedError
+
+    def summary_message(self, text: str) -> Any:
+        """A system message carrying ``text``."""
+        raise NotImplementedError
+
+    def system_part(self, message: Any) -> Optional[Any]:
+        """The system instructions a message carries, to keep when it is compacted away."""
+        return message if self.role(message) == "system" else None
+
+
+class ChatMessageFormat(MessageFormat):
+    """OpenAI chat-completion message dicts."""
+
+    def role(self, message: Dict[str, Any]) -> str:
+        return message.get("role", "user")
+
+    def text(self, message: Dict[str, Any]) -> str:
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        calls = message.get("tool_calls")
+        if calls:
+            content += "".join(f"\n{_call_text(call)}" for call in calls)
+        return content
+
+    def elide_tool_output(self, message: Dict[str, Any], max_chars: int) -> Dict[str, Any]:
+        content = message.get("content")
+        if message.get("role") != "tool" or not isinstance(content, str) or len(content) <= max_chars:
+            return message
+        return {**message, "content": elide(content, max_chars)}
+
+    def summary_message(self, text: str) -> Dict[str, Any]:
+        return {"role": "system", "content": text}
+
+
+def _call_text(call: Any) -> str:
+    function = call.get("function", {}) if isinstance(call, dict) else getattr(call, "function", None)
+    if isinstance(function, dict):
+        return f"[called {function.get('name')}({function.get('arguments') or ''})]"
+    return f"[called {getattr(function, 'name', '')}({getattr(function, 'arguments', '') or ''})]"
+
+
+def turn_text(message_format: MessageFormat, turns: List[List[Any]]) -> str:
+    """Transcript of ``turns`` with one ``role: text`` paragraph per message."""
+    return "\n\n".join(
+        f"{message_format.role(message)}: {message_format.text(message)}"
+        for turn in turns
+        for message in turn
+    )
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+async def extractive_summary(transcript: str, max_chars_per_message: int = 160) -> str:
+    """
+    Summarize without a model call: the first sentence of every user and
+    assistant message, shortened to ``max_chars_per_message``.
+    """
+    lines = []
+    for paragraph in transcript.split("\n\n"):
+        role, _, text = paragraph.partition(": ")
+        if role not in ("user", "assistant"):
+            continue
+        sentence = _SENTENCE_END.split(text.strip(), 1)[0].replace("\n", " ")
+        if len(sentence) > max_chars_per_message:
+            sentence = sentence[: max_chars_per_message - 3] + "..."
+        if sentence:
+            lines.append(f"- {role}: {sentence}")
+    return "\n".join(lines)
+
+
+class SummaryCache:
+    """
+    LRU cache of summaries by the content they summarize.
+
+    Args:
+        max_entries: Maximum number of cached summaries
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    async def get(self, transcript: str, summarizer: Summarizer) -> str:
+        """Return the summary of ``transcript``, summarizing it once on a miss."""
+        key = hashlib.sha256(transcript.encode()).hexdigest()
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return summary
+        pending = self._pending.get(key)
+        if pending is not None:
+            # Another run of the thread is summarizing the same block
+            self.hits += 1
+            return await asyncio.shield(pending)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            summary = await summarizer(transcript)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            future.exception()  # retrieved; waiters re-raise it
+            raise
+        finally:
+            self._pending.pop(key, None)
+        future.set_result(summary)
+        with self._lock:
+            self._entries[key] = summary
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return summary
+
+
+class HistoryCompactor:
+    """
+    Elides, summarizes and truncates message histories.
+
+    Args:
+        message_format: Adapter for the message type
+        max_tokens: Estimated prompt budget (0 disables truncation)
+        keep_recent_turns: Latest turns left untouched by elision and
+            summarization
+        max_tool_output_chars: Longest tool output kept in older turns
+            (0 disables elision)
+        summarizer: Summarizes a transcript of older turns (None disables
+            summarization)
+        summary_block_turns: Turns summarized together
+        summary_cache: Cache of block summaries
+    """
+
+    def __init__(
+        self,
+        message_format: MessageFormat,
+        max_tokens: int = 32000,
+        keep_recent_turns: int = 8,
+        max_tool_output_chars: int = 4000,
+        summarizer: Optional[Summarizer] = extractive_summary,
+        summary_block_turns: int = 16,
+        summary_cache: Optional[SummaryCache] = None,
+    ):
+        self.message_format = message_format
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = max(1, keep_recent_turns)
+        self.max_tool_output_chars = max_tool_output_chars
+        self.summarizer = summarizer
+        self.summary_block_turns = max(1, summary_block_turns)
+        self.summary_cache = summary_cache or SummaryCache()
+        self.runs = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.elided_outputs = 0
+        self.dropped_turns = 0
+
+    def count_tokens(self, messages: List[Any]) -> int:
+        """Estimated prompt tokens of ``messages``."""
+        return sum(estimate_tokens(len(self.message_format.text(message))) for message in messages)
+
+    async def compact(self, messages: List[Any]) -> List[Any]:
+        """Return a compacted copy of ``messages``; the messages themselves are not modified."""
+        message_format = self.message_format
+        roles = [message_format.role(message) for message in messages]
+        pinned = 0
+        while pinned < len(messages) and roles[pinned] == "system":
+            pinned += 1
+        starts = [i for i in range(pinned + 1, len(messages)) if roles[i] == "user"]
+        bounds = [pinned, *starts, len(messages)]
+        turns = [messages[start:end] for start, end in zip(bounds, bounds[1:]) if start < end]
+        self.runs += 1
+        before = self.count_tokens(messages)
+        self.tokens_before += before
+        if len(turns) <= self.keep_recent_turns and (not self.max_tokens or before <= self.max_tokens):
+            self.tokens_after += before
+            return messages
+
+        older = turns[: -self.keep_recent_turns]
+        recent = turns[-self.keep_recent_turns:]
+        if self.max_tool_output_chars:
+            older = [[self._elide(message) for message in turn] for turn in older]
+
+        # Summaries of whole blocks, then the turns that do not fill a block
+        summaries: List[str] = []
+        blocks = len(older) // self.summary_block_turns if self.summarizer is not None else 0
+        if blocks:
+            size = self.summary_block_turns
+            results = await asyncio.gather(*(
+                self.summary_cache.get(turn_text(message_format, older[i * size:(i + 1) * size]), self.summarizer)
+                for i in range(blocks)
+            ), return_exceptions=True)
+            failed = next((result for result in results if isinstance(result, BaseException)), None)
+            if failed is None:
+                summaries = list(results)
+            else:
+                # Keep the turns rather than fail the run
+                logger.warning("Summarizing older turns failed: %r", failed)
+                blocks = 0
+        compacted_away = older[: blocks * self.summary_block_turns]
+        kept_turns = older[blocks * self.summary_block_turns:] + recent
+
+        # Drop the oldest summaries, then the oldest turns, until within budget
+        head = list(messages[:pinned])
+        budget = self.max_tokens - self.count_tokens(head) if self.max_tokens else None
+        summary_tokens = [estimate_tokens(len(summary)) for summary in summaries]
+        turn_tokens = [self.count_tokens(turn) for turn in kept_turns]
+        if budget is not None:
+            total = sum(summary_tokens) + sum(turn_tokens)
+            while total > budget and summaries:
+                total -= summary_tokens.pop(0)
+                summaries.pop(0)
+            while total > budget and len(kept_turns) > 1:
+                total -= turn_tokens.pop(0)
+                compacted_away.append(kept_turns.pop(0))
+                self.dropped_turns += 1
+
+        # System instructions inside compacted turns still apply
+        for turn in compacted_away:
+            for message in turn:
+                system = message_format.system_part(message)
+                if system is not None:
+                    head.append(system)
+        if summaries:
+            head.append(message_format.summary_message("\n\n".join([SUMMARY_HEADER, *summaries])))
+        result = head + [message for turn in kept_turns for message in turn]
+        self.tokens_after += self.count_tokens(result)
+        return result
+
+    def _elide(self, message: Any) -> Any:
+        elided = self.message_format.elide_tool_output(message, self.max_tool_output_chars)
+        if elided is not message:
+            self.elided_outputs += 1
+        return elided
+
+
+def resolve_summarizer(name: str, model: Optional[Summarizer] = None) -> Optional[Summarizer]:
+    """The summarizer configured as ``"none"``, ``"extractive"`` or ``"model"``."""
+    if name == "none":
+        return None
+    if name == "extractive":
+        return extractive_summary
+    if name == "model" and model is not None:
+        return model
+    raise ValueError(f"Unknown summarizer {name!r}, expected 'none', 'extractive' or 'model'")
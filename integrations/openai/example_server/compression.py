@@ -0,0 +1,171 @@
+"""
+Negotiated compression of streamed responses.
+
+A response is written frame by frame, and a compressor that waits for a full
+block before emitting anything would hold tokens back. Every frame is
+therefore compressed and flushed on its own (zlib's ``Z_SYNC_FLUSH``,
+brotli's ``flush``): the output ends on a boundary the client can decode at
+once, while the compression window is kept, so each frame still compresses
+against everything sent before it. The JSON keys, event types and ids that
+repeat in every SSE frame cost a few bits each after the first.
+
+The encoding is picked from the request's ``Accept-Encoding`` among the
+configured ones; ``br`` needs the ``brotli`` package and is skipped when it
+is not installed.
+"""
+
+import logging
+import zlib
+from typing import AsyncIterator, Dict, Optional, Sequence, Tuple, Union
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class StreamCompressor:
+    """Compresses one response; every ``compress`` output is decodable on its own."""
+
+    encoding: str
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress ``data`` and flush it."""
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        """End the compressed stream."""
+        raise NotImplementedError
+
+
+class GzipCompressor(StreamCompressor):
+    encoding = "gzip"
+
+    def __init__(self, level: int = 6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(StreamCompressor):
+    encoding = "br"
+
+    def __init__(self, quality: int = 5):
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def available_encodings() -> Tuple[str, ...]:
+    """The encodings this process can write."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str], offered: Sequence[str]) -> Optional[str]:
+    """
+    Pick the encoding of a response.
+
+    Args:
+        accept_encoding: The request's ``Accept-Encoding`` header
+        offered: Encodings the server may use, preferred first
+
+    Returns:
+        The offered encoding with the highest quality value the client gives
+        it (ties go to the server's preference), or None for no compression
+    """
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in offered:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class ResponseCompression:
+    """
+    Compresses streamed responses for the clients that accept it.
+
+    Args:
+        encodings: Encodings to offer, preferred first; those this process
+            cannot write are dropped
+        gzip_level: zlib compression level (1-9)
+        brotli_quality: Brotli quality (0-11)
+    """
+
+    def __init__(self, encodings: Sequence[str] = ("br", "gzip"), gzip_level: int = 6, brotli_quality: int = 5):
+        unknown = set(encodings) - {"br", "gzip"}
+        if unknown:
+            raise ValueError(f"Unknown compression encodings: {sorted(unknown)}")
+        self.encodings = tuple(encoding for encoding in encodings if encoding in available_encodings())
+        if len(self.encodings) < len(encodings):
+            logger.warning("br compression requested but the brotli package is not installed")
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.streams: Dict[str, int] = {encoding: 0 for encoding in self.encodings}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compressor(self, encoding: str) -> StreamCompressor:
+        if encoding == "br":
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.gzip_level)
+
+    def wrap(
+        self,
+        accept_encoding: Optional[str],
+        frames: AsyncIterator[Union[str, bytes]],
+    ) -> Tuple[AsyncIterator[Union[str, bytes]], Dict[str, str]]:
+        """
+        Compress ``frames`` for a client.
+
+        Returns:
+            The frames to write, compressed if the client accepts one of the
+            encodings, and the response headers that say how
+        """
+        encoding = negotiate(accept_encoding, self.encodings)
+        if encoding is None:
+            return frames, {"Vary": "Accept-Encoding"}
+        self.streams[encoding] += 1
+        return self._compress(frames, self.compressor(encoding)), {
+            "Content-Encoding": encoding,
+            "Vary": "Accept-Encoding",
+        }
+
+    async def _compress(
+        self,
+        frames: AsyncIterator[Union[str, bytes]],
+        compressor: StreamCompressor,
+    ) -> AsyncIterator[bytes]:
+        async for frame in frames:
+            data = frame.encode() if isinstance(frame, str) else frame
+            compressed = compressor.compress(data)
+            self.bytes_in += len(data)
+            self.bytes_out += len(compressed)
+            yield compressed
+        tail = compressor.finish()
+        self.bytes_out += len(tail)
+        yield tail
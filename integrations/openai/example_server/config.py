@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -5,6 +7,133 @@ class Settings(BaseSettings):
     app_name: str = "Awesome API"
     gemini_api_key: str
 
+    # OpenAI-compatible upstream
+    openai_base_url: str = "https://generativelanguage.googleapis.com/v1beta/openai/"
+    openai_model: str = "gemini-2.5-flash"
+
+    # Shared upstream connection pool (HTTP/2 needs h2, from httpx[http2])
+    upstream_max_connections: int = 200
+    upstream_max_keepalive_connections: int = 50
+    upstream_keepalive_expiry: float = 30.0
+    upstream_connect_timeout: float = 5.0
+    upstream_read_timeout: float = 600.0
+    upstream_http2: bool = True
+    upstream_dns_cache_ttl_seconds: float = 60.0
+
+    # Opt-in hedged upstream requests: a run without a first token after the
+    # HEDGE_PERCENTILE of recent first-token latencies (within the min/max
+    # delays; the max until HEDGE_MIN_SAMPLES are seen) sends a second request,
+    # to HEDGE_MODEL / HEDGE_BASE_URL if set, and keeps whichever streams a
+    # token first; at most HEDGE_MAX_RATIO of the last HEDGE_WINDOW runs hedge
+    hedge_enabled: bool = False
+    hedge_percentile: float = 95.0
+    hedge_min_delay_ms: float = 50.0
+    hedge_max_delay_ms: float = 2000.0
+    hedge_min_samples: int = 20
+    hedge_window: int = 1000
+    hedge_max_ratio: float = 0.1
+    hedge_model: Optional[str] = None
+    hedge_base_url: Optional[str] = None
+
+    # AG-UI chunk batching (0 disables a budget, both 0 disables batching)
+    agui_batch_max_chars: int = 512
+    agui_batch_max_delay_ms: float = 20.0
+    # Write trusted chunk events from frame templates instead of pydantic models
+    agui_fast_events: bool = True
+
+    # Reuse validated history of the previous run of the same AG-UI thread
+    thread_cache_enabled: bool = True
+    thread_cache_max_threads: int = 256
+    thread_cache_max_bytes: int = 64 * 1024 * 1024
+
+    # Opt-in server-side thread histories, so clients may send only new messages
+    # after the version in their X-Thread-Version header; backend is "memory" or
+    # "sqlite", threads over THREAD_STORE_MAX_MESSAGES drop old turns (0 keeps all)
+    thread_store_enabled: bool = False
+    thread_store_backend: str = "memory"
+    thread_store_path: str = "thread_store.sqlite3"
+    thread_store_ttl_seconds: float = 86400.0
+    thread_store_max_threads: int = 10000
+    thread_store_max_bytes: int = 256 * 1024 * 1024
+    thread_store_max_messages: int = 0
+
+    # Opt-in history compaction before each model request (0 disables a step):
+    # tool outputs over COMPACTION_MAX_TOOL_OUTPUT_CHARS are elided outside the
+    # last COMPACTION_KEEP_RECENT_TURNS turns, older turns are summarized in
+    # blocks of COMPACTION_SUMMARY_BLOCK_TURNS by the "extractive" or "model"
+    # summarizer (or "none"), and the oldest are dropped past COMPACTION_MAX_TOKENS
+    compaction_enabled: bool = False
+    compaction_max_tokens: int = 32000
+    compaction_keep_recent_turns: int = 8
+    compaction_max_tool_output_chars: int = 4000
+    compaction_summarizer: str = "extractive"
+    compaction_summary_block_turns: int = 16
+    compaction_summary_cache_entries: int = 4096
+
+    # How often streaming endpoints check whether the client went away
+    disconnect_poll_interval_ms: float = 100.0
+
+    # Per-stream buffer between the upstream reader and the client; a slow
+    # client makes the upstream "block", gets its deltas "coalesce"d, or is
+    # "drop"ped after STREAM_SLOW_CONSUMER_TIMEOUT_SECONDS
+    stream_buffer_policy: str = "block"
+    stream_buffer_max_frames: int = 16
+    stream_buffer_max_bytes: int = 256 * 1024
+    stream_slow_consumer_timeout_seconds: float = 10.0
+
+    # Opt-in cache replaying identical requests; backend is "memory" or "sqlite"
+    response_cache_enabled: bool = False
+    response_cache_backend: str = "memory"
+    response_cache_path: str = "response_cache.sqlite3"
+    response_cache_ttl_seconds: float = 3600.0
+    response_cache_max_entries: int = 1024
+    response_cache_max_bytes: int = 64 * 1024 * 1024
+
+    # Opt-in sharing of one upstream stream between identical concurrent
+    # requests; a run that has buffered more than max_bytes takes no joiners
+    single_flight_enabled: bool = False
+    single_flight_max_bytes: int = 4 * 1024 * 1024
+
+    # Opt-in compression of streamed responses, negotiated with Accept-Encoding
+    # in COMPRESSION_ENCODINGS order ("br" needs the brotli package); every
+    # frame is flushed as it is written, so compression holds no token back
+    compression_enabled: bool = False
+    compression_encodings: str = "br,gzip"
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 5
+
+    # Production launcher (example_server.serve); 0 workers means one per CPU core
+    serve_app: str = "example_server:app"
+    serve_host: str = "0.0.0.0"
+    serve_workers: int = 0
+    serve_loop: str = "auto"
+    serve_http: str = "auto"
+    serve_backlog: int = 2048
+    serve_keep_alive_seconds: int = 5
+    serve_graceful_shutdown_seconds: float = 30.0
+    serve_access_log: bool = False
+    # Label every metric series with worker="<pid>"; the launcher turns it on
+    # when it starts more than one worker
+    metrics_worker_label: bool = False
+
+    # Logging; records are written by a background thread
+    log_level: str = "INFO"
+    log_json: bool = False
+    log_token_sample_every: int = 100
+
+    # Admission control for streaming runs (0 disables a limit); callers are
+    # keyed by ADMISSION_KEY_HEADER, falling back to the client address
+    admission_enabled: bool = True
+    admission_max_concurrent: int = 256
+    admission_max_concurrent_per_key: int = 32
+    admission_rate_per_second: float = 0.0
+    admission_burst: float = 50.0
+    admission_key_rate_per_second: float = 0.0
+    admission_key_burst: float = 10.0
+    admission_max_queue: int = 512
+    admission_max_wait_seconds: float = 5.0
+    admission_key_header: str = "x-tenant-id"
+
     model_config = SettingsConfigDict(env_file=".env")
 
 settings = Settings()
@@ -0,0 +1,196 @@
+"""
+Client-disconnect detection for streaming responses.
+
+``cancel_on_disconnect`` runs the upstream-driving generator in its own task
+and relays its items to the response. While it waits it polls
+``Request.is_disconnected()``; once the client has gone away the producer
+task is cancelled, which closes the upstream completion stream instead of
+letting it run to the end for nobody.
+
+The producer writes into a bounded ``StreamBuffer``, whose policy decides
+what happens when the client reads slower than the upstream produces.
+"""
+
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Optional, TypeVar
+
+from fastapi import Request
+
+from . import metrics
+from .backpressure import END, SlowConsumerError, StreamBuffer, buffer_peak_bytes, slow_consumer_drops
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StreamMeter:
+    """
+    Counts upstream tokens (deltas) produced by one stream and records their
+    timing: time to first token, inter-token gaps, total duration and rate.
+    """
+
+    __slots__ = ("tokens", "started", "last")
+
+    def __init__(self):
+        self.tokens = 0
+        self.started = time.perf_counter()
+        self.last = self.started
+
+    def tick(self, tokens: int = 1) -> None:
+        now = time.perf_counter()
+        if self.tokens:
+            metrics.inter_token_seconds.observe(now - self.last)
+        else:
+            metrics.ttft_seconds.observe(now - self.started)
+        self.last = now
+        self.tokens += tokens
+
+    def finish(self, outcome: str) -> None:
+        """Record the duration and token rate of the stream once it ends."""
+        elapsed = time.perf_counter() - self.started
+        metrics.stream_seconds.labels(outcome).observe(elapsed)
+        if self.tokens and elapsed > 0:
+            metrics.tokens_per_second.observe(self.tokens / elapsed)
+
+
+class DisconnectStats:
+    """
+    Process-wide counters for cancelled streams.
+
+    Tokens saved by a cancellation are estimated as the mean token count of
+    completed streams minus the tokens already produced when the client left.
+    """
+
+    def __init__(self):
+        self.completed_streams = 0
+        self.completed_tokens = 0
+        self.cancelled_streams = 0
+        self.tokens_before_cancel = 0
+        self.estimated_tokens_saved = 0
+
+    def record_completed(self, meter: Optional[StreamMeter]) -> None:
+        self.completed_streams += 1
+        if meter is not None:
+            self.completed_tokens += meter.tokens
+
+    def record_cancelled(self, meter: Optional[StreamMeter]) -> None:
+        self.cancelled_streams += 1
+        if meter is None:
+            return
+        self.tokens_before_cancel += meter.tokens
+        if self.completed_streams:
+            expected = self.completed_tokens / self.completed_streams
+            self.estimated_tokens_saved += max(0, round(expected - meter.tokens))
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+stats = DisconnectStats()
+
+
+async def cancel_on_disconnect(
+    request: Request,
+    source: AsyncIterator[T],
+    meter: Optional[StreamMeter] = None,
+    poll_interval: float = 0.1,
+    buffer: Optional[StreamBuffer] = None,
+    stats: Optional[DisconnectStats] = stats,
+) -> AsyncIterator[T]:
+    """
+    Relay ``source`` until it finishes or the client disconnects.
+
+    Args:
+        request: The incoming request, polled for disconnection
+        source: Generator driving the upstream run
+        meter: Token meter updated by ``source``, used for the saved-token
+            estimate
+        poll_interval: Seconds between disconnect checks
+        buffer: Buffer between ``source`` and the client, by default one
+            that blocks ``source`` while 16 frames are unread
+        stats: Counters to record the outcome in, or None to not record it
+
+    Yields:
+        The items of ``source``
+    """
+    if buffer is None:
+        buffer = StreamBuffer()
+
+    async def produce():
+        try:
+            async for item in source:
+                await buffer.put(item)
+        except SlowConsumerError as error:
+            buffer.finish(error)
+            # Close the upstream now rather than when the generator is collected
+            await source.aclose()
+            return
+        except Exception as error:  # re-raised in the response task
+            buffer.finish(error)
+            return
+        buffer.finish()
+
+    producer = asyncio.ensure_future(produce())
+    getter: Optional[asyncio.Future] = None
+    next_check = time.monotonic() + poll_interval
+    started = time.monotonic()
+    finished = False
+    metrics.active_streams.inc()
+    try:
+        while True:
+            if getter is None and not buffer.empty():
+                item, error = buffer.get_nowait()
+            else:
+                if getter is None:
+                    getter = asyncio.ensure_future(buffer.get())
+                timeout = max(0.0, next_check - time.monotonic())
+                done, _ = await asyncio.wait({getter}, timeout=timeout)
+                if not done:
+                    next_check = time.monotonic() + poll_interval
+                    if await request.is_disconnected():
+                        logger.info(
+                            "Client disconnected after %.2fs, cancelling upstream",
+                            time.monotonic() - started,
+                        )
+                        return
+                    continue
+                item, error = getter.result()
+                getter = None
+
+            if item is END:
+                if isinstance(error, SlowConsumerError):
+                    slow_consumer_drops.inc()
+                    logger.warning("Dropping slow client: %s", error)
+                    return
+                finished = True
+                if error is not None:
+                    if meter is not None:
+                        meter.finish("failed")
+                    raise error
+                if stats is not None:
+                    stats.record_completed(meter)
+                if meter is not None:
+                    meter.finish("completed")
+                return
+
+            if time.monotonic() >= next_check:
+                next_check = time.monotonic() + poll_interval
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, cancelling upstream")
+                    return
+            yield item
+    finally:
+        metrics.active_streams.dec()
+        buffer_peak_bytes.observe(buffer.peak_bytes)
+        if getter is not None:
+            getter.cancel()
+        if not finished:
+            # Also reached when the server cancels the response task itself
+            producer.cancel()
+            if stats is not None:
+                stats.record_cancelled(meter)
+            if meter is not None:
+                meter.finish("cancelled")
@@ -0,0 +1,296 @@
+"""
+In-process metrics with a Prometheus text exposition.
+
+Counters, gauges and histograms are plain Python objects: recording a value
+is a few arithmetic operations (a ``bisect`` for histograms) with no locks,
+I/O or allocation, so they are cheap enough to update once per streamed
+token. ``registry.render()`` produces the text served on ``/metrics``.
+
+Values that already live elsewhere (cache hit counters, disconnect stats) are
+exposed with ``set_function`` instead of being counted twice.
+
+Metrics are per process. Under several worker processes each ``/metrics``
+response is the view of whichever worker answered; ``Registry.labels`` adds
+constant labels (a ``worker`` label there) so the series of different
+workers stay apart instead of looking like counter resets. Summing them
+needs every worker to be scraped, or aggregation in the monitoring system.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Seconds; covers sub-millisecond stages up to multi-minute streams
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0,
+)
+TOKEN_GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Value:
+    """A single counter or gauge series."""
+
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the value from ``function`` at render time."""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        return [f"{name}{labels} {_format_value(self.get())}"]
+
+
+class _HistogramValue:
+    """A single histogram series with fixed upper bounds."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        inner = labels[1:-1] + "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{inner}le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class Metric:
+    """
+    A named metric family, optionally split by labels.
+
+    An unlabelled metric records directly (``counter.inc()``); a labelled
+    one records through ``labels(...)``, whose result can be kept to avoid
+    the lookup on hot paths.
+
+    Args:
+        name: Metric name
+        documentation: Help text
+        labelnames: Names of the labels distinguishing the series
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Return the series for the given label values, creating it if needed."""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            series = self._series[values] = self._new_series()
+        return series
+
+    def render(self, constant_labels: str = "") -> List[str]:
+        """
+        Exposition lines of the metric.
+
+        Args:
+            constant_labels: Rendered labels added to every series
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, series in list(self._series.items()):
+            pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labelnames, values)]
+            if constant_labels:
+                pairs.insert(0, constant_labels)
+            labels = ",".join(pairs)
+            lines.extend(series.samples(self.name, "{" + labels + "}" if labels else ""))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_series(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._default.set_function(function)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_series(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+
+class Timer:
+    """
+    Context manager observing its elapsed wall time into a histogram series.
+
+    Args:
+        series: Histogram (or labelled series) to observe into
+    """
+
+    __slots__ = ("series", "started")
+
+    def __init__(self, series):
+        self.series = series
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.series.observe(time.perf_counter() - self.started)
+
+
+class Registry:
+    """
+    Collection of metrics rendered together.
+
+    Args:
+        labels: Constant labels added to every series, such as the worker
+    """
+
+    def __init__(self, labels: Optional[Dict[str, str]] = None):
+        self.labels: Dict[str, str] = dict(labels or {})
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition (format 0.0.4) of every metric."""
+        constant_labels = ",".join(f'{label}="{_escape(value)}"' for label, value in self.labels.items())
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(constant_labels))
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "request_stage_seconds",
+    "Time spent in each stage of handling a request",
+    ("stage",),
+)
+ttft_seconds = registry.histogram(
+    "stream_time_to_first_token_seconds",
+    "Time from accepting a request to the first model token",
+)
+inter_token_seconds = registry.histogram(
+    "stream_inter_token_seconds",
+    "Gap between consecutive model tokens",
+    buckets=TOKEN_GAP_BUCKETS,
+)
+stream_seconds = registry.histogram(
+    "stream_duration_seconds",
+    "Total duration of streamed responses",
+    ("outcome",),
+)
+tokens_per_second = registry.histogram(
+    "stream_tokens_per_second",
+    "Model tokens per second over a whole stream",
+    buckets=RATE_BUCKETS,
+)
+tool_seconds = registry.histogram(
+    "tool_execution_seconds",
+    "Time from a tool call to its result",
+    ("tool",),
+)
+active_streams = registry.gauge(
+    "active_streams",
+    "Responses currently being streamed",
+)
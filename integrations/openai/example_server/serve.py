@@ -0,0 +1,54 @@
+"""
+Production launcher for the example server.
+
+``main()`` in the package is meant for development: it reloads on code
+changes and runs a single process. This entry point runs
+``settings.serve_workers`` uvicorn worker processes (one per CPU core by
+default) without reload. On SIGTERM each worker stops accepting connections
+and gives in-flight SSE streams up to ``serve_graceful_shutdown_seconds`` to
+finish before cancelling them.
+
+Per-process state (caches, resumable runs, metrics) is not shared between
+workers. With more than one worker, metric series are labelled with the
+worker's pid (``METRICS_WORKER_LABEL``).
+
+Usage:
+    poetry run serve
+"""
+
+import os
+
+import uvicorn
+
+from .config import settings
+
+
+def worker_count() -> int:
+    """Number of worker processes to start; 0 in the settings means one per CPU core."""
+    return settings.serve_workers or os.cpu_count() or 1
+
+
+def main():
+    """Run uvicorn with the production settings."""
+    workers = worker_count()
+    if workers > 1:
+        # Read by the settings of each worker process
+        os.environ.setdefault("METRICS_WORKER_LABEL", "true")
+    port = int(os.getenv("PORT", "8000"))
+    uvicorn.run(
+        settings.serve_app,
+        host=settings.serve_host,
+        port=port,
+        workers=workers,
+        # "auto" picks uvloop and httptools when they are installed
+        loop=settings.serve_loop,
+        http=settings.serve_http,
+        backlog=settings.serve_backlog,
+        timeout_keep_alive=settings.serve_keep_alive_seconds,
+        timeout_graceful_shutdown=settings.serve_graceful_shutdown_seconds,
+        access_log=settings.serve_access_log,
+    )
+
+
+if __name__ == "__main__":
+    main()
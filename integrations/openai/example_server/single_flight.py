@@ -0,0 +1,241 @@
+"""
+Single-flight sharing of identical concurrent runs.
+
+Requests with the same normalized input (messages, tools, model and system
+prompt, as hashed for the response cache) that arrive while a run of that
+input is streaming attach to it instead of opening another upstream stream.
+The first request's frames are driven by their own task into a shared list;
+every subscriber reads the list from the start, so a late joiner is replayed
+everything sent so far, and then follows new frames as they arrive.
+
+Per-run identifiers inside frames (such as a message or run id) are
+rewritten for each subscriber: ``substitutions`` maps a name to the exact
+text of the identifier as it appears in the frames of that subscriber's run.
+
+The upstream stream is cancelled once every subscriber has gone. A
+subscriber counts from the moment it is handed its ``Subscription`` until the
+subscription is released: when its iteration ends, fails or is closed, or,
+if the server never started reading it, when its response is done (see
+``AdmittedStreamingResponse``). A flight takes new subscribers only while it
+is running and has buffered at most ``max_bytes``; a finished flight is
+forgotten (exact repeats after it are the response cache's job).
+
+The admission permit of the request that started a flight is handed to the
+flight, and released when the upstream run ends rather than when that
+request's response does.
+"""
+
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+
+from .admission import Lease
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """
+    Frames of one upstream run, shared by its subscribers.
+
+    Args:
+        key: Key of the normalized input
+        substitutions: Name -> identifier text in the frames of this run
+        max_bytes: Buffered size after which no one may join
+    """
+
+    def __init__(self, key: str, substitutions: Dict[str, str], max_bytes: int):
+        self.key = key
+        self.substitutions = substitutions
+        self.max_bytes = max_bytes
+        self.frames: List[bytes] = []
+        self.size = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def joinable(self) -> bool:
+        return not self.done and self.size <= self.max_bytes
+
+    def append(self, frame: bytes) -> None:
+        self.frames.append(frame)
+        self.size += len(frame)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def follow(self, substitutions: Optional[Dict[str, str]] = None) -> "Subscription":
+        """
+        Subscribe to the run, from its first frame, with this subscriber's
+        identifiers.
+
+        The subscriber is counted from this call, not from its first read, so
+        the run is not cancelled if every other subscriber leaves before this
+        one starts reading.
+        """
+        replacements = [
+            (self.substitutions[name].encode(), text.encode())
+            for name, text in (substitutions or {}).items()
+            if name in self.substitutions and self.substitutions[name] != text
+        ]
+        return Subscription(self, replacements)
+
+    async def _follow(
+        self,
+        subscription: "Subscription",
+        replacements: List[Tuple[bytes, bytes]],
+    ) -> AsyncIterator[bytes]:
+        try:
+            index = 0
+            while True:
+                changed = self._changed
+                while index < len(self.frames):
+                    frame = self.frames[index]
+                    index += 1
+                    for old, new in replacements:
+                        frame = frame.replace(old, new)
+                    yield frame
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            subscription.release()
+
+    def _unsubscribe(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            # Nobody is left to stream to
+            self.task.cancel()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class Subscription:
+    """
+    One subscriber's frames of a flight.
+
+    Iterating it yields every frame of the run from the first until the run
+    ends, then raises what the run raised, if anything. ``release`` it if it
+    may never be iterated; ending, failing or closing the iteration releases
+    it too, and releasing twice is harmless.
+    """
+
+    __slots__ = ("flight", "released", "_frames")
+
+    def __init__(self, flight: Flight, replacements: List[Tuple[bytes, bytes]]):
+        self.flight = flight
+        self.released = False
+        flight.subscribers += 1
+        self._frames = flight._follow(self, replacements)
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    def __anext__(self):
+        return self._frames.__anext__()
+
+    async def aclose(self) -> None:
+        try:
+            await self._frames.aclose()
+        finally:
+            self.release()
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.flight._unsubscribe()
+
+
+class SingleFlight:
+    """
+    Registry of the runs in flight, by key.
+
+    Args:
+        max_bytes: Buffered size of a run after which no one may join it
+    """
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.started = 0
+        self.joined = 0
+        self._flights: Dict[str, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def join(self, key: str, substitutions: Optional[Dict[str, str]] = None) -> Optional[Subscription]:
+        """Follow the run in flight under ``key``, or return None if there is none to join."""
+        flight = self._flights.get(key)
+        if flight is None or not flight.joinable:
+            return None
+        self.joined += 1
+        return flight.follow(substitutions)
+
+    def start(
+        self,
+        key: str,
+        start: Callable[[], AsyncIterator[Union[str, bytes]]],
+        substitutions: Optional[Dict[str, str]] = None,
+        lease: Optional[Lease] = None,
+    ) -> Subscription:
+        """
+        Start the run ``start`` returns in the background under ``key`` and follow it.
+
+        Args:
+            key: Key of the normalized input
+            start: Opens the run's frames
+            substitutions: Name -> identifier text in the frames of this run
+            lease: Released when the run ends, however it ends, e.g. the
+                admission permit of the request that starts it
+        """
+        flight = Flight(key, substitutions or {}, self.max_bytes)
+        flight.task = asyncio.ensure_future(self._drive(flight, start()))
+        if lease is not None:
+            # Also called if the task is cancelled before it first runs
+            flight.task.add_done_callback(lambda _: lease.release())
+        self._flights[key] = flight
+        self.started += 1
+        return flight.follow(substitutions)
+
+    def subscribe(
+        self,
+        key: str,
+        start: Callable[[], AsyncIterator[Union[str, bytes]]],
+        substitutions: Optional[Dict[str, str]] = None,
+        lease: Optional[Lease] = None,
+    ) -> Subscription:
+        """
+        Follow the run in flight under ``key``, starting it if there is none to join.
+
+        ``lease`` is handed to the run if this call starts it, and released
+        at once otherwise: following a run costs no upstream work.
+        """
+        frames = self.join(key, substitutions)
+        if frames is None:
+            return self.start(key, start, substitutions, lease)
+        if lease is not None:
+            lease.release()
+        return frames
+
+    async def _drive(self, flight: Flight, source: AsyncIterator[Union[str, bytes]]) -> None:
+        try:
+            async for frame in source:
+                flight.append(frame.encode() if isinstance(frame, str) else frame)
+            flight.finish()
+        except asyncio.CancelledError as error:
+            flight.finish(error)
+        except Exception as error:
+            flight.finish(error)
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
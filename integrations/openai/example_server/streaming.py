@@ -0,0 +1,268 @@
+"""
+Batched AG-UI event encoding for the OpenAI streaming loop.
+
+``ChunkBatcher`` accumulates upstream text and tool-call argument deltas and
+emits one ``TextMessageChunkEvent``/``ToolCallArgsEvent`` per flush window
+instead of one per upstream chunk. ``ToolCallAssembler`` tracks the tool
+calls of a completion by their index and brackets each call's arguments with
+``ToolCallStartEvent`` and ``ToolCallEndEvent``.
+
+Events built here come from trusted, already-typed upstream data, so by
+default SSE frames are written straight from cached templates, skipping
+pydantic validation and model serialization (``model_construct`` is not used:
+it is slower than validating these small models). The output is the same JSON
+``EventEncoder`` writes.
+"""
+
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from ag_ui.core import EventType
+from ag_ui.core.events import (
+    TextMessageChunkEvent,
+    ToolCallArgsEvent,
+    ToolCallEndEvent,
+    ToolCallStartEvent,
+)
+from ag_ui.encoder import EventEncoder
+
+from . import metrics
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+_encode_seconds = metrics.stage_seconds.labels("encode")
+
+
+class ChunkBatcher:
+    """
+    Accumulate upstream deltas into AG-UI chunk events.
+
+    Args:
+        encoder: Encoder used to serialize flushed events
+        message_id: Id of the assistant message being streamed
+        max_chars: Flush once this many characters are buffered (0 disables)
+        max_delay: Flush once the oldest buffered delta is this many seconds
+            old (0 disables)
+        validate: Build and serialize pydantic events instead of writing
+            frames from templates
+    """
+
+    def __init__(
+        self,
+        encoder: EventEncoder,
+        message_id: str,
+        max_chars: int = 512,
+        max_delay: float = 0.02,
+        validate: bool = False,
+    ):
+        self.encoder = encoder
+        self.message_id = message_id
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        # Templates only reproduce the SSE encoding
+        self.validate = validate or encoder.get_content_type() != "text/event-stream"
+        self._text_prefix = (
+            'data: {"type":"TEXT_MESSAGE_CHUNK","messageId":'
+            + _json_encoder.encode(message_id)
+            + ',"delta":'
+        )
+        # ("text", None) or ("args", tool_call_id)
+        self._key: Optional[tuple] = None
+        self._parts: List[str] = []
+        self._size = 0
+        self._started = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_chars > 0 or self.max_delay > 0
+
+    def text(self, delta: str) -> List[str]:
+        """Buffer a text delta; return encoded events that are due."""
+        return self._add(("text", None), delta)
+
+    def tool_call_start(self, tool_call_id: str, tool_call_name: str) -> List[str]:
+        """Flush buffered deltas and encode the start of a tool call."""
+        events = self.flush()
+        if not self.validate:
+            events.append(
+                'data: {"type":"TOOL_CALL_START","toolCallId":' + _json_encoder.encode(tool_call_id)
+                + ',"toolCallName":' + _json_encoder.encode(tool_call_name)
+                + ',"parentMessageId":' + _json_encoder.encode(self.message_id) + "}\n\n"
+            )
+        else:
+            events.append(self.encoder.encode(ToolCallStartEvent(
+                type=EventType.TOOL_CALL_START,
+                tool_call_id=tool_call_id,
+                tool_call_name=tool_call_name,
+                parent_message_id=self.message_id,
+            )))
+        return events
+
+    def tool_call_args(self, tool_call_id: str, delta: str) -> List[str]:
+        """Buffer an argument delta of a started tool call."""
+        return self._add(("args", tool_call_id), delta)
+
+    def tool_call_end(self, tool_call_id: str) -> List[str]:
+        """Flush buffered deltas and encode the end of a tool call."""
+        events = self.flush()
+        if not self.validate:
+            events.append('data: {"type":"TOOL_CALL_END","toolCallId":' + _json_encoder.encode(tool_call_id) + "}\n\n")
+        else:
+            events.append(self.encoder.encode(ToolCallEndEvent(
+                type=EventType.TOOL_CALL_END,
+                tool_call_id=tool_call_id,
+            )))
+        return events
+
+    def flush(self) -> List[str]:
+        """Encode the buffered deltas as one event and reset the buffer."""
+        if self._key is None:
+            return []
+        started = time.perf_counter()
+        events = self._encode()
+        _encode_seconds.observe(time.perf_counter() - started)
+        return events
+
+    def _encode(self) -> List[str]:
+        kind, tool_call_id = self._key
+        delta = "".join(self._parts)
+        self._key = None
+        self._parts = []
+        self._size = 0
+        if kind == "text":
+            if not self.validate:
+                return [self._text_prefix + _json_encoder.encode(delta) + "}\n\n"]
+            event = TextMessageChunkEvent(
+                type=EventType.TEXT_MESSAGE_CHUNK,
+                message_id=self.message_id,
+                delta=delta,
+            )
+        else:
+            if not self.validate:
+                return [
+                    'data: {"type":"TOOL_CALL_ARGS","toolCallId":' + _json_encoder.encode(tool_call_id)
+                    + ',"delta":' + _json_encoder.encode(delta) + "}\n\n"
+                ]
+            event = ToolCallArgsEvent(
+                type=EventType.TOOL_CALL_ARGS,
+                tool_call_id=tool_call_id,
+                delta=delta,
+            )
+        return [self.encoder.encode(event)]
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until buffered deltas must be flushed, or None if nothing is pending."""
+        if self._key is None or not self.max_delay:
+            return None
+        return max(0.0, self._started + self.max_delay - time.monotonic())
+
+    def _add(self, key: tuple, delta: str) -> List[str]:
+        if not self.enabled:
+            self._key = key
+            self._parts.append(delta)
+            return self.flush()
+
+        events = []
+        if self._key is not None and self._key != key:
+            events.extend(self.flush())
+        if self._key is None:
+            self._key = key
+            self._started = time.monotonic()
+        self._parts.append(delta)
+        self._size += len(delta)
+        if self.max_chars and self._size >= self.max_chars:
+            events.extend(self.flush())
+        elif self.max_delay and time.monotonic() - self._started >= self.max_delay:
+            events.extend(self.flush())
+        return events
+
+
+class _ToolCall:
+    __slots__ = ("id", "name", "pending", "started")
+
+    def __init__(self):
+        self.id: Optional[str] = None
+        self.name: Optional[str] = None
+        # Argument deltas received before the id and name are known
+        self.pending: List[str] = []
+        self.started = False
+
+
+class ToolCallAssembler:
+    """
+    Turn the tool-call deltas of one streamed completion into AG-UI events.
+
+    Calls are keyed by their ``index``, so any number of calls may stream in
+    one completion, interleaved or one after the other, several per chunk.
+    The id and name usually come with a call's first delta only; argument
+    deltas that arrive before both are known are held back, and the call is
+    started as soon as they are. Upstreams that send no ``index`` get each
+    delta's position in the chunk; a new id at a known index then starts a
+    new call. ``finish`` ends every call, giving calls that never received an
+    id a generated one.
+
+    Args:
+        batcher: Encodes the events and batches argument deltas
+    """
+
+    def __init__(self, batcher: ChunkBatcher):
+        self.batcher = batcher
+        self._calls: Dict[int, _ToolCall] = {}
+        # Calls in the order they were first seen, to end them in that order
+        self._order: List[_ToolCall] = []
+
+    def add(self, deltas: List[Any]) -> List[str]:
+        """Apply one chunk's ``delta.tool_calls``; return the encoded events that are due."""
+        events: List[str] = []
+        for position, delta in enumerate(deltas):
+            index = getattr(delta, "index", None)
+            if index is None:
+                index = position
+            tool_call_id = delta.id
+            call = self._calls.get(index)
+            if call is None or (tool_call_id and call.id and tool_call_id != call.id):
+                call = self._calls[index] = _ToolCall()
+                self._order.append(call)
+            if tool_call_id and call.id is None:
+                call.id = tool_call_id
+            function = delta.function
+            arguments = None
+            if function is not None:
+                if function.name and call.name is None:
+                    call.name = function.name
+                arguments = function.arguments
+            if call.started:
+                if arguments:
+                    events.extend(self.batcher.tool_call_args(call.id, arguments))
+                continue
+            if arguments:
+                call.pending.append(arguments)
+            if call.id is not None and call.name is not None:
+                events.extend(self._start(call))
+        return events
+
+    def finish(self) -> List[str]:
+        """End every call of the completion and reset."""
+        events: List[str] = []
+        for call in self._order:
+            if not call.started:
+                if call.id is None:
+                    call.id = f"call_{uuid.uuid4().hex}"
+                if call.name is None:
+                    call.name = ""
+                events.extend(self._start(call))
+            events.extend(self.batcher.tool_call_end(call.id))
+        self._calls.clear()
+        self._order.clear()
+        return events
+
+    def _start(self, call: _ToolCall) -> List[str]:
+        call.started = True
+        events = self.batcher.tool_call_start(call.id, call.name)
+        if call.pending:
+            events.extend(self.batcher.tool_call_args(call.id, "".join(call.pending)))
+            call.pending.clear()
+        return events
+
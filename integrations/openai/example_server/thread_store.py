@@ -0,0 +1,582 @@
+"""
+Server-side store of conversation threads.
+
+Clients normally resend a thread's whole history with every run. With the
+thread store enabled they may instead send only the messages added since
+their last request, together with the thread's history version in the
+``X-Thread-Version`` header; the server puts the stored history in front of
+them, validates the merged thread and stores the new messages:
+
+- a request without the header carries the full history, which replaces the
+  stored thread (so existing clients keep working unchanged)
+- a request with the header carries only new messages; if the stored version
+  differs (another tab wrote to the thread, or it was evicted) the request is
+  answered 409 and the client resends in full
+- every accepted request is answered with the thread's next version in
+  ``X-Thread-Version``; its messages are stored only once its run has
+  completed without error, so a rejected, failed or abandoned run leaves the
+  stored thread unchanged (the client's next request with that version is
+  answered 409). Replies the server streamed are not stored, the client sends
+  them back with its next message
+
+Thread ids are chosen by clients and easily guessed, so a version is a random
+token issued by the server for each write, not a counter: appending to a
+thread, and reading its history back through the model, takes the token of
+its latest write, which only the client that made it was sent. A 409 does not
+disclose the current version. Threads are kept in a pluggable backend:
+``MemoryThreadStore`` (per process) or ``SqliteThreadStore`` (a local file
+shared by every worker on the host, appending only the new rows per run).
+Both evict idle threads after a TTL and the least recently used threads
+beyond their thread and byte limits, and compact threads longer than
+``max_messages`` by dropping their oldest turns.
+"""
+
+import asyncio
+import json
+import logging
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from typing import Any, AsyncIterator, Callable, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional fast backend
+    orjson = None
+
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+VERSION_HEADER = "X-Thread-Version"
+
+# Version of a thread that is not stored
+NO_VERSION = "0"
+
+# Messages kept in front of any compaction
+PINNED_ROLES = ("system", "developer")
+
+
+def dumps(message: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(message)
+    return json.dumps(message, separators=(",", ":")).encode()
+
+
+def loads(blob: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(blob)
+    return json.loads(blob)
+
+
+def parse_thread_version(value: Optional[str]) -> Optional[str]:
+    """
+    Parse an ``X-Thread-Version`` header.
+
+    Returns:
+        None if absent (the body carries the full history), else the version
+    """
+    if value is None:
+        return None
+    return value.strip()
+
+
+def new_version() -> str:
+    """A fresh, unguessable thread version."""
+    return secrets.token_urlsafe(16)
+
+
+def message_role(message: Any) -> Optional[str]:
+    return message.get("role") if isinstance(message, dict) else None
+
+
+def compaction_range(roles: Sequence[Optional[str]], max_messages: int) -> Optional[Tuple[int, int]]:
+    """
+    Messages to drop from a thread longer than ``max_messages``.
+
+    Leading system messages are kept. The oldest turns are dropped until about
+    half the limit remains, so the kept history then stays unchanged (and
+    cacheable) for many runs; the cut is moved to a user message so no turn,
+    such as a tool call and its result, is split.
+
+    Returns:
+        ``(start, end)`` slice of the messages to drop, or None
+    """
+    if not max_messages or len(roles) <= max_messages:
+        return None
+    pinned = 0
+    while pinned < len(roles) and roles[pinned] in PINNED_ROLES:
+        pinned += 1
+    target = max(pinned + 1, len(roles) - max(1, max_messages // 2))
+    cut = next((i for i in range(target, len(roles)) if roles[i] == "user"), None)
+    if cut is None:
+        cut = next((i for i in range(target - 1, pinned, -1) if roles[i] == "user"), None)
+    if cut is None or cut <= pinned:
+        return None
+    return pinned, cut
+
+
+class StoredThread(NamedTuple):
+    """A thread's raw messages, its version and their total encoded size."""
+    version: str
+    messages: List[Any]
+    size: int
+
+
+class ThreadVersionConflict(Exception):
+    """A request's history version does not match the stored thread."""
+
+    def __init__(self):
+        super().__init__("Thread history version mismatch")
+
+    def to_response(self) -> Response:
+        """The 409 response asking the client to resend the full history."""
+        return Response(
+            content=json.dumps({"detail": "Thread history version mismatch, resend the full history"}),
+            media_type="application/json",
+            status_code=HTTPStatus.CONFLICT,
+        )
+
+
+class ThreadBackend:
+    """
+    Interface of a thread store backend.
+
+    ``blocking`` backends are called from a worker thread.
+    """
+
+    blocking = False
+
+    def load(self, thread_id: str) -> Optional[StoredThread]:
+        raise NotImplementedError
+
+    def append(self, thread_id: str, version: str, messages: List[Any], new_version: str) -> None:
+        """
+        Add ``messages`` to a thread at ``version``, moving it to ``new_version``.
+
+        Raises:
+            ThreadVersionConflict: The thread is not at ``version``
+        """
+        raise NotImplementedError
+
+    def replace(self, thread_id: str, messages: List[Any], new_version: str) -> None:
+        """Store ``messages`` as the thread's full history at ``new_version``."""
+        raise NotImplementedError
+
+
+class _Thread:
+    __slots__ = ("version", "messages", "sizes", "size", "accessed")
+
+    def __init__(self, version: str):
+        self.version = version
+        self.messages: List[Any] = []
+        self.sizes: List[int] = []
+        self.size = 0
+        self.accessed = time.time()
+
+
+class MemoryThreadStore(ThreadBackend):
+    """
+    In-process LRU thread store.
+
+    Args:
+        ttl: Seconds an idle thread is kept
+        max_threads: Maximum number of threads
+        max_bytes: Maximum total size of stored messages
+        max_messages: Messages per thread before it is compacted (0 disables)
+    """
+
+    def __init__(
+        self,
+        ttl: float = 86400.0,
+        max_threads: int = 10000,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_messages: int = 0,
+    ):
+        self.ttl = ttl
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.total_bytes = 0
+        self._threads: "OrderedDict[str, _Thread]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, thread_id: str) -> Optional[StoredThread]:
+        with self._lock:
+            thread = self._get(thread_id)
+            if thread is None:
+                return None
+            return StoredThread(thread.version, list(thread.messages), thread.size)
+
+    def append(self, thread_id: str, version: str, messages: List[Any], new_version: str) -> None:
+        with self._lock:
+            thread = self._get(thread_id)
+            current = thread.version if thread is not None else NO_VERSION
+            if current != version:
+                raise ThreadVersionConflict()
+            if thread is None:
+                thread = self._threads[thread_id] = _Thread(NO_VERSION)
+            self._write(thread, messages, new_version)
+
+    def replace(self, thread_id: str, messages: List[Any], new_version: str) -> None:
+        with self._lock:
+            previous = self._get(thread_id)
+            if previous is not None:
+                self.total_bytes -= previous.size
+            thread = self._threads[thread_id] = _Thread(NO_VERSION)
+            self._write(thread, messages, new_version)
+
+    def _get(self, thread_id: str) -> Optional[_Thread]:
+        thread = self._threads.get(thread_id)
+        if thread is None:
+            return None
+        if thread.accessed + self.ttl < time.time():
+            self._discard(thread_id)
+            return None
+        self._threads.move_to_end(thread_id)
+        thread.accessed = time.time()
+        return thread
+
+    def _write(self, thread: _Thread, messages: List[Any], new_version: str) -> None:
+        sizes = [len(dumps(message)) for message in messages]
+        thread.messages.extend(messages)
+        thread.sizes.extend(sizes)
+        thread.size += sum(sizes)
+        self.total_bytes += sum(sizes)
+        dropped = compaction_range([message_role(m) for m in thread.messages], self.max_messages)
+        if dropped is not None:
+            start, end = dropped
+            freed = sum(thread.sizes[start:end])
+            del thread.messages[start:end], thread.sizes[start:end]
+            thread.size -= freed
+            self.total_bytes -= freed
+        thread.version = new_version
+        while self._threads and (
+            len(self._threads) > self.max_threads or self.total_bytes > self.max_bytes
+        ):
+            _, evicted = self._threads.popitem(last=False)
+            self.total_bytes -= evicted.size
+
+    def _discard(self, thread_id: str) -> None:
+        thread = self._threads.pop(thread_id, None)
+        if thread is not None:
+            self.total_bytes -= thread.size
+
+
+class SqliteThreadStore(ThreadBackend):
+    """
+    Local on-disk thread store backed by sqlite.
+
+    Messages are stored one row each, so a run only writes the messages it
+    adds. Freed pages are returned to the file system after evictions.
+
+    Args:
+        path: Database file
+        ttl: Seconds an idle thread is kept
+        max_threads: Maximum number of threads
+        max_bytes: Maximum total size of stored messages
+        max_messages: Messages per thread before it is compacted (0 disables)
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 86400.0,
+        max_threads: int = 100000,
+        max_bytes: int = 1024 * 1024 * 1024,
+        max_messages: int = 0,
+    ):
+        self.ttl = ttl
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Only takes effect on a new database file
+        self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS threads ("
+            " thread_id TEXT PRIMARY KEY, version TEXT NOT NULL, next_seq INTEGER NOT NULL,"
+            " count INTEGER NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS thread_messages ("
+            " thread_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT, body BLOB NOT NULL,"
+            " size INTEGER NOT NULL, PRIMARY KEY (thread_id, seq)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS threads_accessed ON threads (accessed)")
+
+    def load(self, thread_id: str) -> Optional[StoredThread]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version, size, accessed FROM threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            version, size, accessed = row
+            if accessed + self.ttl < now:
+                self._transaction(self._delete, thread_id)
+                return None
+            bodies = self._db.execute(
+                "SELECT body FROM thread_messages WHERE thread_id = ? ORDER BY seq", (thread_id,)
+            ).fetchall()
+            self._db.execute("UPDATE threads SET accessed = ? WHERE thread_id = ?", (now, thread_id))
+        return StoredThread(str(version), [loads(body) for body, in bodies], size)
+
+    def append(self, thread_id: str, version: str, messages: List[Any], new_version: str) -> None:
+        rows = [(message_role(message), dumps(message)) for message in messages]
+        with self._lock:
+            self._transaction(self._append, thread_id, version, rows, new_version)
+
+    def replace(self, thread_id: str, messages: List[Any], new_version: str) -> None:
+        rows = [(message_role(message), dumps(message)) for message in messages]
+        with self._lock:
+            self._transaction(self._replace, thread_id, rows, new_version)
+
+    def _transaction(self, function, *args):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            result = function(*args)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _append(
+        self, thread_id: str, version: str, rows: List[Tuple[Optional[str], bytes]], new_version: str
+    ) -> None:
+        row = self._db.execute(
+            "SELECT version, next_seq, accessed FROM threads WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        current = str(row[0]) if row is not None and row[2] + self.ttl >= time.time() else NO_VERSION
+        if current != version:
+            raise ThreadVersionConflict()
+        if current == NO_VERSION:
+            self._replace(thread_id, rows, new_version)
+        else:
+            self._write(thread_id, row[1], rows, new_version)
+
+    def _replace(self, thread_id: str, rows: List[Tuple[Optional[str], bytes]], new_version: str) -> None:
+        row = self._db.execute(
+            "SELECT next_seq FROM threads WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        next_seq = row[0] if row is not None else 0
+        self._db.execute("DELETE FROM thread_messages WHERE thread_id = ?", (thread_id,))
+        self._db.execute(
+            "INSERT OR REPLACE INTO threads (thread_id, version, next_seq, count, size, accessed)"
+            " VALUES (?, ?, ?, 0, 0, ?)",
+            (thread_id, NO_VERSION, next_seq, time.time()),
+        )
+        self._write(thread_id, next_seq, rows, new_version)
+
+    def _write(
+        self, thread_id: str, next_seq: int, rows: List[Tuple[Optional[str], bytes]], new_version: str
+    ) -> None:
+        now = time.time()
+        self._db.executemany(
+            "INSERT INTO thread_messages (thread_id, seq, role, body, size) VALUES (?, ?, ?, ?, ?)",
+            [(thread_id, next_seq + i, role, body, len(body)) for i, (role, body) in enumerate(rows)],
+        )
+        added = sum(len(body) for _, body in rows)
+        self._db.execute(
+            "UPDATE threads SET version = ?, next_seq = ?, count = count + ?, size = size + ?,"
+            " accessed = ? WHERE thread_id = ?",
+            (new_version, next_seq + len(rows), len(rows), added, now, thread_id),
+        )
+        if self.max_messages:
+            self._compact(thread_id)
+
+        evicted = self._db.execute(
+            "SELECT thread_id, size FROM threads WHERE accessed < ?", (now - self.ttl,)
+        ).fetchall()
+        count, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM threads"
+        ).fetchone()
+        count -= len(evicted)
+        total -= sum(size for _, size in evicted)
+        if count > self.max_threads or total > self.max_bytes:
+            for other, size in self._db.execute(
+                "SELECT thread_id, size FROM threads WHERE accessed >= ? ORDER BY accessed",
+                (now - self.ttl,),
+            ).fetchall():
+                if (count <= self.max_threads and total <= self.max_bytes) or other == thread_id:
+                    break
+                evicted.append((other, size))
+                count -= 1
+                total -= size
+        for other, _ in evicted:
+            self._delete(other)
+        if evicted:
+            self._db.execute("PRAGMA incremental_vacuum")
+
+    def _compact(self, thread_id: str) -> None:
+        count, = self._db.execute(
+            "SELECT count FROM threads WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        if count <= self.max_messages:
+            return
+        rows = self._db.execute(
+            "SELECT seq, role, size FROM thread_messages WHERE thread_id = ? ORDER BY seq", (thread_id,)
+        ).fetchall()
+        dropped = compaction_range([role for _, role, _ in rows], self.max_messages)
+        if dropped is None:
+            return
+        start, end = dropped
+        freed = sum(size for _, _, size in rows[start:end])
+        self._db.execute(
+            "DELETE FROM thread_messages WHERE thread_id = ? AND seq >= ? AND seq < ?",
+            (thread_id, rows[start][0], rows[end][0]),
+        )
+        self._db.execute(
+            "UPDATE threads SET count = count - ?, size = size - ? WHERE thread_id = ?",
+            (end - start, freed, thread_id),
+        )
+
+    def _delete(self, thread_id: str) -> None:
+        self._db.execute("DELETE FROM thread_messages WHERE thread_id = ?", (thread_id,))
+        self._db.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+
+
+class ThreadWrite:
+    """
+    The messages of an accepted request, stored once its run has completed.
+
+    Args:
+        store: Thread store to write to
+        thread_id: Thread the messages belong to
+        messages: Raw messages of the request
+        stored: Stored thread the messages follow, or None if they are the
+            full history
+    """
+
+    def __init__(
+        self,
+        store: "ThreadStore",
+        thread_id: str,
+        messages: List[Any],
+        stored: Optional[StoredThread] = None,
+    ):
+        self.store = store
+        self.thread_id = thread_id
+        self.messages = messages
+        self.stored = stored
+        # Sent to the client up front, valid once committed
+        self.version = new_version()
+
+    async def commit(self) -> bool:
+        """
+        Store the messages under ``version``.
+
+        Returns:
+            False if another request wrote to the thread first or the write
+            failed; the client's next request with ``version`` is then
+            answered 409
+        """
+        store = self.store
+        try:
+            if self.stored is None:
+                await store._call(store.backend.replace, self.thread_id, self.messages, self.version)
+                store.replaced += 1
+            else:
+                await store._call(
+                    store.backend.append, self.thread_id, self.stored.version, self.messages, self.version
+                )
+                store.merged += 1
+                store.messages_not_resent += len(self.stored.messages)
+        except ThreadVersionConflict:
+            store.conflicts += 1
+            return False
+        except Exception:
+            logger.exception("Failed to store thread")
+            return False
+        return True
+
+
+async def commit_on_success(
+    frames: AsyncIterator[T],
+    write: ThreadWrite,
+    failed: Callable[[T], bool],
+) -> AsyncIterator[T]:
+    """
+    Relay ``frames`` and commit ``write`` once they end.
+
+    Nothing is stored if the stream raises, is closed early (the client left)
+    or relayed a frame for which ``failed`` is true.
+    """
+    ok = True
+    async for frame in frames:
+        if ok and failed(frame):
+            ok = False
+        yield frame
+    if ok:
+        await write.commit()
+
+
+class ThreadStore:
+    """
+    Loads and merges thread histories on behalf of the endpoints.
+
+    Args:
+        backend: Backing store
+    """
+
+    def __init__(self, backend: ThreadBackend):
+        self.backend = backend
+        self.merged = 0
+        self.replaced = 0
+        self.conflicts = 0
+        self.messages_not_resent = 0
+
+    async def load(self, thread_id: str, version: str) -> StoredThread:
+        """
+        Return the stored thread a request's new messages follow.
+
+        Raises:
+            ThreadVersionConflict: The thread is not stored at ``version``
+        """
+        stored = await self._call(self.backend.load, thread_id)
+        current = stored.version if stored is not None else NO_VERSION
+        if not secrets.compare_digest(current.encode(), version.encode()):
+            self.conflicts += 1
+            raise ThreadVersionConflict()
+        return stored or StoredThread(NO_VERSION, [], 0)
+
+    def write(self, thread_id: str, messages: List[Any], stored: Optional[StoredThread] = None) -> ThreadWrite:
+        """
+        Prepare storing a request's messages, merged onto ``stored`` if given
+        and as the thread's full history otherwise.
+        """
+        return ThreadWrite(self, thread_id, messages, stored)
+
+    async def _call(self, function, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+
+def create_thread_store(
+    backend: str,
+    path: str,
+    ttl: float,
+    max_threads: int,
+    max_bytes: int,
+    max_messages: int,
+) -> ThreadStore:
+    """Build a ``ThreadStore`` for the configured backend ("memory" or "sqlite")."""
+    if backend == "memory":
+        store: ThreadBackend = MemoryThreadStore(ttl, max_threads, max_bytes, max_messages)
+    elif backend == "sqlite":
+        store = SqliteThreadStore(path, ttl, max_threads, max_bytes, max_messages)
+    else:
+        raise ValueError(f"Unknown thread store backend {backend!r}, expected 'memory' or 'sqlite'")
+    return ThreadStore(store)
@@ -0,0 +1,236 @@
+"""
+Tuned HTTP transport for the upstream model API.
+
+``UpstreamTransport`` is an ``httpx`` transport for a single pooled client
+shared by every request of a worker. On top of the usual pool limits it:
+
+- enables HTTP/2 when the ``h2`` package is installed, so hundreds of
+  concurrent streams to the same host share a few multiplexed connections
+- caches DNS answers for a TTL (concurrent lookups of one host share a
+  single query) and spreads new connections across the returned addresses,
+  instead of resolving the host for every connection
+- applies a connect timeout even when the SDK passes ``timeout=None``
+- counts requests and opened connections, so the connection reuse rate can
+  be exported as metrics
+"""
+
+import asyncio
+import importlib.util
+import ipaddress
+import itertools
+import logging
+import socket
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpcore
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available() -> bool:
+    """Whether the optional ``h2`` package needed for HTTP/2 is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+class CachingResolver:
+    """
+    ``getaddrinfo`` results cached per host and port.
+
+    Args:
+        ttl: Seconds an answer is reused (0 disables caching)
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._answers: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._pending: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._rotation = itertools.count()
+
+    async def resolve(self, host: str, port: int) -> List[str]:
+        """
+        Addresses of ``host``, rotated so consecutive connections start with
+        a different address.
+        """
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+
+        key = (host, port)
+        answer = self._answers.get(key)
+        if self.ttl <= 0:
+            self.misses += 1
+            addresses = await self.lookup(host, port)
+        elif answer is not None and answer[0] > time.monotonic():
+            self.hits += 1
+            addresses = answer[1]
+        else:
+            pending = self._pending.get(key)
+            if pending is None:
+                self.misses += 1
+                pending = self._pending[key] = asyncio.ensure_future(self._refresh(key))
+            else:
+                self.hits += 1
+            addresses = await asyncio.shield(pending)
+
+        start = next(self._rotation) % len(addresses)
+        return addresses[start:] + addresses[:start]
+
+    async def lookup(self, host: str, port: int) -> List[str]:
+        """Resolve ``host`` without the cache."""
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, port, type=socket.SOCK_STREAM
+        )
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    async def _refresh(self, key: Tuple[str, int]) -> List[str]:
+        try:
+            addresses = await self.lookup(*key)
+            self._answers[key] = (time.monotonic() + self.ttl, addresses)
+            return addresses
+        finally:
+            del self._pending[key]
+
+    def forget(self, host: str, port: int) -> None:
+        """Drop a cached answer, e.g. after none of its addresses accepted a connection."""
+        self._answers.pop((host, port), None)
+
+
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    Network backend resolving hosts through a ``CachingResolver``.
+
+    Args:
+        resolver: Resolver used for every TCP connection
+        connect_timeout: Timeout for resolving and connecting when the
+            caller does not set one
+        backend: Backend opening the connections, ``AnyIOBackend`` by default
+    """
+
+    def __init__(
+        self,
+        resolver: CachingResolver,
+        connect_timeout: Optional[float] = None,
+        backend: Optional[httpcore.AsyncNetworkBackend] = None,
+    ):
+        self.resolver = resolver
+        self.connect_timeout = connect_timeout
+        self.connections_opened = 0
+        self._backend = backend or httpcore.AnyIOBackend()
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options: Optional[Iterable] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        if timeout is None:
+            timeout = self.connect_timeout
+        try:
+            addresses = await asyncio.wait_for(self.resolver.resolve(host, port), timeout)
+        except asyncio.TimeoutError as error:
+            raise httpcore.ConnectTimeout(f"Resolving {host} timed out") from error
+        except OSError as error:
+            raise httpcore.ConnectError(str(error)) from error
+
+        last_error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                stream = await self._backend.connect_tcp(
+                    address,
+                    port,
+                    timeout=timeout,
+                    local_address=local_address,
+                    socket_options=socket_options,
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as error:
+                last_error = error
+                continue
+            self.connections_opened += 1
+            return stream
+
+        self.resolver.forget(host, port)
+        raise last_error
+
+    async def connect_unix_socket(
+        self,
+        path: str,
+        timeout: Optional[float] = None,
+        socket_options: Optional[Iterable] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(
+            path, timeout=timeout, socket_options=socket_options
+        )
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class UpstreamTransport(httpx.AsyncHTTPTransport):
+    """
+    Pooled ``httpx`` transport with HTTP/2, DNS caching and reuse counters.
+
+    Args:
+        max_connections: Maximum open connections
+        max_keepalive_connections: Maximum idle connections kept open
+        keepalive_expiry: Seconds an idle connection is kept
+        connect_timeout: Connect timeout used when the caller sets none
+        http2: Negotiate HTTP/2 if ``h2`` is installed
+        dns_cache_ttl: Seconds DNS answers are reused (0 disables)
+        resolver: Resolver to use instead of a new ``CachingResolver``
+        backend: Network backend under the DNS cache (for benchmarks)
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 200,
+        max_keepalive_connections: int = 50,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: Optional[float] = 5.0,
+        http2: bool = True,
+        dns_cache_ttl: float = 60.0,
+        resolver: Optional[CachingResolver] = None,
+        backend: Optional[httpcore.AsyncNetworkBackend] = None,
+    ):
+        if http2 and not http2_available():
+            logger.warning("HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        super().__init__(http2=http2)
+        self.network_backend = CachingNetworkBackend(
+            resolver or CachingResolver(dns_cache_ttl), connect_timeout, backend
+        )
+        # httpx has no public hook for the network backend, so the pool it
+        # built is replaced by one with the same TLS context and our limits
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=self._pool._ssl_context,
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+            http1=True,
+            http2=http2,
+            network_backend=self.network_backend,
+        )
+        self.requests = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        return await super().handle_async_request(request)
+
+    @property
+    def connections_opened(self) -> int:
+        return self.network_backend.connections_opened
+
+    @property
+    def reuse_rate(self) -> float:
+        """Share of requests served on an already open connection."""
+        if not self.requests:
+            return 0.0
+        return max(0.0, 1.0 - self.connections_opened / self.requests)
@@ -0,0 +1,49 @@
+"""
+Shared async client for the OpenAI-compatible upstream.
+
+A single ``AsyncOpenAI`` instance (and therefore a single pooled
+``httpx.AsyncClient``) is shared by every request handled by this worker, so
+concurrent chats reuse keep-alive connections instead of each opening their
+own and never block the event loop while waiting on the model. Its
+transport (see ``transport.py``) adds HTTP/2, DNS caching and reuse counters.
+"""
+
+import httpx
+from openai import AsyncOpenAI
+from .config import settings
+from .transport import UpstreamTransport
+
+transport = UpstreamTransport(
+    max_connections=settings.upstream_max_connections,
+    max_keepalive_connections=settings.upstream_max_keepalive_connections,
+    keepalive_expiry=settings.upstream_keepalive_expiry,
+    connect_timeout=settings.upstream_connect_timeout,
+    http2=settings.upstream_http2,
+    dns_cache_ttl=settings.upstream_dns_cache_ttl_seconds,
+)
+
+http_client = httpx.AsyncClient(
+    transport=transport,
+    timeout=httpx.Timeout(
+        settings.upstream_read_timeout,
+        connect=settings.upstream_connect_timeout,
+    ),
+)
+
+client = AsyncOpenAI(
+    api_key=settings.gemini_api_key,
+    base_url=settings.openai_base_url,
+    http_client=http_client,
+)
+
+# Target of hedged requests; an alternate base URL shares the connection pool
+hedge_client = (
+    client.with_options(base_url=settings.hedge_base_url)
+    if settings.hedge_base_url
+    else client
+)
+
+
+async def aclose():
+    """Close the shared upstream client and its connection pool."""
+    await client.close()
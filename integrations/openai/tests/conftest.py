@@ -0,0 +1,4 @@
+import os
+
+# The settings of example_server are read when it is imported
+os.environ.setdefault("GEMINI_API_KEY", "test")
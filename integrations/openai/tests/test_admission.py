@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from example_server import admission, app
+from example_server.admission import AdmissionController, AdmissionRejected
+from .asgi import post_and_leave
+
+
+def run_input() -> dict:
+    return {
+        "threadId": "thread-0",
+        "runId": "run-0",
+        "state": {},
+        "messages": [{"id": "msg-0", "role": "user", "content": "Hello"}],
+        "tools": [],
+        "context": [],
+        "forwardedProps": {},
+    }
+
+
+@pytest.mark.parametrize("spec_version", ["2.3", "2.4"])
+def test_permit_released_when_client_leaves_before_first_chunk(spec_version):
+    assert admission is not None
+    asyncio.run(post_and_leave(app, "/", run_input(), spec_version))
+    assert admission.active == 0
+
+
+def test_rate_limited_request_is_rejected_with_retry_after():
+    controller = AdmissionController(rate_per_key=1.0, burst_per_key=1.0)
+
+    async def scenario():
+        await controller.acquire("a")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("a")
+        # Other keys have their own bucket
+        await controller.acquire("b")
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == "rate_limited"
+    assert 0 < rejected.retry_after <= 1.0
+    response = rejected.to_response()
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_waiters_are_admitted_in_order_as_slots_free_up():
+    controller = AdmissionController(max_concurrent=2, max_concurrent_per_key=1)
+
+    async def scenario():
+        first = await controller.acquire("a")
+        waiting = [asyncio.ensure_future(controller.acquire(key)) for key in ("a", "a")]
+        await asyncio.sleep(0)
+        # Another key is not held up by a's queue while there is room
+        other = await asyncio.wait_for(controller.acquire("b"), 0.1)
+        assert controller.queued == 2 and not any(task.done() for task in waiting)
+        first.release()
+        second = await asyncio.wait_for(asyncio.shield(waiting[0]), 0.1)
+        assert not waiting[1].done()
+        second.release()
+        (await asyncio.wait_for(waiting[1], 0.1)).release()
+        other.release()
+
+    asyncio.run(scenario())
+    assert controller.active == 0 and controller.queued == 0
+
+
+def test_full_queue_rejects_at_once():
+    controller = AdmissionController(max_concurrent=1, max_queue=1)
+
+    async def scenario():
+        await controller.acquire("a")
+        waiter = asyncio.ensure_future(controller.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("a")
+        waiter.cancel()
+        return rejected.value.reason
+
+    assert asyncio.run(scenario()) == "queue_full"
+
+
+def test_request_is_shed_at_its_deadline():
+    controller = AdmissionController(max_concurrent=1, max_wait=0.01)
+
+    async def scenario():
+        await controller.acquire("a")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("a")
+        return rejected.value.reason
+
+    assert asyncio.run(scenario()) == "deadline"
+    assert controller.queued == 0 and controller.active == 1
+
+
+def test_cancelled_waiter_leaves_the_queue_and_holds_no_slot():
+    controller = AdmissionController(max_concurrent=1)
+
+    async def scenario():
+        permit = await controller.acquire("a")
+        waiter = asyncio.ensure_future(controller.acquire("a"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.queued == 0
+        permit.release()
+        # Released twice, or through a transferred permit, frees one slot
+        permit.release()
+        moved = (await controller.acquire("a")).transfer()
+        moved.release()
+        moved.release()
+
+    asyncio.run(scenario())
+    assert controller.active == 0
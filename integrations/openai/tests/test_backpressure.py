@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import pytest
+
+from example_server.backpressure import END, SlowConsumerError, StreamBuffer, merge_delta_frames
+
+
+def delta(text, message_id="m", event_id=None):
+    frame = f'data: {{"type":"TEXT_MESSAGE_CONTENT","messageId":"{message_id}","delta":"{text}"}}\n\n'
+    return f"id: {event_id}\n{frame}" if event_id else frame
+
+
+def drain(buffer):
+    frames = []
+    while not buffer.empty():
+        frame, error = buffer.get_nowait()
+        if frame is END:
+            break
+        frames.append(frame)
+    return frames
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        StreamBuffer("fifo")
+
+
+def test_block_policy_waits_for_room():
+    buffer = StreamBuffer("block", max_frames=2)
+
+    async def scenario():
+        await buffer.put("a")
+        await buffer.put("b")
+        blocked = asyncio.ensure_future(buffer.put("c"))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        assert buffer.get_nowait() == ("a", None)
+        await asyncio.wait_for(blocked, 0.1)
+        buffer.finish()
+        return drain(buffer)
+
+    assert asyncio.run(scenario()) == ["b", "c"]
+    assert buffer.peak_bytes == 2
+
+
+def test_oversized_frame_is_accepted_into_an_empty_buffer():
+    buffer = StreamBuffer("block", max_bytes=10)
+
+    async def scenario():
+        await buffer.put("x" * 20)
+        blocked = asyncio.ensure_future(buffer.put("y"))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        buffer.get_nowait()
+        await asyncio.wait_for(blocked, 0.1)
+
+    asyncio.run(scenario())
+
+
+def test_coalesce_policy_merges_deltas_into_the_newest_entry():
+    buffer = StreamBuffer("coalesce", max_frames=1)
+
+    async def scenario():
+        for frame in ("start\n\n", delta("a"), delta("b"), delta("c"), "end\n\n"):
+            await asyncio.wait_for(buffer.put(frame), 0.1)
+        return drain(buffer)
+
+    [entry] = asyncio.run(scenario())
+    assert entry == "start\n\n" + delta("abc") + "end\n\n"
+    assert buffer.coalesced == 4
+    assert buffer.bytes == 0
+
+
+def test_coalesce_policy_waits_once_the_byte_limit_is_reached():
+    buffer = StreamBuffer("coalesce", max_frames=1, max_bytes=len(delta("a")) + 1)
+
+    async def scenario():
+        await buffer.put(delta("a"))
+        blocked = asyncio.ensure_future(buffer.put(delta("b")))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        buffer.get_nowait()
+        await asyncio.wait_for(blocked, 0.1)
+
+    asyncio.run(scenario())
+
+
+def test_only_deltas_of_the_same_event_are_merged():
+    merged = merge_delta_frames(delta("a", event_id="1"), delta("b", event_id="2"))
+    assert merged == "id: 2\n" + delta("ab")
+    assert json.loads(merge_delta_frames(delta("a").encode(), delta("b").encode())[6:])["delta"] == "ab"
+    assert merge_delta_frames(delta("a"), delta("b", message_id="other")) is None
+    assert merge_delta_frames(delta("a", event_id="1"), delta("b")) is None
+    assert merge_delta_frames(delta("a"), delta("b").encode()) is None
+    assert merge_delta_frames("data: [DONE]\n\n", delta("b")) is None
+
+
+def test_drop_policy_disconnects_a_slow_client():
+    buffer = StreamBuffer("drop", max_frames=1, drop_after=0.01)
+
+    async def scenario():
+        await buffer.put("a")
+        with pytest.raises(SlowConsumerError) as dropped:
+            await buffer.put("b")
+        buffer.finish(dropped.value)
+        return await buffer.get()
+
+    frame, error = asyncio.run(scenario())
+    # Buffered frames are discarded rather than written after the error
+    assert frame is END and isinstance(error, SlowConsumerError)
+    assert buffer.bytes == 0
+
+
+def test_reader_gets_buffered_frames_before_the_end():
+    buffer = StreamBuffer()
+
+    async def scenario():
+        reader = asyncio.ensure_future(buffer.get())
+        await asyncio.sleep(0)
+        await buffer.put(b"a")
+        error = RuntimeError("upstream failed")
+        await buffer.put(b"b")
+        buffer.finish(error)
+        return [await reader, await buffer.get(), await buffer.get()], error
+
+    received, error = asyncio.run(scenario())
+    assert received == [(b"a", None), (b"b", None), (END, error)]
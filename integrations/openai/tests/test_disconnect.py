@@ -0,0 +1,100 @@
+import asyncio
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+from starlette.requests import Request
+
+from benchmarks.fake_openai import FakeOpenAI, free_port, serve_in_thread
+from example_server import admission, app, upstream
+from example_server.disconnect import DisconnectStats, StreamMeter, cancel_on_disconnect
+from .asgi import post_and_leave_mid_stream, post_scope
+
+
+class Upstream:
+    """An endless upstream stream that records when it is closed."""
+
+    def __init__(self):
+        self.sent = 0
+        self.closed = False
+
+    async def frames(self):
+        try:
+            while True:
+                await asyncio.sleep(0.005)
+                self.sent += 1
+                yield f"frame {self.sent}"
+        finally:
+            self.closed = True
+
+
+def test_upstream_is_cancelled_when_the_client_disconnects():
+    async def scenario():
+        connected = asyncio.Event()
+        connected.set()
+
+        async def receive() -> dict:
+            if connected.is_set():
+                await asyncio.sleep(3600)
+            return {"type": "http.disconnect"}
+
+        upstream = Upstream()
+        stats = DisconnectStats()
+        request = Request(post_scope("/", "2.4"), receive)
+        relayed = []
+        async for frame in cancel_on_disconnect(
+            request, upstream.frames(), meter=StreamMeter(), poll_interval=0.01, stats=stats
+        ):
+            relayed.append(frame)
+            if len(relayed) == 3:
+                connected.clear()
+        # Let the cancelled producer unwind
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return upstream, stats, relayed
+
+    upstream, stats, relayed = asyncio.run(scenario())
+    assert upstream.closed
+    assert upstream.sent < 50
+    assert stats.cancelled_streams == 1 and stats.completed_streams == 0
+
+
+@pytest.fixture(scope="module")
+def fake_upstream():
+    fake = FakeOpenAI(tokens=1000, token_delay=0.005)
+    port = free_port()
+    server = serve_in_thread(fake.app, port)
+    yield fake, f"http://127.0.0.1:{port}"
+    server.should_exit = True
+
+
+@pytest.mark.parametrize("spec_version", ["2.3", "2.4"])
+def test_upstream_stream_is_closed_when_the_client_leaves_mid_stream(monkeypatch, fake_upstream, spec_version):
+    fake, base_url = fake_upstream
+    run_input = {
+        "threadId": f"thread-{spec_version}",
+        "runId": "run-0",
+        "state": {},
+        "messages": [{"id": "msg-0", "role": "user", "content": "Hello"}],
+        "tools": [],
+        "context": [],
+        "forwardedProps": {},
+    }
+
+    async def scenario():
+        async with httpx.AsyncClient() as http_client:
+            client = AsyncOpenAI(api_key="test", base_url=base_url, http_client=http_client)
+            monkeypatch.setattr(upstream, "client", client)
+            sent = await post_and_leave_mid_stream(app, "/", run_input, 3, spec_version)
+            # The fake upstream sees the connection close
+            for _ in range(100):
+                if fake.active_streams == 0:
+                    break
+                await asyncio.sleep(0.01)
+        return sent
+
+    aborted = fake.aborted_streams
+    sent = asyncio.run(scenario())
+    assert sent[0]["status"] == 200
+    assert fake.active_streams == 0 and fake.aborted_streams == aborted + 1
+    assert admission is None or admission.active == 0
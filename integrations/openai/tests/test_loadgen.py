@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+
+from benchmarks.loadgen import StreamTiming, level_result, percentile, timed_stream, write_report
+
+LEVEL_KEYS = {
+    "concurrency", "streams", "errors", "streams_per_second", "ttft_ms",
+    "inter_token_ms", "cpu_us_per_token", "rss_mib_per_stream",
+}
+
+
+def test_level_result_schema():
+    timings = [StreamTiming(0.010, [0.001, 0.003], 0.02), StreamTiming(0.030, [0.002], 0.04)]
+    result = level_result(
+        4, wall=2.0, timings=timings, errors=1, cpu_seconds=0.5,
+        tokens_per_stream=100, rss_idle=10 * 2 ** 20, rss_peak=14 * 2 ** 20,
+    )
+
+    assert set(result) == LEVEL_KEYS
+    assert (result["concurrency"], result["streams"], result["errors"]) == (4, 2, 1)
+    assert result["streams_per_second"] == 1.0
+    assert result["ttft_ms"] == {"p50": 10.0, "p99": 30.0}
+    assert result["inter_token_ms"] == {"p50": 2.0, "p99": 3.0}
+    assert result["cpu_us_per_token"] == 2500.0
+    assert result["rss_mib_per_stream"] == 1.0
+
+
+def test_level_without_streams_reports_no_latencies():
+    result = level_result(2, 1.0, [], 2, 0.1, 100, 0, 0)
+    assert result["ttft_ms"] == {"p50": None, "p99": None}
+    assert result["cpu_us_per_token"] is None
+    assert result["streams_per_second"] == 0.0
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert [percentile(values, q) for q in (1, 50, 99, 100)] == [1, 50, 99, 100]
+    assert percentile([], 50) is None
+
+
+def test_report_is_labelled_with_commit_and_parameters(tmp_path):
+    path = tmp_path / "load.json"
+    results = [level_result(1, 1.0, [StreamTiming(0.01, [], 0.01)], 0, 0.0, 10, 0, 0)]
+    write_report(str(path), "example", {"workers": 2}, results)
+
+    report = json.loads(path.read_text())
+    assert set(report) == {"benchmark", "server", "commit", "parameters", "results"}
+    assert (report["benchmark"], report["server"]) == ("bench_load", "example")
+    assert report["commit"] is None or isinstance(report["commit"], str)
+    assert report["parameters"] == {"workers": 2}
+    assert report["results"] == results
+
+
+def test_timed_stream_times_only_marked_lines():
+    async def stream(request):
+        async def frames():
+            for frame in ("data: start\n\n", "data: token\n\n", "data: token\n\n", "data: end\n\n"):
+                yield frame
+
+        return StreamingResponse(frames(), media_type="text/event-stream")
+
+    app = Starlette(routes=[Route("/", stream, methods=["POST"])])
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await timed_stream(client, "/", {}, ["token"])
+
+    timing = asyncio.run(scenario())
+    assert len(timing.gaps) == 1
+    assert 0 <= timing.ttft <= timing.duration
@@ -0,0 +1,55 @@
+from example_server.metrics import Registry, Timer
+
+
+def test_render_matches_the_text_exposition_format():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ("path",))
+    requests.labels('/a"b\\c\nd').inc()
+    registry.gauge("active", "Active").set(2.5)
+    latency = registry.histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+    series = latency.labels("parse")
+    for value in (0.05, 0.1, 0.5, 3.0):
+        series.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{path="/a\\"b\\\\c\\nd"} 1',
+        "# HELP active Active",
+        "# TYPE active gauge",
+        "active 2.5",
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        # Buckets are cumulative; a value equal to a bound falls in its bucket
+        'latency_seconds_bucket{stage="parse",le="0.1"} 2',
+        'latency_seconds_bucket{stage="parse",le="1"} 3',
+        'latency_seconds_bucket{stage="parse",le="+Inf"} 4',
+        'latency_seconds_sum{stage="parse"} 3.65',
+        'latency_seconds_count{stage="parse"} 4',
+    ]
+
+
+def test_unlabelled_histogram_and_function_values():
+    registry = Registry()
+    histogram = registry.histogram("duration_seconds", "Duration", buckets=(1.0,))
+    with Timer(histogram):
+        pass
+    registry.counter("hits_total", "Hits").set_function(lambda: 7)
+
+    lines = registry.render().splitlines()
+    assert 'duration_seconds_bucket{le="1"} 1' in lines
+    assert 'duration_seconds_bucket{le="+Inf"} 1' in lines
+    assert "duration_seconds_count 1" in lines
+    assert "hits_total 7" in lines
+
+
+def test_constant_labels_come_first_on_every_series():
+    registry = Registry({"worker": "42"})
+    registry.counter("plain_total", "Plain").inc()
+    registry.histogram("stage_seconds", "Stage", ("stage",), buckets=(1.0,)).labels("parse").observe(0.5)
+
+    lines = registry.render().splitlines()
+    assert 'plain_total{worker="42"} 1' in lines
+    assert 'stage_seconds_bucket{worker="42",stage="parse",le="1"} 1' in lines
+    assert 'stage_seconds_sum{worker="42",stage="parse"} 0.5' in lines
+    assert 'stage_seconds_count{worker="42",stage="parse"} 1' in lines
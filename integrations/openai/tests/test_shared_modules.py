@@ -0,0 +1,39 @@
+"""
+The openai and pydanticai integrations carry their own copies of the modules
+below, so each example stays a standalone project. These tests fail as soon
+as the copies differ: change both, or move the module off this list.
+"""
+
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+SIBLING = ROOT.parent / {"openai": "pydanticai", "pydanticai": "openai"}.get(ROOT.name, "")
+
+SHARED = (
+    "example_server/admission.py",
+    "example_server/backpressure.py",
+    "example_server/compression.py",
+    "example_server/flush_deadline.py",
+    "example_server/hedging.py",
+    "example_server/logs.py",
+    "example_server/metrics.py",
+    "example_server/response_cache.py",
+    "example_server/run_input.py",
+    "example_server/single_flight.py",
+    "example_server/thread_store.py",
+    "example_server/transport.py",
+    "benchmarks/loadgen.py",
+    "tests/asgi.py",
+    "tests/test_shared_modules.py",
+)
+
+
+@pytest.mark.parametrize("path", SHARED)
+def test_copies_are_identical(path):
+    if not (SIBLING / path).exists():
+        pytest.skip(f"{SIBLING.name} integration is not checked out")
+    assert (ROOT / path).read_bytes() == (SIBLING / path).read_bytes(), (
+        f"{path} differs from {SIBLING.name}/{path}; change both copies"
+    )
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from example_server.thread_store import (
+    VERSION_HEADER,
+    MemoryThreadStore,
+    SqliteThreadStore,
+    ThreadStore,
+    ThreadVersionConflict,
+)
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_stale_version_is_a_conflict(backend, tmp_path):
+    if backend == "memory":
+        store = ThreadStore(MemoryThreadStore())
+    else:
+        store = ThreadStore(SqliteThreadStore(str(tmp_path / "threads.sqlite3")))
+
+    async def scenario():
+        first = store.write("t", [{"role": "user", "content": "a"}])
+        assert await first.commit()
+        stored = await store.load("t", first.version)
+        # Two tabs continue from the same version; the second one loses
+        tabs = [store.write("t", [{"role": "user", "content": tab}], stored) for tab in "bc"]
+        assert await tabs[0].commit()
+        assert not await tabs[1].commit()
+        with pytest.raises(ThreadVersionConflict):
+            await store.load("t", first.version)
+        with pytest.raises(ThreadVersionConflict):
+            await store.load("t", tabs[1].version)
+        return await store.load("t", tabs[0].version)
+
+    thread = asyncio.run(scenario())
+    assert [m["content"] for m in thread.messages] == ["a", "b"]
+    assert store.conflicts == 3
+    assert ThreadVersionConflict().to_response().status_code == 409
+
+
+def test_versions_are_not_guessable():
+    store = ThreadStore(MemoryThreadStore())
+
+    async def scenario():
+        write = store.write("t", [{"role": "user", "content": "a"}])
+        await write.commit()
+        for guess in ("0", "1", "2"):
+            with pytest.raises(ThreadVersionConflict):
+                await store.load("t", guess)
+        return write.version
+
+    version = asyncio.run(scenario())
+    assert len(version) >= 16
+    assert VERSION_HEADER not in ThreadVersionConflict().to_response().headers
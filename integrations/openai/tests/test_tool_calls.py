@@ -0,0 +1,106 @@
+import json
+from types import SimpleNamespace
+
+from ag_ui.encoder import EventEncoder
+from openai.types.chat.chat_completion_chunk import ChoiceDeltaToolCall, ChoiceDeltaToolCallFunction
+
+from example_server.streaming import ChunkBatcher, ToolCallAssembler
+
+
+def delta(index, id=None, name=None, arguments=None) -> ChoiceDeltaToolCall:
+    function = ChoiceDeltaToolCallFunction(name=name, arguments=arguments) if name or arguments else None
+    return ChoiceDeltaToolCall(index=index, id=id, type="function" if id else None, function=function)
+
+
+def assembler() -> ToolCallAssembler:
+    # Unbatched, so every argument delta is its own event
+    return ToolCallAssembler(ChunkBatcher(EventEncoder(), "msg-1", max_chars=0, max_delay=0))
+
+
+def decode(frames: list) -> list:
+    return [json.loads(frame[len("data: "):]) for frame in frames]
+
+
+def calls(events: list) -> dict:
+    """Id -> name, joined arguments and whether the call ended, checking event order."""
+    assembled = {}
+    for event in events:
+        kind, tool_call_id = event["type"], event["toolCallId"]
+        if kind == "TOOL_CALL_START":
+            assert tool_call_id not in assembled, f"{tool_call_id} started twice"
+            assembled[tool_call_id] = {"name": event["toolCallName"], "arguments": "", "ended": False}
+        elif kind == "TOOL_CALL_ARGS":
+            assert not assembled[tool_call_id]["ended"]
+            assembled[tool_call_id]["arguments"] += event["delta"]
+        elif kind == "TOOL_CALL_END":
+            assembled[tool_call_id]["ended"] = True
+    return assembled
+
+
+def test_interleaved_indexes():
+    tool_calls = assembler()
+    events = decode(tool_calls.add([
+        delta(0, "call_a", "get_weather", ""),
+        delta(1, "call_b", "get_time", ""),
+    ]))
+    events += decode(tool_calls.add([delta(1, arguments='{"zone": ')]))
+    events += decode(tool_calls.add([delta(0, arguments='{"city": ')]))
+    events += decode(tool_calls.add([delta(0, arguments='"Paris"}'), delta(1, arguments='"UTC"}')]))
+    events += decode(tool_calls.finish())
+
+    assert calls(events) == {
+        "call_a": {"name": "get_weather", "arguments": '{"city": "Paris"}', "ended": True},
+        "call_b": {"name": "get_time", "arguments": '{"zone": "UTC"}', "ended": True},
+    }
+    assert [event["toolCallId"] for event in events if event["type"] == "TOOL_CALL_END"] == ["call_a", "call_b"]
+
+
+def test_arguments_split_across_chunks():
+    tool_calls = assembler()
+    events = decode(tool_calls.add([delta(0, "call_a", "get_weather", "")]))
+    for piece in ('{"ci', 'ty": "Pa', "ris", '"}'):
+        events += decode(tool_calls.add([delta(0, arguments=piece)]))
+    events += decode(tool_calls.finish())
+
+    call = calls(events)["call_a"]
+    assert json.loads(call["arguments"]) == {"city": "Paris"}
+    assert sum(event["type"] == "TOOL_CALL_ARGS" for event in events) == 4
+
+
+def test_id_in_a_later_chunk():
+    tool_calls = assembler()
+    # Nothing can be sent before the call has an id
+    assert tool_calls.add([delta(0, name="get_weather", arguments='{"city": ')]) == []
+    assert tool_calls.add([delta(0, arguments='"Paris"}')]) == []
+    events = decode(tool_calls.add([delta(0, "call_a")]))
+
+    assert [event["type"] for event in events] == ["TOOL_CALL_START", "TOOL_CALL_ARGS"]
+    events += decode(tool_calls.finish())
+    assert calls(events) == {"call_a": {"name": "get_weather", "arguments": '{"city": "Paris"}', "ended": True}}
+
+
+def test_finish_ends_open_calls():
+    tool_calls = assembler()
+    events = decode(tool_calls.add([delta(0, "call_a", "get_weather", '{"city": "Paris"}')]))
+    # A call whose id never arrives
+    events += decode(tool_calls.add([delta(1, name="get_time", arguments="{}")]))
+    events += decode(tool_calls.finish())
+
+    assembled = calls(events)
+    assert assembled.pop("call_a") == {"name": "get_weather", "arguments": '{"city": "Paris"}', "ended": True}
+    (generated_id, call), = assembled.items()
+    assert generated_id.startswith("call_")
+    assert call == {"name": "get_time", "arguments": "{}", "ended": True}
+    assert tool_calls.finish() == []
+
+
+def test_deltas_without_index_use_their_position():
+    tool_calls = assembler()
+    function = SimpleNamespace(name="search", arguments='{"q": 1}')
+    events = decode(tool_calls.add([
+        SimpleNamespace(id="call_a", function=function),
+        SimpleNamespace(id="call_b", function=function),
+    ]))
+    events += decode(tool_calls.finish())
+
+    assert set(calls(events)) == {"call_a", "call_b"}
@@ -0,0 +1,90 @@
+"""
+Frames/sec and bytes/sec of the /chat Data Stream Protocol encoder with and
+without text-delta coalescing.
+
+The agent runs on a deterministic ``FunctionModel`` that streams ``--tokens``
+tokens per run, optionally sleeping ``--token-delay`` seconds between tokens,
+so only encoding work is measured.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_coalescing
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from pydantic_ai import Agent
+from pydantic_ai.models.function import FunctionModel
+
+from example_server.data_stream import DeltaCoalescer
+from example_server.vercel_to_pydantic import to_data_stream_protocol
+
+
+def streaming_agent(tokens: int, token_delay: float) -> Agent:
+    async def stream(messages, info):
+        for _ in range(tokens):
+            if token_delay:
+                await asyncio.sleep(token_delay)
+            yield "tok "
+
+    return Agent(FunctionModel(stream_function=stream))
+
+
+async def run_once(agent: Agent, coalescer) -> tuple[int, int]:
+    frames = 0
+    size = 0
+    async with agent.iter("hello") as agent_run:
+        async for node in agent_run:
+            async for chunk in to_data_stream_protocol(node, agent_run, coalescer):
+                frames += 1
+                size += len(chunk)
+    return frames, size
+
+
+async def measure(agent: Agent, tokens: int, runs: int, max_bytes: int, max_delay: float) -> dict:
+    frames = size = 0
+    start = time.perf_counter()
+    for _ in range(runs):
+        coalescer = DeltaCoalescer(max_bytes=max_bytes, max_delay=max_delay)
+        run_frames, run_size = await run_once(agent, coalescer)
+        frames += run_frames
+        size += run_size
+    elapsed = time.perf_counter() - start
+    return {
+        "frames": frames,
+        "tokens_per_sec": runs * tokens / elapsed,
+        "frames_per_sec": frames / elapsed,
+        "bytes_per_sec": size / elapsed,
+        "elapsed": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    agent = streaming_agent(args.tokens, args.token_delay)
+    configs = [
+        ("off", 0, 0.0),
+        ("1KB", 1024, 0.0),
+        ("20ms", 0, 0.02),
+        ("1KB/20ms", 1024, 0.02),
+    ]
+    print(f"{'coalescing':>10} {'frames':>8} {'frames/s':>10} {'bytes/s':>12} {'tokens/s':>10} {'elapsed s':>10}")
+    for name, max_bytes, max_delay in configs:
+        result = asyncio.run(measure(agent, args.tokens, args.runs, max_bytes, max_delay))
+        print(
+            f"{name:>10} {result['frames']:>8} {result['frames_per_sec']:>10.0f} "
+            f"{result['bytes_per_sec']:>12.0f} {result['tokens_per_sec']:>10.0f} {result['elapsed']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
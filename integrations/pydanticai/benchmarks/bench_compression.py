@@ -0,0 +1,151 @@
+"""
+Bytes on the wire and CPU per frame of compressed ``/chat`` streams.
+
+Builds the Data Stream Protocol frames of a synthetic chat the way ``/chat``
+writes them (``DataStreamEncoder``): a ``--tokens`` token answer, uncoalesced
+and coalesced, and a tool call whose output carries ``--tool-kib`` KiB of
+JSON, as a search or retrieval tool would. Each encoding compresses the
+frames one by one with a flush after every frame, as ``ResponseCompression``
+does, and the script reports the bytes written, the ratio to the
+uncompressed stream and CPU per frame. The same frames compressed as one
+body (no flushes) show what per-frame flushing costs in size.
+
+Then it starts ``example_server.serve`` with ``benchmarks.fake_app`` and
+compression on and streams chats with and without ``Accept-Encoding``,
+checking that the decoded text matches and reporting bytes downloaded and
+TTFT.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_compression
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+import httpx
+
+from example_server.compression import BrotliCompressor, GzipCompressor, available_encodings
+from example_server.data_stream import DataStreamEncoder, DeltaCoalescer
+from .bench_workers import chat_body, start_server, stop_server
+from .fake_model import FakeModel
+
+WORDS = (
+    "the model streams tokens to the client as soon as they arrive and every "
+    "frame carries its event type part id and a short delta of text while "
+    "tool results arrive as one frame"
+).split()
+
+
+def chat_frames(tokens: int, tool_kib: int, coalesced: bool) -> list:
+    """Frames of one chat: a tool call with a large output and a streamed answer."""
+    rng = random.Random(0)
+    encoder = DataStreamEncoder()
+    coalescer = DeltaCoalescer(max_bytes=1024 if coalesced else 0, max_delay=0, encoder=encoder)
+    output = {"results": [
+        {"title": " ".join(rng.choices(WORDS, k=6)), "url": f"https://example.com/{i}",
+         "snippet": " ".join(rng.choices(WORDS, k=30))}
+        for i in range(tool_kib * 4)
+    ]}
+    frames = [
+        encoder.frame({"type": "start"}),
+        encoder.tool_input_available("call-0", "search", {"query": "streaming compression"}),
+        encoder.tool_output_available("call-0", output),
+        encoder.text_start("text-0"),
+    ]
+    for _ in range(tokens):
+        frames.extend(coalescer.add("text-0", rng.choice(WORDS) + " "))
+    frames.extend(coalescer.flush())
+    frames += [encoder.text_end("text-0"), encoder.frame({"type": "finish"}), b"data: [DONE]\n\n"]
+    return frames
+
+
+def compressors() -> list:
+    """Name and factory of every compressor measured."""
+    measured = [(f"gzip-{level}", lambda level=level: GzipCompressor(level)) for level in (1, 6, 9)]
+    if "br" in available_encodings():
+        measured += [(f"br-{quality}", lambda quality=quality: BrotliCompressor(quality)) for quality in (4, 5, 8)]
+    return measured
+
+
+def measure(frames: list, make, repeat: int) -> tuple[int, int, float]:
+    """Bytes per-frame flushed, bytes as one body and CPU microseconds per frame."""
+    start = time.process_time()
+    for _ in range(repeat):
+        compressor = make()
+        flushed = sum(len(compressor.compress(frame)) for frame in frames) + len(compressor.finish())
+    cpu = (time.process_time() - start) / repeat / len(frames) * 1e6
+    whole = make()
+    body = len(whole.compress(b"".join(frames))) + len(whole.finish())
+    return flushed, body, cpu
+
+
+async def stream(url: str, i: int, accept_encoding: str) -> tuple[float, int, str, str]:
+    """TTFT, bytes downloaded, decoded text and content encoding of one chat."""
+    started = time.perf_counter()
+    ttft = None
+    text = ""
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream(
+            "POST", url, json=chat_body(i), headers={"accept-encoding": accept_encoding}
+        ) as response:
+            response.raise_for_status()
+            encoding = response.headers.get("content-encoding", "identity")
+            async for line in response.aiter_lines():
+                if '"text-delta"' in line:
+                    ttft = ttft if ttft is not None else time.perf_counter() - started
+                    text += json.loads(line[len("data: "):])["delta"]
+            return ttft, response.num_bytes_downloaded, text, encoding
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--tool-kib", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{args.tokens} tokens and a tool output of {args.tool_kib} KiB")
+    print(f"{'frames':>9} {'encoding':>9} {'frames':>6} {'bytes':>8} {'ratio':>6} {'as body':>8} {'CPU us/frame':>12}")
+    for coalesced in (False, True):
+        frames = chat_frames(args.tokens, args.tool_kib, coalesced)
+        size = sum(len(frame) for frame in frames)
+        label = "coalesced" if coalesced else "per token"
+        print(f"{label:>9} {'identity':>9} {len(frames):>6} {size:>8} {1:>6.2f} {size:>8} {0:>12.2f}")
+        for name, make in compressors():
+            flushed, body, cpu = measure(frames, make, args.repeat)
+            print(f"{label:>9} {name:>9} {len(frames):>6} {flushed:>8} {flushed / size:>6.2f} {body:>8} {cpu:>12.2f}")
+    if "br" not in available_encodings():
+        print("(br not measured: the brotli package is not installed)")
+
+    expected = FakeModel(tokens=200)
+    os.environ["COMPRESSION_ENABLED"] = "true"
+    server, url = start_server(1, expected.tokens, 0.002)
+    failed = False
+    print(f"\nserver, {args.runs} chats of {expected.tokens} tokens")
+    print(f"{'accept-encoding':>15} {'content-encoding':>16} {'bytes/chat':>10} {'TTFT p50 ms':>11} {'ok':>4}")
+    try:
+        for accept_encoding in ("identity", *available_encodings()):
+            results = [asyncio.run(stream(url, i, accept_encoding)) for i in range(args.runs)]
+            ok = all(text == expected.token_text * expected.tokens for _, _, text, _ in results)
+            ok &= all(encoding == accept_encoding for _, _, _, encoding in results)
+            failed |= not ok
+            ttfts = sorted(ttft for ttft, _, _, _ in results)
+            print(f"{accept_encoding:>15} {results[0][3]:>16} "
+                  f"{sum(size for _, size, _, _ in results) // len(results):>10} "
+                  f"{ttfts[len(ttfts) // 2] * 1000:>11.1f} {'yes' if ok else 'NO':>4}")
+    finally:
+        stop_server(server)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
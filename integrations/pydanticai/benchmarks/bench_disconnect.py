@@ -0,0 +1,95 @@
+"""
+Checks that abandoned ``/chat`` and ``/`` streams cancel their agent run.
+
+A client reads the first few frames from a deliberately slow fake model and
+then drops the connection. The script reports how long it took for the
+model stream to be cancelled and fails if that exceeds ``--bound`` seconds.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_disconnect
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+os.environ["CHAT_COALESCE_MAX_BYTES"] = "0"
+os.environ["CHAT_COALESCE_MAX_DELAY_MS"] = "0"
+# Resumable runs survive a disconnect for the grace period; measure the cancel itself
+os.environ.setdefault("REPLAY_GRACE_SECONDS", "0")
+
+from .fake_model import FakeModel, free_port, serve_in_thread
+
+def chat_body(i: int) -> dict:
+    return {
+        "id": f"chat-{i}",
+        "messages": [{"id": f"m{i}", "role": "user", "parts": [{"type": "text", "text": "Hello"}]}],
+    }
+
+
+def agui_body(i: int) -> dict:
+    return {
+        "threadId": f"thread-{i}",
+        "runId": f"run-{i}",
+        "state": {},
+        "messages": [{"id": f"m{i}", "role": "user", "content": "Hello"}],
+        "tools": [],
+        "context": [],
+        "forwardedProps": {},
+    }
+
+
+async def abandon(url: str, body: dict, frames: int) -> float:
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream("POST", url, json=body) as response:
+            seen = 0
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    seen += 1
+                    if seen >= frames:
+                        break
+    return time.monotonic()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--token-delay", type=float, default=0.2)
+    parser.add_argument("--bound", type=float, default=1.0)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    from example_server import agent, app
+    from example_server.disconnect import stats
+
+    fake = FakeModel(tokens=1000, token_delay=args.token_delay)
+    # The server runs on another thread, so agent.override() (a context var) would not apply
+    agent.model = fake.model
+    port = free_port()
+    serve_in_thread(app, port)
+
+    worst = 0.0
+    for path, body in (("/chat", chat_body), ("/", agui_body)):
+        for run in range(args.runs):
+            aborted_before = fake.aborted_streams
+            dropped_at = asyncio.run(abandon(f"http://127.0.0.1:{port}{path}", body(run), frames=4))
+            while fake.aborted_streams == aborted_before:
+                if time.monotonic() - dropped_at > args.bound * 5:
+                    sys.exit(f"{path} run {run}: model stream was never cancelled")
+                time.sleep(0.005)
+            latency = max(0.0, fake.last_abort - dropped_at)
+            worst = max(worst, latency)
+            print(f"{path} run {run}: model stream cancelled {latency * 1000:.0f} ms after disconnect")
+
+    print("disconnect stats:", stats.as_dict())
+    if worst > args.bound:
+        sys.exit(f"worst cancellation latency {worst:.3f}s exceeds bound {args.bound}s")
+    print(f"ok: worst cancellation latency {worst * 1000:.0f} ms <= {args.bound * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
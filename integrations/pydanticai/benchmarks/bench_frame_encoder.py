@@ -0,0 +1,61 @@
+"""
+Micro-benchmark of Data Stream Protocol frame encoding.
+
+Compares the previous ``"data: {}\\n\\n".format(json.dumps({...}))`` path
+(plus the UTF-8 encode Starlette performs on ``str`` chunks) with
+``DataStreamEncoder`` on the json and orjson backends.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_frame_encoder
+"""
+
+import argparse
+import json
+import os
+import timeit
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from example_server.data_stream import DataStreamEncoder, orjson
+
+TEXT_ID = "text-140234567890"
+DELTA = "Crimson is #DC143C, "
+TOOL_OUTPUT = {"color": "crimson", "hex": "#DC143C", "rgb": [220, 20, 60]}
+
+
+def legacy_text_delta():
+    return "data: {}\n\n".format(
+        json.dumps({"type": "text-delta", "id": TEXT_ID, "delta": DELTA})
+    ).encode()
+
+
+def legacy_tool_output():
+    return "data: {}\n\n".format(
+        json.dumps({"type": "tool-output-available", "toolCallId": "call-1", "output": TOOL_OUTPUT})
+    ).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=200_000)
+    args = parser.parse_args()
+
+    cases = [("legacy format+json.dumps", legacy_text_delta, legacy_tool_output)]
+    backends = ["json"] + (["orjson"] if orjson is not None else [])
+    for backend in backends:
+        encoder = DataStreamEncoder(backend=backend)
+        cases.append((
+            f"DataStreamEncoder[{backend}]",
+            lambda encoder=encoder: encoder.text_delta(TEXT_ID, DELTA),
+            lambda encoder=encoder: encoder.tool_output_available("call-1", TOOL_OUTPUT),
+        ))
+
+    print(f"{'encoder':>28} {'text-delta ns':>14} {'tool-output ns':>15}")
+    for name, text_delta, tool_output in cases:
+        delta_ns = min(timeit.repeat(text_delta, number=args.number, repeat=3)) / args.number * 1e9
+        tool_ns = min(timeit.repeat(tool_output, number=args.number, repeat=3)) / args.number * 1e9
+        print(f"{name:>28} {delta_ns:>14.0f} {tool_ns:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
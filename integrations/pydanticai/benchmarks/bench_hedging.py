@@ -0,0 +1,89 @@
+"""
+Time to first token on ``/chat`` with and without hedged model requests.
+
+Starts ``example_server.serve`` with ``benchmarks.fake_app`` as a subprocess;
+a ``--slow-fraction`` of the fake model's responses, drawn at random, take
+``--slow-delay`` extra seconds before their first chunk. A closed loop of
+``--concurrency`` clients streams ``--streams`` chats with hedging off and
+on, and the script reports TTFT p50/p95/p99 and the hedges, hedge wins and
+wasted tokens counted on ``/metrics``.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_hedging
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import re
+
+import httpx
+
+from .bench_workers import chat_body, start_server, stop_server
+from .loadgen import drive, percentile
+
+HEDGE_METRICS = (
+    "model_hedges_total",
+    "model_hedge_wins_total",
+    "model_hedge_wasted_tokens_total",
+    "model_hedge_wasted_prompt_tokens_total",
+)
+
+
+def scrape(base_url: str) -> dict:
+    text = httpx.get(base_url + "/metrics").text
+    values = {}
+    for name in HEDGE_METRICS:
+        match = re.search(rf"^{name} (\S+)$", text, re.MULTILINE)
+        values[name] = int(float(match.group(1))) if match else 0
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--streams", type=int, default=600)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--slow-fraction", type=float, default=0.05)
+    parser.add_argument("--slow-delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    os.environ["FAKE_SLOW_FRACTION"] = str(args.slow_fraction)
+    os.environ["FAKE_SLOW_DELAY"] = str(args.slow_delay)
+    ids = itertools.count()
+
+    def make_body(_: int) -> dict:
+        return chat_body(next(ids))
+
+    print(f"{args.streams} chats, {args.concurrency} concurrent, {args.slow_fraction:.0%} of responses "
+          f"{args.slow_delay * 1000:g} ms slow to start")
+    print(f"{'hedging':>7} {'TTFT p50 ms':>11} {'p95':>7} {'p99':>7} {'hedges':>6} {'wins':>5} "
+          f"{'wasted tok':>10} {'prompt tok':>10}")
+    for enabled in (False, True):
+        os.environ["HEDGE_ENABLED"] = str(enabled).lower()
+        server, url = start_server(1, args.tokens, args.token_delay)
+        base_url = url.removesuffix("/chat")
+        try:
+            # Fills the server's latency window before the measured chats
+            asyncio.run(drive(url, make_body, args.concurrency, 100, ('"text-delta"',)))
+            before = scrape(base_url)
+            _, timings, errors = asyncio.run(drive(
+                url, make_body, args.concurrency, args.streams, ('"text-delta"',)
+            ))
+            after = scrape(base_url)
+        finally:
+            stop_server(server)
+        counted = {metric: after[metric] - before[metric] for metric in HEDGE_METRICS}
+        ttfts = [timing.ttft for timing in timings]
+        print(f"{'on' if enabled else 'off':>7} {percentile(ttfts, 50) * 1000:>11.1f} "
+              f"{percentile(ttfts, 95) * 1000:>7.1f} {percentile(ttfts, 99) * 1000:>7.1f} "
+              f"{counted['model_hedges_total']:>6} {counted['model_hedge_wins_total']:>5} "
+              f"{counted['model_hedge_wasted_tokens_total']:>10} "
+              f"{counted['model_hedge_wasted_prompt_tokens_total']:>10}"
+              + (f"  ({errors} errors)" if errors else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+End-to-end load and latency of the ``/`` and ``/chat`` endpoints.
+
+Starts ``example_server.serve`` as a subprocess (``--workers`` workers)
+serving ``benchmarks.fake_app``, whose fake model first makes
+``--tool-calls`` parallel ``roll_dice`` calls and then streams ``--tokens``
+tokens ``--token-delay`` seconds apart. For each endpoint and
+``--concurrency`` level a closed loop of clients streams ``--streams`` runs
+and the script reports:
+
+- time to the first text frame (TTFT) and the gap between text frames,
+  p50/p99 (frames may carry several tokens when coalescing is on)
+- streams per second
+- server CPU per model token (launcher and workers, from ``/proc``; the
+  fake model runs in the workers and is included)
+- resident memory per in-flight stream: peak during the level minus idle,
+  divided by the concurrency
+
+``--output`` writes the results with the commit and parameters as JSON, so
+runs of different commits can be compared.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_load --output load.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+
+from .bench_workers import chat_body, start_server, stop_server
+from .loadgen import ProcessTree, RssSampler, drive, level_result, write_report
+
+
+def run_input(i: int) -> dict:
+    return {
+        "threadId": f"thread-{i}",
+        "runId": f"run-{i}",
+        "state": {},
+        "messages": [{"id": f"msg-{i}", "role": "user", "content": "Hello"}],
+        "tools": [],
+        "context": [],
+        "forwardedProps": {},
+    }
+
+
+# Path, request body, markers of text frames and request headers
+ENDPOINTS = {
+    "/": ("/", run_input, ('"TEXT_MESSAGE_CONTENT"',), {"accept": "text/event-stream"}),
+    "/chat": ("/chat", chat_body, ('"text-delta"',), None),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--tool-calls", type=int, default=0)
+    parser.add_argument("--endpoints", default="/,/chat")
+    parser.add_argument("--concurrency", default="1,16,64")
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    server, chat_url = start_server(args.workers, args.tokens, args.token_delay, args.tool_calls)
+    base_url = chat_url[: -len("/chat")]
+    tree = ProcessTree(server.pid)
+    # Fresh ids for every stream, so no run is replayed or resumed from an
+    # earlier one
+    ids = itertools.count()
+    results = []
+    try:
+        print(f"{'endpoint':>8} {'clients':>7} {'streams/s':>9} {'TTFT p50':>9} {'p99':>8} "
+              f"{'ITL p50':>8} {'p99':>8} {'CPU us/tok':>10} {'RSS MiB/stream':>14} {'errors':>6}")
+        for endpoint in args.endpoints.split(","):
+            path, body, markers, headers = ENDPOINTS[endpoint]
+
+            def make_body(_: int, body=body) -> dict:
+                return body(next(ids))
+
+            url = base_url + path
+            # Warm up connections and every worker's imports
+            asyncio.run(drive(url, make_body, 4, 8, markers, headers))
+            time.sleep(0.5)
+            for concurrency in (int(x) for x in args.concurrency.split(",")):
+                rss_idle = tree.rss_bytes()
+                cpu_before = tree.cpu_seconds()
+                with RssSampler(tree) as rss:
+                    wall, timings, errors = asyncio.run(drive(
+                        url, make_body, concurrency, max(args.streams, concurrency), markers, headers
+                    ))
+                result = {"endpoint": endpoint, **level_result(
+                    concurrency, wall, timings, errors, tree.cpu_seconds() - cpu_before,
+                    args.tokens, rss_idle, rss.peak,
+                )}
+                results.append(result)
+                print(f"{endpoint:>8} {concurrency:>7} {result['streams_per_second']:>9} "
+                      f"{result['ttft_ms']['p50']:>9} {result['ttft_ms']['p99']:>8} "
+                      f"{result['inter_token_ms']['p50']:>8} {result['inter_token_ms']['p99']:>8} "
+                      f"{result['cpu_us_per_token']:>10} {result['rss_mib_per_stream']:>14} {errors:>6}")
+    finally:
+        stop_server(server)
+
+    if args.output:
+        write_report(args.output, "pydanticai", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
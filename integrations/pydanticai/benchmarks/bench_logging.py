@@ -0,0 +1,107 @@
+"""
+Checks that per-token logging does no work when debug logging is disabled.
+
+Streams a long fake-model response through ``to_data_stream_protocol`` with
+the package logger at INFO and at DEBUG (every per-token event sampled). At
+INFO the run must create no log records and render no messages; the script
+fails otherwise. The per-token time of both runs is printed for comparison.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_logging
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from example_server import agent
+from example_server.logs import configure_logging
+from example_server.vercel_to_pydantic import to_data_stream_protocol
+from .fake_model import FakeModel
+
+
+class CountingHandler(logging.Handler):
+    """Counts records and formats them, like a real handler would."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = 0
+
+    def emit(self, record):
+        self.records += 1
+        self.format(record)
+
+
+async def stream_once() -> int:
+    frames = 0
+    async with agent.iter("Hello") as run:
+        async for node in run:
+            async for _ in to_data_stream_protocol(node, run):
+                frames += 1
+    return frames
+
+
+def run(level: str, sample_every: int, fake: FakeModel) -> tuple[float, int, int]:
+    configure_logging(level, token_sample_every=sample_every)
+    logger = logging.getLogger("example_server")
+    counter = CountingHandler()
+    # Count synchronously instead of going through the background listener
+    handlers = logger.handlers[:]
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(counter)
+
+    made = 0
+    make_record = logging.Logger.makeRecord
+
+    def counting_make_record(self, *args, **kwargs):
+        nonlocal made
+        made += 1
+        return make_record(self, *args, **kwargs)
+
+    logging.Logger.makeRecord = counting_make_record
+    try:
+        start = time.perf_counter()
+        asyncio.run(stream_once())
+        elapsed = time.perf_counter() - start
+    finally:
+        logging.Logger.makeRecord = make_record
+        logger.removeHandler(counter)
+        for handler in handlers:
+            logger.addHandler(handler)
+    return elapsed / fake.tokens * 1e6, made, counter.records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=20000)
+    args = parser.parse_args()
+
+    fake = FakeModel(tokens=args.tokens, token_delay=0)
+    agent.model = fake.model
+
+    print(f"{'level':<22} {'us/token':>9} {'records':>8} {'formatted':>10}")
+    results = {}
+    for label, level, sample_every in (
+        ("INFO", "INFO", 100),
+        ("DEBUG, 1 in 100", "DEBUG", 100),
+        ("DEBUG, every token", "DEBUG", 1),
+    ):
+        per_token, made, formatted = run(level, sample_every, fake)
+        results[label] = made
+        print(f"{label:<22} {per_token:>9.2f} {made:>8} {formatted:>10}")
+
+    configure_logging("INFO")
+    if results["INFO"]:
+        print(f"FAIL: {results['INFO']} log records created with debug logging disabled")
+        sys.exit(1)
+    print("ok: no log records created on the hot path at INFO")
+
+
+if __name__ == "__main__":
+    main()
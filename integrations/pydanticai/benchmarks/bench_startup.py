@@ -0,0 +1,135 @@
+"""
+Import cost and cold-start time of the server.
+
+Three measurements, each in fresh processes:
+
+1. ``python -X importtime -c "import example_server"``: total import time
+   and the most expensive imports (cumulative), best of ``--repeats``. The
+   run fails (exit status 1) when the total exceeds ``--budget-ms``, so the
+   import cost can be tracked and guarded.
+2. Building the model after import (the Google SDK import and client set-up
+   that ``LazyModel`` defers).
+3. Cold start of ``example_server.serve`` with 1 and ``--workers`` workers:
+   time from spawning the launcher until ``/metrics`` answers.
+
+``--json`` prints the results as one JSON object for tracking over time.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_startup
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .bench_workers import stop_server
+from .fake_model import free_port
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def env() -> dict:
+    return {**os.environ, "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "fake")}
+
+
+def import_profile() -> tuple[float, list[tuple[str, float]]]:
+    """Import time of ``example_server`` and of the imports it triggers, in ms."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import example_server"],
+        env=env(), capture_output=True, text=True, check=True,
+    )
+    total = 0.0
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        _, cumulative, indent, name = match.groups()
+        if name == "example_server":
+            total = int(cumulative) / 1000
+        elif len(indent) <= 2:
+            # Imports made directly by a top-level import, so their times
+            # do not overlap
+            modules.append((name, int(cumulative) / 1000))
+    modules.sort(key=lambda module: module[1], reverse=True)
+    return total, modules
+
+
+def model_build_ms() -> float:
+    code = (
+        "import time, example_server\n"
+        "started = time.perf_counter()\n"
+        "example_server.model.wrapped\n"
+        "print((time.perf_counter() - started) * 1000)\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], env=env(), capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def cold_start_ms(workers: int, timeout: float = 60.0) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "example_server.serve"],
+        env={**env(), "PORT": str(port), "SERVE_HOST": "127.0.0.1", "SERVE_WORKERS": str(workers)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/metrics"
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(url, timeout=1.0)
+                return (time.perf_counter() - started) * 1000
+            except httpx.TransportError:
+                time.sleep(0.01)
+        raise RuntimeError(f"{url} did not come up within {timeout}s")
+    finally:
+        stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=1200.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    profiles = [import_profile() for _ in range(args.repeats)]
+    total, modules = min(profiles, key=lambda profile: profile[0])
+    build = min(model_build_ms() for _ in range(args.repeats))
+    levels = sorted({1, args.workers})
+    cold = {workers: min(cold_start_ms(workers) for _ in range(args.repeats)) for workers in levels}
+
+    over_budget = total > args.budget_ms
+    if args.json:
+        print(json.dumps({
+            "import_ms": round(total, 1),
+            "import_budget_ms": args.budget_ms,
+            "top_imports_ms": {name: round(ms, 1) for name, ms in modules[: args.top]},
+            "model_build_ms": round(build, 1),
+            "cold_start_ms": {str(workers): round(ms, 1) for workers, ms in cold.items()},
+        }))
+    else:
+        print(f"import example_server: {total:.0f} ms (budget {args.budget_ms:.0f} ms), best of {args.repeats}")
+        for name, ms in modules[: args.top]:
+            print(f"  {ms:>8.1f} ms  {name}")
+        print(f"model build on first use: {build:.0f} ms")
+        for workers, ms in cold.items():
+            print(f"cold start, {workers} worker(s): {ms:.0f} ms")
+    if over_budget:
+        print(f"import time {total:.0f} ms is over the {args.budget_ms:.0f} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Parallel tool execution through ``ToolHost``.
+
+A fake model calls several tools in one turn: blocking sleeps of different
+lengths on the thread pool, a CPU-bound loop on the process pool and a tool
+that exceeds its timeout. The script streams the run through
+``to_data_stream_protocol`` and checks that the turn takes about as long as
+its slowest tool (not the sum), that ``tool-output-available`` frames arrive
+in completion order, and that the slow tool was cut off by its timeout.
+It then repeats a call to a slow pure tool in a new run and checks that the
+second call is answered from the result cache.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_tools
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+from pydantic_ai import Agent
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+
+from example_server.tools import ToolHost, ToolResultCache
+from example_server.vercel_to_pydantic import to_data_stream_protocol
+
+host = ToolHost(
+    thread_workers=4,
+    process_workers=2,
+    default_timeout=5.0,
+    result_cache=ToolResultCache(),
+)
+
+
+@host.tool
+def wait(seconds: float) -> str:
+    """Block for ``seconds`` and report it."""
+    time.sleep(seconds)
+    return f"waited {seconds}s"
+
+
+@host.tool(executor="process")
+def count_primes(limit: int) -> int:
+    """Count primes below ``limit`` by trial division."""
+    return sum(
+        all(n % d for d in range(2, int(n ** 0.5) + 1))
+        for n in range(2, limit)
+    )
+
+
+@host.tool(timeout=0.3)
+def hang() -> str:
+    """Never answers in time."""
+    time.sleep(1.0)
+    return "too late"
+
+
+@host.tool(pure=True, ttl=60)
+def slow_square(n: int) -> int:
+    """Square ``n``, slowly."""
+    time.sleep(0.3)
+    return n * n
+
+
+def make_model(calls):
+    turns = {"count": 0}
+
+    async def stream(messages, info):
+        turns["count"] += 1
+        if turns["count"] == 1:
+            for index, (tool_call_id, name, args) in enumerate(calls):
+                yield {index: DeltaToolCall(name=name, json_args=json.dumps(args), tool_call_id=tool_call_id)}
+        else:
+            yield "done"
+
+    return FunctionModel(stream_function=stream)
+
+
+async def run_turn(agent: Agent) -> tuple[float, list]:
+    outputs = []
+    start = time.perf_counter()
+    async with agent.iter("go") as run:
+        async for node in run:
+            async for frame in to_data_stream_protocol(node, run):
+                payload = json.loads(frame.decode()[len("data: "):])
+                if payload["type"] == "tool-output-available":
+                    outputs.append((time.perf_counter() - start, payload["toolCallId"], payload["output"]))
+    return time.perf_counter() - start, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--prime-limit", type=int, default=200_000)
+    args = parser.parse_args()
+
+    calls = [
+        ("slow", "wait", {"seconds": 0.8}),
+        ("fast", "wait", {"seconds": 0.1}),
+        ("medium", "wait", {"seconds": 0.4}),
+        ("cpu", "count_primes", {"limit": args.prime_limit}),
+        ("timeout", "hang", {}),
+    ]
+    agent = Agent(make_model(calls), retries=3)
+    host.register(agent)
+
+    start = time.perf_counter()
+    count_primes(args.prime_limit)
+    cpu_seconds = time.perf_counter() - start
+
+    elapsed, outputs = asyncio.run(run_turn(agent))
+
+    for at, tool_call_id, output in outputs:
+        print(f"{at:>6.2f}s {tool_call_id:<8} {str(output)[:60]}")
+    sequential = 0.8 + 0.1 + 0.4 + 0.3 + cpu_seconds
+    print(f"turn took {elapsed:.2f}s; sequential would take ~{sequential:.2f}s")
+
+    order = [tool_call_id for _, tool_call_id, _ in outputs]
+    timed_out = any(tool_call_id == "timeout" and "timed out" in str(output) for _, tool_call_id, output in outputs)
+    ok = order.index("fast") < order.index("medium") < order.index("slow") and timed_out
+    if not ok:
+        print("FAIL: outputs not in completion order or timeout not applied")
+        sys.exit(1)
+    print("ok: tool results streamed in completion order, timeout applied")
+
+    memo_times = []
+    for _ in range(2):
+        memo_agent = Agent(make_model([("square", "slow_square", {"n": 7})]))
+        host.register(memo_agent)
+        _, memo_outputs = asyncio.run(run_turn(memo_agent))
+        memo_times.append(memo_outputs[0][0])
+    host.shutdown()
+    print(f"pure tool: first call {memo_times[0]:.3f}s, repeated call {memo_times[1]:.3f}s")
+    if memo_times[1] >= 0.3:
+        print("FAIL: repeated pure tool call was not memoized")
+        sys.exit(1)
+    print("ok: repeated pure tool call answered from the cache")
+
+
+if __name__ == "__main__":
+    main()
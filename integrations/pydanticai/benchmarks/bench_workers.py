@@ -0,0 +1,145 @@
+"""
+Throughput of the production launcher across worker counts.
+
+Starts ``example_server.serve`` as a subprocess with 1, 2, ... workers, each
+serving ``benchmarks.fake_app`` (the example server with a fake model), and
+drives the same closed-loop ``/chat`` load at each level. The fake model
+streams without delay, so requests are bound by server CPU (agent graph,
+frame encoding, SSE framing) and throughput should grow with the worker
+count up to the number of cores. The load generator shares the machine, so
+expect less than linear scaling.
+
+Finally it checks the graceful drain: a slow stream is started, the server
+gets SIGTERM, and the stream must still complete.
+
+Usage (from integrations/pydanticai):
+    poetry run python -m benchmarks.bench_workers
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .fake_model import free_port
+
+
+def chat_body(i: int) -> dict:
+    return {
+        "id": f"chat-{i}",
+        "messages": [{"id": f"m{i}", "role": "user", "parts": [{"type": "text", "text": "Hello"}]}],
+    }
+
+
+def start_server(workers: int, tokens: int, token_delay: float, tool_calls: int = 0) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = {
+        **os.environ,
+        "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "fake"),
+        "PORT": str(port),
+        "SERVE_APP": "benchmarks.fake_app:app",
+        "SERVE_HOST": "127.0.0.1",
+        "SERVE_WORKERS": str(workers),
+        "FAKE_TOKENS": str(tokens),
+        "FAKE_TOKEN_DELAY": str(token_delay),
+        "FAKE_TOOL_CALLS": str(tool_calls),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "example_server.serve"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/chat"
+    wait_until_up(url)
+    return process, url
+
+
+def stop_server(process: subprocess.Popen):
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=60)
+
+
+def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def read_chat(client: httpx.AsyncClient, url: str, i: int) -> bytes:
+    async with client.stream("POST", url, json=chat_body(i)) as response:
+        response.raise_for_status()
+        return await response.aread()
+
+
+async def drive(url: str, concurrency: int, requests: int) -> float:
+    """Run ``requests`` chats with ``concurrency`` in flight and return chats per second."""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    counter = iter(range(requests))
+
+    async def client_loop(client: httpx.AsyncClient):
+        for i in counter:
+            await read_chat(client, url, i)
+
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        return requests / (time.perf_counter() - start)
+
+
+async def check_drain(url: str, process: subprocess.Popen) -> bool:
+    """Send SIGTERM while a chat is streaming and report whether it still completes."""
+    async with httpx.AsyncClient(timeout=None) as client:
+        chat = asyncio.create_task(read_chat(client, url, 0))
+        await asyncio.sleep(0.5)
+        process.send_signal(signal.SIGTERM)
+        try:
+            body = await chat
+        except httpx.HTTPError:
+            return False
+    process.wait(timeout=60)
+    return b'"type":"text-end"' in body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", default=",".join(
+        str(n) for n in sorted({1, 2, os.cpu_count() or 1})
+    ))
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'workers':>8} {'chats/s':>9} {'speedup':>8}")
+    for workers in (int(x) for x in args.workers.split(",")):
+        server, url = start_server(workers, args.tokens, 0.0)
+        try:
+            # Warm up so every worker has imported the app
+            asyncio.run(drive(url, args.concurrency, args.concurrency * 2))
+            rate = asyncio.run(drive(url, args.concurrency, args.requests))
+        finally:
+            stop_server(server)
+        baseline = baseline or rate
+        print(f"{workers:>8} {rate:>9.1f} {rate / baseline:>7.2f}x")
+
+    server, url = start_server(1, tokens=40, token_delay=0.05)
+    drained = asyncio.run(check_drain(url, server))
+    print(f"in-flight stream completed after SIGTERM: {'yes' if drained else 'NO'}")
+    if not drained:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+The example server with ``FakeModel`` in place of Gemini.
+
+Load tests start it in separate worker processes through the production
+launcher (``SERVE_APP=benchmarks.fake_app:app``); the fake model is
+configured with ``FAKE_TOKENS``, ``FAKE_TOKEN_DELAY``, ``FAKE_TOOL_CALLS``,
+``FAKE_SLOW_FRACTION`` and ``FAKE_SLOW_DELAY``, and hedged like Gemini when
+hedging is enabled.
+"""
+
+import os
+
+from example_server import agent, app, hedger
+from example_server.hedged_model import HedgedModel
+from .fake_model import FakeModel
+
+fake = FakeModel(
+    tokens=int(os.getenv("FAKE_TOKENS", "200")),
+    token_delay=float(os.getenv("FAKE_TOKEN_DELAY", "0")),
+    tool_calls=int(os.getenv("FAKE_TOOL_CALLS", "0")),
+    slow_fraction=float(os.getenv("FAKE_SLOW_FRACTION", "0")),
+    slow_delay=float(os.getenv("FAKE_SLOW_DELAY", "0")),
+)
+agent.model = HedgedModel(fake.model, hedger) if hedger is not None else fake.model
+
+__all__ = ["app", "fake"]
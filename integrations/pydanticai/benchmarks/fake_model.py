@@ -0,0 +1,106 @@
+"""
+Deterministic stand-ins for Gemini used by the benchmarks.
+
+``FakeModel`` wraps a pydantic-ai ``FunctionModel`` that streams a fixed
+number of tokens with a configurable delay, and records whether each stream
+ran to completion or was cancelled. With ``tool_calls`` it first answers
+with that many parallel calls of a tool and streams the text once their
+results are back. A fraction of responses can be made slow to start, standing
+in for the occasional slow Gemini response.
+"""
+
+import asyncio
+import random
+import socket
+import threading
+import time
+
+import uvicorn
+from pydantic_ai.messages import ModelRequest, ToolReturnPart
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+
+
+class FakeModel:
+    """
+    Configurable fake model.
+
+    Args:
+        tokens: Number of text tokens streamed per response
+        token_delay: Seconds to sleep between tokens
+        token_text: Text of every streamed token
+        tool_calls: Number of parallel calls of ``tool_name`` made before
+            the text
+        tool_name: Tool to call, taking no arguments
+        slow_fraction: Fraction of responses, drawn at random, whose first
+            chunk takes ``slow_delay`` extra seconds
+        slow_delay: Extra seconds before the first chunk of a slow response
+        seed: Seed of the draws of slow responses
+    """
+
+    def __init__(
+        self,
+        tokens: int = 50,
+        token_delay: float = 0.01,
+        token_text: str = "lorem ",
+        tool_calls: int = 0,
+        tool_name: str = "roll_dice",
+        slow_fraction: float = 0.0,
+        slow_delay: float = 0.0,
+        seed: int = 0,
+    ):
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.token_text = token_text
+        self.tool_calls = tool_calls
+        self.tool_name = tool_name
+        self.slow_fraction = slow_fraction
+        self.slow_delay = slow_delay
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.active_streams = 0
+        self.aborted_streams = 0
+        self.last_abort = 0.0
+        self.model = FunctionModel(stream_function=self._stream)
+
+    async def _stream(self, messages, info):
+        self.requests += 1
+        self.active_streams += 1
+        completed = False
+        try:
+            if self.slow_fraction and self.random.random() < self.slow_fraction:
+                await asyncio.sleep(self.slow_delay)
+            last = messages[-1]
+            answered = isinstance(last, ModelRequest) and any(isinstance(part, ToolReturnPart) for part in last.parts)
+            if self.tool_calls and not answered:
+                yield {
+                    index: DeltaToolCall(name=self.tool_name, json_args="{}", tool_call_id=f"call-{index}")
+                    for index in range(self.tool_calls)
+                }
+                completed = True
+                return
+            for _ in range(self.tokens):
+                if self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+                yield self.token_text
+            completed = True
+        finally:
+            self.active_streams -= 1
+            if not completed:
+                self.aborted_streams += 1
+                self.last_abort = time.monotonic()
+
+
+def free_port() -> int:
+    """Return a free localhost TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    """Start ``app`` with uvicorn on a daemon thread and wait until it accepts requests."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
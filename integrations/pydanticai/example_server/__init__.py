@@ -1,29 +1,372 @@
+import asyncio
+import logging
 import os
+import random
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Type, TypeVar, Union
 import uvicorn
 from ag_ui.core import RunAgentInput
-from fastapi import FastAPI
+from ag_ui.encoder import EventEncoder
+from fastapi import FastAPI, HTTPException
+from fastapi.exceptions import RequestValidationError
 from http import HTTPStatus
 from fastapi.requests import Request
-from fastapi.responses import Response, StreamingResponse
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import ValidationError
+from pydantic import BaseModel, ValidationError
 import json
 from pydantic_ai import Agent
 from pydantic_ai.ag_ui import run_ag_ui, SSE_CONTENT_TYPE
-from pydantic_ai.models.google import GoogleModel
-from pydantic_ai.providers.google import GoogleProvider
+from pydantic_ai.messages import ModelMessage
+from pydantic_ai.models import Model
+from pydantic_ai.profiles.google import google_model_profile
+from .admission import (
+    AdmissionController,
+    AdmissionRejected,
+    AdmittedStreamingResponse,
+    Lease,
+    admission_key,
+    hold_permit,
+)
+from .backpressure import StreamBuffer
+from .compaction import SUMMARY_PROMPT, HistoryCompactor, ModelMessageFormat, SummaryCache, resolve_summarizer
+from .compression import ResponseCompression
 from .config import settings
+from .data_stream import ERROR_TEXT_ID, DataStreamEncoder, DeltaCoalescer
+from .disconnect import StreamMeter, cancel_on_disconnect, stats as disconnect_stats
+from .hedged_model import HedgedModel
+from .hedging import Hedger
+from .history_cache import HistoryCache
+from .lazy_model import LazyModel
+from .logs import configure_logging
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Timer, registry, stage_seconds
+from .replay import ReplayRegistry, parse_last_event_id
+from .response_cache import cache_key, create_response_cache
+from .run_input import ThreadPrefixCache, decode_run_input, decode_thread_run_input, loads
+from .single_flight import SingleFlight
+from .thread_store import (
+    VERSION_HEADER,
+    ThreadVersionConflict,
+    ThreadWrite,
+    commit_on_success,
+    create_thread_store,
+    parse_thread_version,
+)
+from .tools import ToolHost, ToolResultCache
+from .transport import UpstreamTransport
 from .vercel_to_pydantic import (
     ChatMessageRequest,
     convert_vercel_messages_to_pydantic,
     to_data_stream_protocol,
 )
 
-provider = GoogleProvider(api_key=settings.gemini_api_key)
-model = GoogleModel('gemini-1.5-flash', provider=provider)
-agent = Agent(model)
+configure_logging(settings.log_level, settings.log_json, settings.log_token_sample_every)
+logger = logging.getLogger(__name__)
+
+upstream_transport = UpstreamTransport(
+    max_connections=settings.upstream_max_connections,
+    max_keepalive_connections=settings.upstream_max_keepalive_connections,
+    keepalive_expiry=settings.upstream_keepalive_expiry,
+    connect_timeout=settings.upstream_connect_timeout,
+    http2=settings.upstream_http2,
+    dns_cache_ttl=settings.upstream_dns_cache_ttl_seconds,
+)
+
+
+def build_model(model_name: str = settings.gemini_model, base_url: Optional[str] = settings.gemini_base_url) -> Model:
+    """Build a Gemini model, importing the Google SDK."""
+    from google import genai
+    from google.genai.types import HttpOptions
+    from pydantic_ai.models.google import GoogleModel
+    from pydantic_ai.providers.google import GoogleProvider
+
+    # One client and connection pool for every Gemini request of this worker
+    provider = GoogleProvider(
+        client=genai.Client(
+            api_key=settings.gemini_api_key,
+            http_options=HttpOptions(
+                base_url=base_url,
+                timeout=int(settings.upstream_read_timeout * 1000),
+                async_client_args={"transport": upstream_transport},
+            ),
+        )
+    )
+    return GoogleModel(model_name, provider=provider)
+
+
+model = LazyModel(build_model, settings.gemini_model, profile=google_model_profile)
+
+hedger = (
+    Hedger(
+        percentile=settings.hedge_percentile,
+        min_delay=settings.hedge_min_delay_ms / 1000,
+        max_delay=settings.hedge_max_delay_ms / 1000,
+        min_samples=settings.hedge_min_samples,
+        window=settings.hedge_window,
+        max_ratio=settings.hedge_max_ratio,
+    )
+    if settings.hedge_enabled
+    else None
+)
+hedge_model = (
+    LazyModel(
+        lambda: build_model(
+            settings.hedge_model or settings.gemini_model,
+            settings.hedge_base_url or settings.gemini_base_url,
+        ),
+        settings.hedge_model or settings.gemini_model,
+        profile=google_model_profile,
+    )
+    if hedger is not None and (settings.hedge_model or settings.hedge_base_url)
+    else None
+)
+
+# Summarizes older turns for history compaction; no tools, no history
+summary_agent = Agent(model)
+
+
+async def summarize_with_model(transcript: str) -> str:
+    """Summarize older turns of a thread with the model."""
+    result = await summary_agent.run(SUMMARY_PROMPT + transcript)
+    return result.output
+
+
+compactor = (
+    HistoryCompactor(
+        ModelMessageFormat(),
+        max_tokens=settings.compaction_max_tokens,
+        keep_recent_turns=settings.compaction_keep_recent_turns,
+        max_tool_output_chars=settings.compaction_max_tool_output_chars,
+        summarizer=resolve_summarizer(settings.compaction_summarizer, summarize_with_model),
+        summary_block_turns=settings.compaction_summary_block_turns,
+        summary_cache=SummaryCache(settings.compaction_summary_cache_entries),
+    )
+    if settings.compaction_enabled
+    else None
+)
+
+
+async def compact_history(messages: List[ModelMessage]) -> List[ModelMessage]:
+    """Agent history processor; runs before every model request of / and /chat."""
+    with Timer(stage_seconds.labels("compact")):
+        return await compactor.compact(messages)
+
+
+agent = Agent(
+    HedgedModel(model, hedger, hedge_model) if hedger is not None else model,
+    history_processors=[compact_history] if compactor is not None else None,
+)
+
+
+def lazy_models() -> List[LazyModel]:
+    """The agent's models that are built on first use."""
+    models = agent.model.models if isinstance(agent.model, HedgedModel) else (agent.model,)
+    return [lazy for lazy in models if isinstance(lazy, LazyModel)]
+
+history_cache = (
+    HistoryCache(
+        max_entries=settings.history_cache_max_entries,
+        max_bytes=settings.history_cache_max_bytes,
+    )
+    if settings.history_cache_enabled
+    else None
+)
+
+thread_cache = (
+    ThreadPrefixCache(
+        max_threads=settings.thread_cache_max_threads,
+        max_bytes=settings.thread_cache_max_bytes,
+    )
+    if settings.thread_cache_enabled
+    else None
+)
+
+thread_store = (
+    create_thread_store(
+        settings.thread_store_backend,
+        settings.thread_store_path,
+        settings.thread_store_ttl_seconds,
+        settings.thread_store_max_threads,
+        settings.thread_store_max_bytes,
+        settings.thread_store_max_messages,
+    )
+    if settings.thread_store_enabled
+    else None
+)
+
+stream_encoder = DataStreamEncoder(backend=settings.data_stream_json_backend)
+
+replay_registry = (
+    ReplayRegistry(
+        max_frames_per_run=settings.replay_max_frames_per_run,
+        max_bytes_per_run=settings.replay_max_bytes_per_run,
+        max_total_bytes=settings.replay_max_total_bytes,
+        ttl=settings.replay_ttl_seconds,
+        grace=settings.replay_grace_seconds,
+        stats=disconnect_stats,
+    )
+    if settings.replay_enabled
+    else None
+)
+
+admission = (
+    AdmissionController(
+        max_concurrent=settings.admission_max_concurrent,
+        max_concurrent_per_key=settings.admission_max_concurrent_per_key,
+        rate=settings.admission_rate_per_second,
+        burst=settings.admission_burst,
+        rate_per_key=settings.admission_key_rate_per_second,
+        burst_per_key=settings.admission_key_burst,
+        max_queue=settings.admission_max_queue,
+        max_wait=settings.admission_max_wait_seconds,
+    )
+    if settings.admission_enabled
+    else None
+)
+
+def stream_buffer() -> StreamBuffer:
+    """Buffer between the upstream and the client for one stream."""
+    return StreamBuffer(
+        policy=settings.stream_buffer_policy,
+        max_frames=settings.stream_buffer_max_frames,
+        max_bytes=settings.stream_buffer_max_bytes,
+        drop_after=settings.stream_slow_consumer_timeout_seconds,
+    )
+
+
+stream_buffer()  # reject an unknown policy at startup rather than per request
+
+response_cache = (
+    create_response_cache(
+        settings.response_cache_backend,
+        settings.response_cache_path,
+        settings.response_cache_ttl_seconds,
+        settings.response_cache_max_entries,
+        settings.response_cache_max_bytes,
+    )
+    if settings.response_cache_enabled
+    else None
+)
+
+single_flight = SingleFlight(settings.single_flight_max_bytes) if settings.single_flight_enabled else None
+
+compression = (
+    ResponseCompression(
+        encodings=[encoding.strip() for encoding in settings.compression_encodings.split(",") if encoding.strip()],
+        gzip_level=settings.compression_gzip_level,
+        brotli_quality=settings.compression_brotli_quality,
+    )
+    if settings.compression_enabled
+    else None
+)
+
+if settings.metrics_worker_label:
+    # Each worker answers /metrics with its own series
+    registry.labels["worker"] = str(os.getpid())
+
+for _name, _help, _function in (
+    ("streams_completed_total", "Agent runs that ran to completion", lambda: disconnect_stats.completed_streams),
+    ("streams_cancelled_total", "Agent runs cancelled before completion", lambda: disconnect_stats.cancelled_streams),
+    ("stream_tokens_saved_total", "Estimated model tokens saved by cancelling runs", lambda: disconnect_stats.estimated_tokens_saved),
+):
+    registry.counter(_name, _help).set_function(_function)
+if history_cache is not None:
+    registry.counter("history_cache_hits_total", "History cache hits").set_function(lambda: history_cache.hits)
+    registry.counter("history_cache_misses_total", "History cache misses").set_function(lambda: history_cache.misses)
+    registry.gauge("history_cache_bytes", "Approximate size of cached histories").set_function(lambda: history_cache.total_bytes)
+if thread_cache is not None:
+    registry.counter("thread_cache_hits_total", "Runs that reused validated thread history").set_function(lambda: thread_cache.hits)
+    registry.counter("thread_cache_misses_total", "Runs validated in full").set_function(lambda: thread_cache.misses)
+    registry.counter("thread_cache_reused_messages_total", "Messages reused without validation").set_function(lambda: thread_cache.reused_messages)
+    registry.gauge("thread_cache_bytes", "Approximate size of cached threads").set_function(lambda: thread_cache.total_bytes)
+if thread_store is not None:
+    registry.counter("thread_store_merged_total", "Runs that sent only new messages").set_function(lambda: thread_store.merged)
+    registry.counter("thread_store_replaced_total", "Runs that sent the full history").set_function(lambda: thread_store.replaced)
+    registry.counter("thread_store_conflicts_total", "Runs answered 409 for a stale history version").set_function(lambda: thread_store.conflicts)
+    registry.counter("thread_store_messages_not_resent_total", "Stored messages clients did not resend").set_function(lambda: thread_store.messages_not_resent)
+if compactor is not None:
+    for _name, _help, _function in (
+        ("compaction_tokens_before_total", "Estimated prompt tokens before history compaction", lambda: compactor.tokens_before),
+        ("compaction_tokens_after_total", "Estimated prompt tokens after history compaction", lambda: compactor.tokens_after),
+        ("compaction_elided_tool_outputs_total", "Tool outputs elided from older turns", lambda: compactor.elided_outputs),
+        ("compaction_dropped_turns_total", "Turns dropped to fit the token budget", lambda: compactor.dropped_turns),
+        ("compaction_summary_cache_hits_total", "Summaries of older turns reused", lambda: compactor.summary_cache.hits),
+        ("compaction_summary_cache_misses_total", "Summaries of older turns computed", lambda: compactor.summary_cache.misses),
+    ):
+        registry.counter(_name, _help).set_function(_function)
+if response_cache is not None:
+    registry.counter("response_cache_hits_total", "Response cache hits").set_function(lambda: response_cache.hits)
+    registry.counter("response_cache_misses_total", "Response cache misses").set_function(lambda: response_cache.misses)
+if single_flight is not None:
+    registry.counter("single_flight_started_total", "Agent runs started").set_function(lambda: single_flight.started)
+    registry.counter("single_flight_joined_total", "Requests that joined an identical run in flight").set_function(lambda: single_flight.joined)
+    registry.gauge("single_flight_runs", "Runs in flight").set_function(lambda: len(single_flight))
+if compression is not None:
+    _compressed_streams = registry.counter("compressed_streams_total", "Streams compressed", ("encoding",))
+    for _encoding in compression.encodings:
+        _compressed_streams.labels(_encoding).set_function(lambda encoding=_encoding: compression.streams[encoding])
+    registry.counter("compression_bytes_in_total", "Bytes of streamed frames before compression").set_function(lambda: compression.bytes_in)
+    registry.counter("compression_bytes_out_total", "Bytes of streamed frames after compression").set_function(lambda: compression.bytes_out)
+if hedger is not None:
+    for _name, _help, _function in (
+        ("model_hedges_total", "Hedged model requests sent", lambda: hedger.hedges),
+        ("model_hedge_wins_total", "Model requests whose hedge responded first", lambda: hedger.hedge_wins),
+        ("model_hedges_over_budget_total", "Slow model requests not hedged because of the hedge budget", lambda: hedger.budget_exhausted),
+        ("model_hedge_wasted_tokens_total", "Response chunks of losing requests read before they were cancelled", lambda: hedger.wasted_tokens),
+        ("model_hedge_wasted_prompt_tokens_total", "Estimated prompt tokens of losing requests", lambda: hedger.wasted_prompt_tokens),
+    ):
+        registry.counter(_name, _help).set_function(_function)
+    registry.gauge("model_hedge_delay_seconds", "Current delay before hedging").set_function(hedger.delay)
+if replay_registry is not None:
+    registry.gauge("replay_runs", "Resumable runs held in memory").set_function(lambda: len(replay_registry))
+    registry.gauge("replay_bytes", "Size of buffered resumable-run frames").set_function(lambda: replay_registry.total_bytes)
+for _name, _help, _function in (
+    ("upstream_requests_total", "Requests sent to the Gemini API", lambda: upstream_transport.requests),
+    ("upstream_connections_opened_total", "Gemini API connections opened", lambda: upstream_transport.connections_opened),
+    ("upstream_dns_cache_hits_total", "Gemini API DNS lookups answered from the cache", lambda: upstream_transport.network_backend.resolver.hits),
+    ("upstream_dns_cache_misses_total", "Gemini API DNS lookups sent to the resolver", lambda: upstream_transport.network_backend.resolver.misses),
+):
+    registry.counter(_name, _help).set_function(_function)
+
+tool_host = ToolHost(
+    thread_workers=settings.tool_thread_workers,
+    process_workers=settings.tool_process_workers,
+    default_executor=settings.tool_default_executor,
+    default_timeout=settings.tool_timeout_seconds,
+    result_cache=(
+        ToolResultCache(max_entries=settings.tool_cache_max_entries)
+        if settings.tool_cache_enabled
+        else None
+    ),
+)
+
+
+# A PRNG draw is instant and never blocks, so this tool runs inline: a pool
+# hop would cost more than the call. Tools that do I/O or real work take
+# TOOL_DEFAULT_EXECUTOR by leaving ``executor`` unset.
+@tool_host.tool(executor="inline")
+def roll_dice() -> str:
+    """Roll a six-sided die and return the result."""
+    return str(random.randint(1, 6))
+
+
+tool_host.register(agent)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_ups = []
+    if settings.model_warmup:
+        # Accept connections right away; a request that needs the model
+        # before it is built waits for it
+        warm_ups = [asyncio.create_task(lazy.warm_up()) for lazy in lazy_models()]
+    yield
+    await asyncio.gather(*warm_ups)
+    tool_host.shutdown(wait=False)
+    await upstream_transport.aclose()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -32,29 +375,324 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[VERSION_HEADER],
 )
 
-# @agent.tool_plain
-# def roll_dice() -> str:
-#     """Roll a six-sided die and return the result."""
-#     return str(random.randint(1, 6))
+def agent_tool_names() -> List[str]:
+    """Names of the tools registered with the agent."""
+    return sorted(
+        name
+        for toolset in agent.toolsets
+        for name in getattr(toolset, "tools", {})
+    )
 
 
-@app.post("/")
-async def run_agent(request: Request) -> Response:
-    accept = request.headers.get('accept', SSE_CONTENT_TYPE)
+def chat_cache_key(messages: List[Dict[str, Any]], system_prompt: str) -> str:
+    """
+    Response-cache key of a /chat request.
+
+    Message ids differ between otherwise identical conversations, so they
+    are left out; the model, system prompt and registered tools are included.
+    """
+    return cache_key(
+        model=getattr(agent.model, "model_name", str(agent.model)),
+        system_prompt=system_prompt,
+        tools=agent_tool_names(),
+        messages=[
+            {field: value for field, value in message.items() if field != "id"}
+            for message in messages
+        ],
+    )
+
+
+def agui_flight_key(run_input: RunAgentInput, accept: str) -> str:
+    """
+    Single-flight key of an AG-UI run.
+
+    Thread, run and message ids differ between otherwise identical runs, so
+    they are left out; frames are encoded for ``accept``, so it is included.
+    """
+    return cache_key(
+        accept=accept,
+        model=getattr(agent.model, "model_name", str(agent.model)),
+        tools=agent_tool_names(),
+        client_tools=run_input.tools,
+        messages=[message.model_dump(mode="json", exclude={"id"}) for message in run_input.messages],
+        state=run_input.state,
+        context=run_input.context,
+        forwarded_props=run_input.forwarded_props,
+    )
+
+
+def agui_substitutions(run_input: RunAgentInput) -> Dict[str, str]:
+    """The run's identifiers as they appear in its AG-UI frames."""
+    return {
+        "thread_id": '"threadId":' + json.dumps(run_input.thread_id, ensure_ascii=False),
+        "run_id": '"runId":' + json.dumps(run_input.run_id, ensure_ascii=False),
+    }
+
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+async def read_json(request: Request) -> Any:
+    """Read and parse a JSON request body, timing both stages."""
+    with Timer(stage_seconds.labels("read_body")):
+        body = await request.body()
+    with Timer(stage_seconds.labels("parse")):
+        return loads(body)
+
+
+def json_invalid(error: json.JSONDecodeError) -> RequestValidationError:
+    """FastAPI's 422 error for a body that is not valid JSON."""
+    return RequestValidationError([{
+        "type": "json_invalid",
+        "loc": ("body", error.pos),
+        "msg": "JSON decode error",
+        "input": {},
+        "ctx": {"error": error.msg},
+    }])
+
+
+def body_invalid(error: ValidationError) -> RequestValidationError:
+    """FastAPI's 422 error for a body that does not match its model."""
+    return RequestValidationError([
+        {**detail, "loc": ("body", *detail["loc"])}
+        for detail in error.errors(include_url=False)
+    ])
+
+
+async def parse_request(request: Request, model: Type[ModelT]) -> ModelT:
+    """
+    Read and validate a JSON request body as ``model``, timing each stage.
+
+    Raises:
+        RequestValidationError: The body is not valid JSON or does not match
+            ``model``, answered with FastAPI's usual 422 response
+    """
     try:
-        run_input = RunAgentInput.model_validate(await request.json())
-    except ValidationError as e:  # pragma: no cover
+        payload = await read_json(request)
+    except json.JSONDecodeError as error:
+        raise json_invalid(error)
+    try:
+        with Timer(stage_seconds.labels("validate")):
+            return model.model_validate(payload)
+    except ValidationError as error:
+        raise body_invalid(error)
+
+
+async def merge_chat_history(http_request: Request, request: ChatMessageRequest) -> Optional[ThreadWrite]:
+    """
+    Merge a /chat request's messages onto the chat's stored history.
+
+    A request with an ``X-Thread-Version`` header carries only the messages
+    added since that version; ``request.messages`` is replaced by the full
+    history. Any other request of a chat with an ``id`` replaces the stored
+    history. Without a thread store only full histories are accepted.
+
+    Returns:
+        The pending write of the request's messages, to commit once the run
+        completed; None if the chat is not stored
+
+    Raises:
+        ThreadVersionConflict: The request follows a stale history version
+            (or has no chat id to look the history up by)
+    """
+    version = parse_thread_version(http_request.headers.get(VERSION_HEADER))
+    if thread_store is None or not request.id:
+        if version is not None:
+            # Only new messages, and no history to put them after
+            raise ThreadVersionConflict()
+        return None
+    key = f"chat:{request.id}"
+    if version is None:
+        return thread_store.write(key, request.messages)
+    stored = await thread_store.load(key, version)
+    write = thread_store.write(key, request.messages, stored)
+    request.messages = stored.messages + request.messages
+    return write
+
+
+def is_run_error(frame: Union[str, bytes]) -> bool:
+    """Whether an AG-UI frame reports that the run failed."""
+    if isinstance(frame, bytes):
+        return b'"RUN_ERROR"' in frame
+    return '"RUN_ERROR"' in frame
+
+
+CHAT_ERROR_MARKER = b'"%s"' % ERROR_TEXT_ID.encode()
+
+
+def is_chat_error(frame: bytes) -> bool:
+    """Whether a /chat frame reports that the run failed."""
+    return CHAT_ERROR_MARKER in frame
+
+
+async def meter_agui_frames(frames: AsyncIterator[str], meter: StreamMeter) -> AsyncIterator[str]:
+    """Tick ``meter`` for every streamed text or tool-argument event."""
+    async for frame in frames:
+        if '"TEXT_MESSAGE_CONTENT"' in frame or '"TOOL_CALL_ARGS"' in frame:
+            meter.tick()
+        yield frame
+
+
+async def resumable_stream(
+    request: Request,
+    run_key: Optional[str],
+    start: Callable[[], AsyncIterator],
+    meter: Optional[StreamMeter] = None,
+    flight_key: Optional[str] = None,
+    substitutions: Optional[Dict[str, str]] = None,
+) -> Union[Tuple[AsyncIterator, Optional[Lease]], Response]:
+    """
+    Stream a run, resuming an earlier one registered under ``run_key``.
+
+    Without a replay registry or a usable ``run_key`` the run is streamed
+    directly. Otherwise a request with a ``Last-Event-ID`` header follows
+    the run registered under ``run_key`` from that id, and any other request
+    starts a new run in the background that replaces it: a repeated request
+    without the header is a retry or a regenerate, not a reconnect.
+
+    With single flight enabled, a new run whose ``flight_key`` matches a run
+    in progress follows that run from its first frame instead, with its own
+    identifiers (``substitutions``) in the frames.
+
+    Only new runs go through admission control; following a run that is
+    already in progress costs no upstream work.
+
+    Returns:
+        The frame iterator to stream and the permit or single-flight
+        subscription the response must release (a run streamed directly only
+        starts when its body is read), or an error response if the run was not admitted or the
+        frames after ``Last-Event-ID`` are no longer buffered
+    """
+    poll_interval = settings.disconnect_poll_interval_ms / 1000
+    replayable = replay_registry is not None and run_key is not None
+    resuming = replayable and "last-event-id" in request.headers
+    last_event_id = parse_last_event_id(request.headers.get("last-event-id"))
+    run = replay_registry.get(run_key) if resuming else None
+
+    if run is None:
+        shared = single_flight is not None and flight_key is not None
+        frames = single_flight.join(flight_key, substitutions) if shared else None
+        # What the stream holds until it ends: a subscription or a permit
+        lease = frames
+        if frames is None:
+            permit = None
+            if admission is not None:
+                try:
+                    permit = await admission.acquire(admission_key(request, settings.admission_key_header))
+                except AdmissionRejected as rejected:
+                    return rejected.to_response()
+                # Another request may have started the run while this one waited
+                run = replay_registry.get(run_key) if resuming else None
+
+            if run is not None:
+                permit.release()
+            else:
+                for lazy in lazy_models():
+                    # The agent would build it on the event loop
+                    await lazy.build()
+
+                if shared:
+                    # The shared run holds the slot until it ends, whoever follows it
+                    frames = lease = single_flight.start(flight_key, start, substitutions, lease=permit)
+                else:
+                    frames, lease = start(), permit
+                    if permit is not None:
+                        # The slot is freed as soon as the run ends, fails or is cancelled
+                        frames = hold_permit(permit, frames)
+        if run is None:
+            if not replayable:
+                frames = cancel_on_disconnect(
+                    request, frames, meter=meter, poll_interval=poll_interval, buffer=stream_buffer()
+                )
+                return frames, lease
+            run = replay_registry.start(run_key, frames, meter, lease=lease)
+            last_event_id = -1
+
+    if not run.can_resume(last_event_id):
+        return Response(
+            content=json.dumps({"detail": "Events after Last-Event-ID are no longer available"}),
+            media_type='application/json',
+            status_code=HTTPStatus.CONFLICT,
+        )
+    if run.done and not run.completed:
+        # Replaying it would end the answer early with a normal end of stream
         return Response(
-            content=json.dumps(e.json()),
+            content=json.dumps({"detail": "The run was cancelled before it finished; send the request again"}),
             media_type='application/json',
-            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            status_code=HTTPStatus.CONFLICT,
         )
 
-    event_stream = run_ag_ui(agent, run_input, accept=accept)
+    # The run outlives this connection; a disconnect only drops the subscription
+    return cancel_on_disconnect(
+        request,
+        run.follow(last_event_id),
+        poll_interval=poll_interval,
+        buffer=stream_buffer(),
+        stats=None,
+    ), None
+
+
+@app.get("/metrics")
+async def metrics_endpoint() -> Response:
+    """Prometheus metrics"""
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.post("/")
+async def run_agent(request: Request) -> Response:
+    accept = request.headers.get('accept', SSE_CONTENT_TYPE)
+    meter = StreamMeter()
+    with Timer(stage_seconds.labels("read_body")):
+        body = await request.body()
+    try:
+        version = parse_thread_version(request.headers.get(VERSION_HEADER))
+        if thread_store is not None:
+            run_input, thread_write = await decode_thread_run_input(
+                body, thread_store, version, thread_cache
+            )
+        elif version is not None:
+            # Only new messages, and no history to put them after
+            raise ThreadVersionConflict()
+        else:
+            run_input, thread_write = decode_run_input(body, thread_cache), None
+    except json.JSONDecodeError as error:
+        raise json_invalid(error)
+    except ValidationError as error:
+        raise body_invalid(error)
+    except ThreadVersionConflict as conflict:
+        return conflict.to_response()
+
+    streamed = await resumable_stream(
+        request,
+        f"agui:{run_input.thread_id}:{run_input.run_id}",
+        lambda: meter_agui_frames(run_ag_ui(agent, run_input, accept=accept), meter),
+        meter=meter,
+        flight_key=agui_flight_key(run_input, accept) if single_flight is not None else None,
+        substitutions=agui_substitutions(run_input),
+    )
+    if isinstance(streamed, Response):
+        return streamed
+    event_stream, lease = streamed
+
+    headers = {}
+    if thread_write is not None:
+        # Stored once this client was sent the whole run without an error
+        event_stream = commit_on_success(event_stream, thread_write, is_run_error)
+        headers[VERSION_HEADER] = thread_write.version
+    if compression is not None:
+        event_stream, compression_headers = compression.wrap(request.headers.get("accept-encoding"), event_stream)
+        headers.update(compression_headers)
 
-    return StreamingResponse(event_stream, media_type=accept)
+    return AdmittedStreamingResponse(
+        event_stream,
+        lease=lease,
+        # What run_ag_ui's encoder writes for this Accept header
+        media_type=EventEncoder(accept=accept).get_content_type(),
+        headers=headers or None,
+    )
 
 
 
@@ -70,7 +708,7 @@ async def run_agent(request: Request) -> Response:
 #         print(result.all_messages())
 
 @app.post("/chat")
-async def chat_with_agent(request: ChatMessageRequest) -> StreamingResponse:
+async def chat_with_agent(http_request: Request) -> Response:
     """
     The main (and only) endpoint for this minimalist demonstration.
 
@@ -100,7 +738,14 @@ async def chat_with_agent(request: ChatMessageRequest) -> StreamingResponse:
         ]
     }
     """
-    print(f"🚀 Received chat request with {len(request.messages)} messages")
+    meter = StreamMeter()
+    request = await parse_request(http_request, ChatMessageRequest)
+    try:
+        thread_write = await merge_chat_history(http_request, request)
+    except ThreadVersionConflict as conflict:
+        return conflict.to_response()
+
+    logger.debug("Received chat request with %d messages", len(request.messages))
 
     try:
 
@@ -110,13 +755,17 @@ You can do nothing else.
 """
 
         # Convert Vercel AI SDK messages to Pydantic-AI format
-        user_message, message_history = convert_vercel_messages_to_pydantic(
-            request.messages,
-            system_prompt_content=system_prompt_content
-        )
+        with Timer(stage_seconds.labels("convert")):
+            user_message, message_history = convert_vercel_messages_to_pydantic(
+                request.messages,
+                system_prompt_content=system_prompt_content,
+                cache=history_cache,
+                conversation_id=request.id,
+            )
 
-        print(f"📝 User message: {user_message[:100]}...")
-        print(f"📚 Message history: {len(message_history)} previous messages")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("User message: %s...", user_message[:100])
+            logger.debug("Message history: %d previous messages", len(message_history))
 
         # Create the streaming response function
         async def stream_agent_response():
@@ -126,39 +775,85 @@ You can do nothing else.
             It runs the agent and converts the stream to the format expected
             by the Vercel AI SDK on the frontend.
             """
-            try:
+            coalescer = DeltaCoalescer(
+                max_bytes=settings.chat_coalesce_max_bytes,
+                max_delay=settings.chat_coalesce_max_delay_ms / 1000,
+                encoder=stream_encoder,
+            )
+
+            async def run_agent_frames():
                 # Run the agent with conversation context - matching the working pattern
                 async with agent.iter(user_message, message_history=message_history) as agent_run:
                     async for node in agent_run:
                         # Convert to data stream protocol format - use the same pattern as the working version
-                        async for chunk in to_data_stream_protocol(node, agent_run):
+                        async for chunk in to_data_stream_protocol(
+                            node, agent_run, coalescer, meter=meter
+                        ):
                             yield chunk
 
+            try:
+                frames = run_agent_frames()
+                if response_cache is not None:
+                    key = chat_cache_key(request.messages, system_prompt_content)
+                    cached = await response_cache.lookup(key)
+                    if cached is not None:
+                        yield cached
+                        return
+                    frames = response_cache.record(key, frames)
+
+                async for chunk in frames:
+                    yield chunk
+
             except Exception as e:
-                print(f"❌ Error in agent stream: {str(e)}")
+                logger.exception("Error in agent stream")
                 # Send error as a text stream
-                error_id = "error-text"
                 error_msg = f"I apologize, but I encountered an error: {str(e)}"
 
-                yield f"data: {json.dumps({'type': 'text-start', 'id': error_id})}\n\n"
-                yield f"data: {json.dumps({'type': 'text-delta', 'id': error_id, 'delta': error_msg})}\n\n"
-                yield f"data: {json.dumps({'type': 'text-end', 'id': error_id})}\n\n"
+                for chunk in stream_encoder.error_text(error_msg):
+                    yield chunk
 
         # Return the streaming response with proper headers
-        response = StreamingResponse(
-            stream_agent_response(),
-            media_type="text/event-stream"
+        last_message_id = request.messages[-1].get("id") if request.messages else None
+        streamed = await resumable_stream(
+            http_request,
+            f"chat:{request.id}:{last_message_id}" if request.id and last_message_id else None,
+            stream_agent_response,
+            meter=meter,
+            flight_key=(
+                chat_cache_key(request.messages, system_prompt_content) if single_flight is not None else None
+            ),
+        )
+        if isinstance(streamed, Response):
+            return streamed
+        event_stream, lease = streamed
+        if thread_write is not None:
+            # Stored once this client was sent the whole run without an error
+            event_stream = commit_on_success(event_stream, thread_write, is_chat_error)
+
+        compression_headers = {}
+        if compression is not None:
+            event_stream, compression_headers = compression.wrap(
+                http_request.headers.get("accept-encoding"), event_stream
+            )
+
+        response = AdmittedStreamingResponse(
+            event_stream,
+            lease=lease,
+            media_type="text/event-stream",
+            headers=compression_headers or None,
         )
 
         # Set headers required for Server-Sent Events
         response.headers["Cache-Control"] = "no-cache"
         response.headers["Connection"] = "keep-alive"
         response.headers["Content-Type"] = "text/event-stream"
+        if thread_write is not None:
+            response.headers[VERSION_HEADER] = thread_write.version
 
         return response
 
     except Exception as e:
-        print(f"❌ Error in chat endpoint: {str(e)}")
+        logger.exception("Error in chat endpoint")
         raise HTTPException(status_code=500, detail=str(e))
 
 
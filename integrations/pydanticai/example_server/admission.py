@@ -0,0 +1,330 @@
+"""
+Admission control for the streaming endpoints.
+
+Every run that would open an upstream stream first asks the
+``AdmissionController`` for a permit. A permit is granted when
+
+- the global and per-key token buckets have a token (request rate), and
+- fewer than ``max_concurrent`` runs are active overall and fewer than
+  ``max_concurrent_per_key`` for the caller's key (concurrent streams).
+
+A request over a rate limit is rejected at once. A request over a
+concurrency limit waits in a bounded FIFO queue; it is rejected at once if
+the queue is full and shed if no slot frees up before its deadline. Rejected
+requests are answered with 429 and a ``Retry-After`` header before any
+upstream work is done.
+
+The key is taken from a request header (e.g. a tenant or API-key id) and
+falls back to the client address.
+"""
+
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from http import HTTPStatus
+from typing import AsyncIterator, Deque, Dict, Optional, Protocol, Tuple, TypeVar
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from . import metrics
+
+T = TypeVar("T")
+
+queue_depth = metrics.registry.gauge(
+    "admission_queue_depth",
+    "Requests waiting for a concurrency slot",
+)
+active_runs = metrics.registry.gauge(
+    "admission_active_runs",
+    "Runs holding an admission permit",
+)
+wait_seconds = metrics.registry.histogram(
+    "admission_wait_seconds",
+    "Time admitted requests spent waiting for a concurrency slot",
+)
+rejections = metrics.registry.counter(
+    "admission_rejections_total",
+    "Requests rejected with 429",
+    ("reason",),
+)
+
+
+class AdmissionRejected(Exception):
+    """
+    A request was not admitted.
+
+    Args:
+        reason: ``"rate_limited"``, ``"queue_full"`` or ``"deadline"``
+        retry_after: Suggested seconds before retrying
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def to_response(self) -> Response:
+        """The 429 response for this rejection."""
+        return Response(
+            content=json.dumps({"detail": f"Too many requests ({self.reason.replace('_', ' ')})"}),
+            media_type="application/json",
+            status_code=HTTPStatus.TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(max(1, math.ceil(self.retry_after)))},
+        )
+
+
+class TokenBucket:
+    """
+    Classic token bucket.
+
+    Args:
+        rate: Tokens added per second (0 disables the limit)
+        burst: Bucket capacity
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take a token if one is available.
+
+        Returns:
+            0 if a token was taken, otherwise seconds until one is available
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class Lease(Protocol):
+    """Something a stream holds until it ends; releasing it twice is harmless."""
+
+    def release(self) -> None: ...
+
+
+class Permit:
+    """A granted admission; release it exactly once when the run ends."""
+
+    __slots__ = ("controller", "key", "released")
+
+    def __init__(self, controller: "AdmissionController", key: str):
+        self.controller = controller
+        self.key = key
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller._release(self.key)
+
+    def transfer(self) -> "Permit":
+        """Hand the slot to a new permit; releasing this one then frees nothing."""
+        permit = Permit(self.controller, self.key)
+        permit.released = self.released
+        self.released = True
+        return permit
+
+
+class AdmissionController:
+    """
+    Global and per-key concurrency limits, rate limits and a wait queue.
+
+    Args:
+        max_concurrent: Runs active at once across all keys (0 disables)
+        max_concurrent_per_key: Runs active at once per key (0 disables)
+        rate: Requests per second across all keys (0 disables)
+        burst: Global token-bucket capacity
+        rate_per_key: Requests per second per key (0 disables)
+        burst_per_key: Per-key token-bucket capacity
+        max_queue: Requests that may wait for a slot (0 rejects at once)
+        max_wait: Seconds a request may wait before it is shed
+        max_keys: Per-key buckets kept before idle ones are dropped
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 256,
+        max_concurrent_per_key: int = 32,
+        rate: float = 0.0,
+        burst: float = 50.0,
+        rate_per_key: float = 0.0,
+        burst_per_key: float = 10.0,
+        max_queue: int = 512,
+        max_wait: float = 5.0,
+        max_keys: int = 10000,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_concurrent_per_key = max_concurrent_per_key
+        self.rate_per_key = rate_per_key
+        self.burst_per_key = burst_per_key
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_keys = max_keys
+        self.active = 0
+        self._bucket = TokenBucket(rate, burst)
+        self._key_buckets: Dict[str, TokenBucket] = {}
+        self._active_by_key: Dict[str, int] = {}
+        self._waiters: Deque[Tuple[str, asyncio.Future]] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, key: str) -> Permit:
+        """
+        Wait for a permit for ``key``.
+
+        Raises:
+            AdmissionRejected: Over a rate limit, queue full or deadline hit
+        """
+        retry_after = max(self._bucket.take(), self._key_bucket(key).take())
+        if retry_after:
+            rejections.labels("rate_limited").inc()
+            raise AdmissionRejected("rate_limited", retry_after)
+
+        if not self._waiters and self._has_room(key):
+            self._admit(key)
+            wait_seconds.observe(0.0)
+            return Permit(self, key)
+
+        if len(self._waiters) >= self.max_queue:
+            rejections.labels("queue_full").inc()
+            raise AdmissionRejected("queue_full", self.max_wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (key, waiter)
+        self._waiters.append(entry)
+        started = time.monotonic()
+        # Waiters ahead may be held only by their own key's limit
+        self._dispatch()
+        try:
+            await asyncio.wait({waiter}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            # The client went away while queued; give a granted slot back
+            if waiter.done() and not waiter.cancelled():
+                self._release(key)
+            else:
+                self._remove(entry)
+            raise
+        if not waiter.done():
+            self._remove(entry)
+            rejections.labels("deadline").inc()
+            raise AdmissionRejected("deadline", self.max_wait)
+        wait_seconds.observe(time.monotonic() - started)
+        return Permit(self, key)
+
+    def _key_bucket(self, key: str) -> TokenBucket:
+        bucket = self._key_buckets.get(key)
+        if bucket is None:
+            if len(self._key_buckets) >= self.max_keys:
+                # Drop the oldest bucket; a returning key just starts full again
+                del self._key_buckets[next(iter(self._key_buckets))]
+            bucket = self._key_buckets[key] = TokenBucket(self.rate_per_key, self.burst_per_key)
+        return bucket
+
+    def _has_room(self, key: str) -> bool:
+        if self.max_concurrent and self.active >= self.max_concurrent:
+            return False
+        if self.max_concurrent_per_key and self._active_by_key.get(key, 0) >= self.max_concurrent_per_key:
+            return False
+        return True
+
+    def _admit(self, key: str) -> None:
+        self.active += 1
+        self._active_by_key[key] = self._active_by_key.get(key, 0) + 1
+        active_runs.set(self.active)
+
+    def _release(self, key: str) -> None:
+        self.active -= 1
+        remaining = self._active_by_key.get(key, 1) - 1
+        if remaining:
+            self._active_by_key[key] = remaining
+        else:
+            self._active_by_key.pop(key, None)
+        active_runs.set(self.active)
+        self._dispatch()
+
+    def _remove(self, entry: Tuple[str, asyncio.Future]) -> None:
+        try:
+            self._waiters.remove(entry)
+        except ValueError:
+            pass
+        entry[1].cancel()
+        queue_depth.set(len(self._waiters))
+
+    def _dispatch(self) -> None:
+        """Hand freed slots to the oldest waiters whose key has room."""
+        for entry in list(self._waiters):
+            if self.max_concurrent and self.active >= self.max_concurrent:
+                break
+            key, waiter = entry
+            if waiter.done():
+                self._waiters.remove(entry)
+            elif self._has_room(key):
+                self._waiters.remove(entry)
+                self._admit(key)
+                waiter.set_result(None)
+        queue_depth.set(len(self._waiters))
+
+
+def admission_key(request: Request, header: str) -> str:
+    """The caller's admission key: ``header`` if present, else the client address."""
+    key = request.headers.get(header) if header else None
+    if key:
+        return key
+    return request.client.host if request.client else "unknown"
+
+
+async def hold_permit(permit: Permit, source: AsyncIterator[T]) -> AsyncIterator[T]:
+    """
+    Relay ``source`` and release ``permit`` when it ends, fails or is closed.
+
+    A generator that is never started never runs its ``finally``: stream it
+    in an ``AdmittedStreamingResponse`` so the permit is released anyway.
+    """
+    try:
+        async for item in source:
+            yield item
+    finally:
+        permit.release()
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    Streaming response that releases what its stream holds once it is done.
+
+    The server may never iterate the body, e.g. when the client disconnects
+    before the first chunk, and then a ``finally`` in the body never runs
+    (``hold_permit``'s, or a single-flight subscription's).
+
+    Args:
+        lease: The run's admission permit or single-flight subscription, or
+            None when the response holds neither
+    """
+
+    def __init__(self, content, lease: Optional[Lease] = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.lease = lease
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.lease is not None:
+                self.lease.release()
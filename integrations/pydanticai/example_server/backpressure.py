@@ -0,0 +1,236 @@
+"""
+Bounded buffer between the upstream reader and the client writer.
+
+``cancel_on_disconnect`` reads the upstream in a producer task and writes to
+the client from the response task; ``StreamBuffer`` sits between them and
+holds at most ``max_frames`` entries and ``max_bytes`` bytes per stream. What
+happens when a slow client lets it fill up is the buffer's policy:
+
+- ``"block"``: the producer waits for room, so reading the upstream stalls
+  with the client (memory stays bounded, the upstream may time out)
+- ``"coalesce"``: the producer keeps reading; new frames are appended to the
+  newest entry, and consecutive delta events that differ only in ``delta``
+  are merged into one frame, so the client gets fewer, larger writes. Once
+  ``max_bytes`` is buffered the producer waits as with ``"block"``
+- ``"drop"``: the producer waits up to ``drop_after`` seconds for room, then
+  the buffered frames are discarded and the client is disconnected
+
+Frames are SSE ``str`` or ``bytes``; one stream uses one type.
+"""
+
+import asyncio
+import json
+from collections import deque
+from typing import Any, Deque, List, Optional, Tuple, Union
+
+from . import metrics
+
+Frame = Union[str, bytes]
+
+POLICIES = ("block", "coalesce", "drop")
+
+# Delta frames are only merged while the merged frame stays this small, so a
+# long coalesced stretch costs no repeated parsing of a large frame
+MAX_MERGED_FRAME = 8 * 1024
+
+BYTE_BUCKETS = (
+    256, 1024, 4096, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024,
+)
+
+buffer_peak_bytes = metrics.registry.histogram(
+    "stream_buffer_peak_bytes",
+    "Largest number of bytes buffered for a client during a stream",
+    buckets=BYTE_BUCKETS,
+)
+coalesced_frames = metrics.registry.counter(
+    "stream_buffer_coalesced_total",
+    "Frames coalesced into a buffered entry because the client was slow",
+)
+slow_consumer_drops = metrics.registry.counter(
+    "slow_consumer_drops_total",
+    "Clients disconnected for reading too slowly",
+)
+
+END = object()
+
+
+class SlowConsumerError(Exception):
+    """The client did not make room in its buffer in time."""
+
+
+def merge_delta_frames(first: Frame, second: Frame) -> Optional[Frame]:
+    """
+    Merge two SSE delta events into one, if they differ only in ``delta``.
+
+    Works for AG-UI ``*_CHUNK`` events and Data Stream Protocol
+    ``text-delta`` frames alike. Frames of a resumable stream start with an
+    ``id:`` line; the merged frame takes the id of ``second``, the last event
+    it carries.
+
+    Returns:
+        The merged frame, or None if the frames cannot be merged
+    """
+    if type(first) is not type(second) or len(first) + len(second) > MAX_MERGED_FRAME:
+        return None
+    prefix, end = ("data: ", "\n\n") if isinstance(first, str) else (b"data: ", b"\n\n")
+    id_a, first = _split_event_id(first)
+    id_b, second = _split_event_id(second)
+    if bool(id_a) != bool(id_b):
+        return None
+    if not (first.startswith(prefix) and second.startswith(prefix)):
+        return None
+    if not (first.endswith(end) and second.endswith(end)):
+        return None
+    try:
+        a = json.loads(first[len(prefix):-len(end)])
+        b = json.loads(second[len(prefix):-len(end)])
+    except ValueError:
+        return None
+    if not (isinstance(a, dict) and isinstance(b, dict)):
+        return None
+    delta_a, delta_b = a.pop("delta", None), b.pop("delta", None)
+    if not (isinstance(delta_a, str) and isinstance(delta_b, str)) or a != b:
+        return None
+    a["delta"] = delta_a + delta_b
+    payload = json.dumps(a, ensure_ascii=False, separators=(",", ":"))
+    return id_b + prefix + (payload if isinstance(first, str) else payload.encode()) + end
+
+
+def _split_event_id(frame: Frame) -> Tuple[Frame, Frame]:
+    """Split a frame into its ``id:`` line (empty if it has none) and the rest."""
+    id_prefix, newline = ("id: ", "\n") if isinstance(frame, str) else (b"id: ", b"\n")
+    if not frame.startswith(id_prefix):
+        return frame[:0], frame
+    line_end = frame.find(newline) + 1
+    return frame[:line_end], frame[line_end:]
+
+
+class StreamBuffer:
+    """
+    Single-producer, single-consumer frame buffer with a slow-consumer policy.
+
+    Args:
+        policy: ``"block"``, ``"coalesce"`` or ``"drop"``
+        max_frames: Buffered entries before the policy applies
+        max_bytes: Buffered bytes before the producer must wait (a single
+            larger frame is still accepted into an empty buffer)
+        drop_after: Seconds the ``"drop"`` policy waits for room
+    """
+
+    def __init__(
+        self,
+        policy: str = "block",
+        max_frames: int = 16,
+        max_bytes: int = 256 * 1024,
+        drop_after: float = 10.0,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow-consumer policy {policy!r}, expected one of {POLICIES}")
+        self.policy = policy
+        self.max_frames = max(1, max_frames)
+        self.max_bytes = max_bytes
+        self.drop_after = drop_after
+        self.bytes = 0
+        self.peak_bytes = 0
+        self.coalesced = 0
+        self._entries: Deque[List[Frame]] = deque()
+        self._finished = False
+        self._error: Optional[BaseException] = None
+        self._getter: Optional[asyncio.Future] = None
+        self._putter: Optional[asyncio.Future] = None
+
+    def empty(self) -> bool:
+        """Whether ``get_nowait`` has nothing to return."""
+        return not self._entries and not self._finished
+
+    async def put(self, frame: Frame) -> None:
+        """
+        Buffer ``frame``, applying the policy while the buffer is full.
+
+        Raises:
+            SlowConsumerError: ``"drop"`` policy and no room within
+                ``drop_after`` seconds
+        """
+        size = len(frame)
+        while self._entries and self._full(size):
+            if self.policy == "coalesce" and self._coalesce(frame, size):
+                return
+            room = asyncio.get_running_loop().create_future()
+            self._putter = room
+            if self.policy == "drop":
+                done, _ = await asyncio.wait({room}, timeout=self.drop_after)
+                if not done:
+                    self._putter = None
+                    raise SlowConsumerError(f"Client read nothing for {self.drop_after:g}s")
+            else:
+                await room
+        self._entries.append([frame])
+        self._grow(size)
+        self._wake_getter()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Mark the end of the stream; ``error`` is returned after the buffered frames."""
+        self._finished = True
+        self._error = error
+        if isinstance(error, SlowConsumerError):
+            # Nothing more will be written to this client
+            self._entries.clear()
+            self.bytes = 0
+        self._wake_getter()
+
+    def get_nowait(self) -> Tuple[Any, Optional[BaseException]]:
+        """
+        Take the oldest entry.
+
+        Returns:
+            ``(frame, None)``, or ``(END, error)`` once the stream has finished
+        """
+        if not self._entries:
+            if not self._finished:
+                raise asyncio.QueueEmpty
+            return END, self._error
+        parts = self._entries.popleft()
+        frame = parts[0] if len(parts) == 1 else parts[0][:0].join(parts)
+        self.bytes -= len(frame)
+        if self._putter is not None and not self._putter.done():
+            self._putter.set_result(None)
+        self._putter = None
+        return frame, None
+
+    async def get(self) -> Tuple[Any, Optional[BaseException]]:
+        """Wait for and take the oldest entry, as ``get_nowait``."""
+        while self.empty():
+            self._getter = asyncio.get_running_loop().create_future()
+            await self._getter
+        return self.get_nowait()
+
+    def _full(self, size: int) -> bool:
+        return len(self._entries) >= self.max_frames or self.bytes + size > self.max_bytes
+
+    def _coalesce(self, frame: Frame, size: int) -> bool:
+        """Append ``frame`` to the newest entry if the byte budget allows."""
+        if self.bytes + size > self.max_bytes:
+            return False
+        parts = self._entries[-1]
+        if type(parts[-1]) is not type(frame):
+            return False
+        merged = merge_delta_frames(parts[-1], frame)
+        if merged is None:
+            parts.append(frame)
+            self._grow(size)
+        else:
+            self._grow(len(merged) - len(parts[-1]))
+            parts[-1] = merged
+        self.coalesced += 1
+        coalesced_frames.inc()
+        return True
+
+    def _grow(self, size: int) -> None:
+        self.bytes += size
+        if self.bytes > self.peak_bytes:
+            self.peak_bytes = self.bytes
+
+    def _wake_getter(self) -> None:
+        if self._getter is not None and not self._getter.done():
+            self._getter.set_result(None)
+        self._getter = None
@@ -0,0 +1,194 @@
+"""
+Helpers for writing the Vercel AI SDK Data Stream Protocol.
+
+``DataStreamEncoder`` builds SSE frames as bytes from cached per-id
+templates, so the per-token cost is escaping the delta text and one
+concatenation. It uses ``orjson`` when installed and the standard library
+``json`` module otherwise.
+
+``DeltaCoalescer`` merges consecutive ``text-delta`` chunks for the same text
+id so a token-by-token model stream is written as fewer, larger SSE frames.
+Buffered text is flushed once it reaches a byte budget, once the oldest
+buffered delta has waited for the latency budget, or before any other frame
+is written, so frame ordering is never changed.
+"""
+
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional fast backend
+    orjson = None
+
+from . import metrics
+
+_encode_seconds = metrics.stage_seconds.labels("encode")
+
+JSON_BACKENDS = ("auto", "json", "orjson")
+
+# Text id of the frames written by ``DataStreamEncoder.error_text``
+ERROR_TEXT_ID = "error-text"
+
+
+class DataStreamEncoder:
+    """
+    Encode Data Stream Protocol frames as ``bytes``.
+
+    Args:
+        backend: ``"orjson"``, ``"json"`` or ``"auto"`` (orjson if installed)
+        max_cached_ids: Number of text ids whose frame templates are cached
+    """
+
+    def __init__(self, backend: str = "auto", max_cached_ids: int = 1024):
+        if backend not in JSON_BACKENDS:
+            raise ValueError(f"Unknown JSON backend {backend!r}, expected one of {JSON_BACKENDS}")
+        if backend == "orjson" and orjson is None:
+            raise ValueError("The orjson backend requires the 'orjson' package")
+        if backend == "orjson" or (backend == "auto" and orjson is not None):
+            self.backend = "orjson"
+            self._dumps = _orjson_dumps
+        else:
+            self.backend = "json"
+            self._dumps = _json_dumps
+        self.max_cached_ids = max_cached_ids
+        self._templates: Dict[str, tuple[bytes, bytes, bytes]] = {}
+
+    def _text_templates(self, text_id: str) -> tuple[bytes, bytes, bytes]:
+        """Return (text-start frame, text-delta prefix, text-end frame) for ``text_id``."""
+        templates = self._templates.get(text_id)
+        if templates is None:
+            if len(self._templates) >= self.max_cached_ids:
+                self._templates.clear()
+            quoted_id = self._dumps(text_id)
+            templates = (
+                b'data: {"type":"text-start","id":' + quoted_id + b"}\n\n",
+                b'data: {"type":"text-delta","id":' + quoted_id + b',"delta":',
+                b'data: {"type":"text-end","id":' + quoted_id + b"}\n\n",
+            )
+            self._templates[text_id] = templates
+        return templates
+
+    def text_start(self, text_id: str) -> bytes:
+        return self._text_templates(text_id)[0]
+
+    def text_delta(self, text_id: str, delta: str) -> bytes:
+        return self._text_templates(text_id)[1] + self._dumps(delta) + b"}\n\n"
+
+    def text_end(self, text_id: str) -> bytes:
+        return self._text_templates(text_id)[2]
+
+    def tool_input_available(self, tool_call_id: str, tool_name: str, tool_input: Any) -> bytes:
+        return self.frame({
+            "type": "tool-input-available",
+            "toolCallId": tool_call_id,
+            "toolName": tool_name,
+            "input": tool_input,
+        })
+
+    def tool_output_available(self, tool_call_id: str, output: Any) -> bytes:
+        return self.frame({
+            "type": "tool-output-available",
+            "toolCallId": tool_call_id,
+            "output": output,
+        })
+
+    def error_text(self, message: str, text_id: str = ERROR_TEXT_ID) -> List[bytes]:
+        """Frames reporting ``message`` to the client as a complete text part."""
+        return [
+            self.text_start(text_id),
+            self.text_delta(text_id, message),
+            self.text_end(text_id),
+        ]
+
+    def frame(self, payload: Dict[str, Any]) -> bytes:
+        """Encode an arbitrary payload as a frame."""
+        return b"data: " + self._dumps(payload) + b"\n\n"
+
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _json_dumps(value: Any) -> bytes:
+    return _json_encoder.encode(value).encode()
+
+
+def _orjson_dumps(value: Any) -> bytes:
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+
+default_encoder = DataStreamEncoder()
+
+
+class DeltaCoalescer:
+    """
+    Buffer text deltas up to a byte or latency budget.
+
+    Args:
+        max_bytes: Flush once this many UTF-8 bytes are buffered (0 disables)
+        max_delay: Flush once the oldest buffered delta is this many seconds
+            old (0 disables)
+        encoder: Frame encoder, defaults to the module encoder
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 1024,
+        max_delay: float = 0.02,
+        encoder: Optional[DataStreamEncoder] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.encoder = encoder or default_encoder
+        self._text_id: Optional[str] = None
+        self._parts: List[str] = []
+        self._size = 0
+        self._started = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.max_delay > 0
+
+    def add(self, text_id: str, delta: str) -> List[bytes]:
+        """
+        Buffer ``delta`` for ``text_id``.
+
+        Returns:
+            Frames that are due to be written (possibly empty)
+        """
+        if not self.enabled:
+            return [self.encoder.text_delta(text_id, delta)]
+
+        frames = []
+        if self._text_id is not None and self._text_id != text_id:
+            frames.extend(self.flush())
+        if not self._parts:
+            self._text_id = text_id
+            self._started = time.monotonic()
+        self._parts.append(delta)
+        self._size += len(delta.encode())
+        if self.max_bytes and self._size >= self.max_bytes:
+            frames.extend(self.flush())
+        elif self.max_delay and time.monotonic() - self._started >= self.max_delay:
+            frames.extend(self.flush())
+        return frames
+
+    def flush(self) -> List[bytes]:
+        """Return the buffered text as a single frame and reset the buffer."""
+        if not self._parts:
+            return []
+        started = time.perf_counter()
+        frame = self.encoder.text_delta(self._text_id, "".join(self._parts))
+        _encode_seconds.observe(time.perf_counter() - started)
+        self._text_id = None
+        self._parts = []
+        self._size = 0
+        return [frame]
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until buffered text must be flushed, or None if nothing is pending."""
+        if not self._parts or not self.max_delay:
+            return None
+        return max(0.0, self._started + self.max_delay - time.monotonic())
+
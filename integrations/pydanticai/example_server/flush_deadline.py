@@ -0,0 +1,89 @@
+"""
+Latency-bounded iteration of an upstream stream.
+
+A batcher (``ChunkBatcher``, ``DeltaCoalescer``) holds deltas back until its
+size budget fills or its latency budget expires. While the upstream is quiet
+nothing would flush them, so ``iter_with_flush_deadline`` reads the upstream
+in a pump task and yields ``None`` when the latency budget expires first.
+
+The pump reads at most ``max_queued`` items ahead of the consumer, one by
+default, so a slow client still slows down reading the upstream (see
+``StreamBuffer``). When the iteration ends, fails or is closed, the pump is
+cancelled and awaited before returning: the upstream's own cleanup has run
+by the time the caller closes the stream the chunks came from.
+"""
+
+import asyncio
+from typing import AsyncIterable, AsyncIterator, Optional, Protocol, TypeVar
+
+T = TypeVar("T")
+
+_END = object()
+
+
+class Batcher(Protocol):
+    def time_left(self) -> Optional[float]:
+        """Seconds until buffered deltas must be flushed, or None if nothing is pending."""
+
+
+async def iter_with_flush_deadline(
+    chunks: AsyncIterable[T],
+    batcher: Batcher,
+    max_queued: int = 1,
+) -> AsyncIterator[Optional[T]]:
+    """
+    Iterate ``chunks``, yielding ``None`` whenever the batcher's latency
+    budget expires while waiting for the next chunk.
+
+    Chunks that are already queued are taken without waiting; only an empty
+    queue with buffered deltas waits on a deadline.
+
+    Args:
+        chunks: The upstream stream
+        batcher: Tells how long buffered deltas may still wait
+        max_queued: Chunks the pump may read ahead of the consumer
+    """
+    queue: asyncio.Queue = asyncio.Queue(max_queued)
+
+    async def pump():
+        try:
+            async for chunk in chunks:
+                await queue.put((chunk, None))
+        except Exception as error:  # propagate to the consumer
+            await queue.put((_END, error))
+            return
+        await queue.put((_END, None))
+
+    pump_task = asyncio.ensure_future(pump())
+    getter: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if getter is None and not queue.empty():
+                item = queue.get_nowait()
+            else:
+                timeout = batcher.time_left()
+                if getter is None:
+                    getter = asyncio.ensure_future(queue.get())
+                if timeout is None:
+                    item = await getter
+                else:
+                    done, _ = await asyncio.wait({getter}, timeout=timeout)
+                    if not done:
+                        yield None
+                        continue
+                    item = getter.result()
+                getter = None
+
+            chunk, error = item
+            if chunk is _END:
+                if error is not None:
+                    raise error
+                return
+            yield chunk
+    finally:
+        if getter is not None:
+            getter.cancel()
+        pump_task.cancel()
+        # Unlike awaiting the task, wait() does not swallow a cancellation
+        # of this task with the pump's
+        await asyncio.wait({pump_task})
@@ -0,0 +1,81 @@
+"""
+Model with hedged streaming requests.
+
+``HedgedModel`` races the streamed requests of the wrapped model through a
+``Hedger``: when the first chunk of a response is slow to arrive, the same
+request is sent to a second model (the same one by default) and the response
+whose first chunk arrives first is used. Gemini and function models enter
+``request_stream`` once they have the first chunk of the response, so the
+race is decided on the first token. Requests that are not streamed are not
+hedged.
+"""
+
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+from pydantic_ai.messages import ModelMessage
+from pydantic_ai.models import Model, ModelRequestParameters, StreamedResponse
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.settings import ModelSettings
+
+from .compaction import ModelMessageFormat, estimate_tokens
+from .hedging import Hedger
+
+
+@dataclass(init=False)
+class HedgedModel(WrapperModel):
+    """
+    Wraps a model, hedging its streamed requests.
+
+    Args:
+        wrapped: Model of the first request of every run
+        hedger: Decides when to hedge and counts hedges and wasted tokens
+        hedge: Model of the hedged request; the wrapped model if None
+    """
+
+    hedger: Hedger
+    hedge: Model
+
+    def __init__(self, wrapped: Model, hedger: Hedger, hedge: Optional[Model] = None):
+        super().__init__(wrapped)
+        self.hedger = hedger
+        self.hedge = hedge if hedge is not None else self.wrapped
+
+    @property
+    def models(self) -> Tuple[Model, ...]:
+        """The distinct models requests are sent to."""
+        return (self.wrapped,) if self.hedge is self.wrapped else (self.wrapped, self.hedge)
+
+    @asynccontextmanager
+    async def request_stream(
+        self,
+        messages: List[ModelMessage],
+        model_settings: Optional[ModelSettings],
+        model_request_parameters: ModelRequestParameters,
+        run_context: Optional[Any] = None,
+    ) -> AsyncIterator[StreamedResponse]:
+        async def attempt(index: int) -> Tuple[AsyncExitStack, StreamedResponse]:
+            model = self.hedge if index else self.wrapped
+            stack = AsyncExitStack()
+            try:
+                response = await stack.enter_async_context(
+                    model.request_stream(messages, model_settings, model_request_parameters, run_context)
+                )
+            except BaseException:
+                await stack.aclose()
+                raise
+            return stack, response
+
+        async def discard(opened: Tuple[AsyncExitStack, StreamedResponse]) -> None:
+            # The response's first chunk was read before it lost
+            self.hedger.wasted_tokens += 1
+            await opened[0].aclose()
+
+        def prompt_tokens() -> int:
+            message_format = ModelMessageFormat()
+            return sum(estimate_tokens(len(message_format.text(message))) for message in messages)
+
+        (stack, response), _ = await self.hedger.race(attempt, discard, prompt_tokens)
+        async with stack:
+            yield response
@@ -0,0 +1,179 @@
+"""
+Hedged upstream requests.
+
+A run's time to first token is dominated by the occasional slow upstream
+response. With hedging, a run whose first token has not arrived after a
+delay sends a second request (to the same upstream, or to an alternate model
+or base URL) and uses whichever produces a token first; the other is
+cancelled. The delay is a percentile of the first-token latencies of recent
+runs, so only the slowest few runs are hedged, and hedges are capped at a
+fraction of recent runs so that an upstream that is slow for everyone does
+not also get twice the requests.
+
+The loser's work is wasted: its prompt is processed upstream and any tokens
+it streamed before it was cancelled are thrown away. Both are counted.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, List, Optional, Set, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Discards of attempts that finished after losing; asyncio keeps only weak
+# references to tasks
+_discards: Set[asyncio.Task] = set()
+
+
+class Hedger:
+    """
+    Races a second attempt against slow first attempts.
+
+    Args:
+        percentile: Percentile (0-100) of recent first-token latencies after
+            which a run is hedged
+        min_delay: Shortest delay before hedging, in seconds
+        max_delay: Longest delay before hedging, in seconds; also the delay
+            until ``min_samples`` latencies have been observed
+        min_samples: Latencies observed before the percentile is used
+        window: Recent runs the percentile and the hedge budget cover
+        max_ratio: Largest fraction of recent runs that may be hedged
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        min_delay: float = 0.05,
+        max_delay: float = 2.0,
+        min_samples: int = 20,
+        window: int = 1000,
+        max_ratio: float = 0.1,
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.runs = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+        self.wasted_tokens = 0
+        self.wasted_prompt_tokens = 0
+        self._latencies: deque = deque(maxlen=window)
+        self._hedged: deque = deque(maxlen=window)
+        self._hedged_count = 0
+        self._delay = max_delay
+        self._since_update = 0
+
+    def delay(self) -> float:
+        """Seconds to wait for the first attempt before hedging."""
+        if len(self._latencies) < self.min_samples:
+            return self.max_delay
+        # Sorting the window for every run would cost more than it saves
+        if self._since_update >= max(1, len(self._latencies) // 20):
+            ordered = sorted(self._latencies)
+            rank = min(len(ordered) - 1, max(0, round(self.percentile / 100 * len(ordered)) - 1))
+            self._delay = min(self.max_delay, max(self.min_delay, ordered[rank]))
+            self._since_update = 0
+        return self._delay
+
+    def observe(self, latency: float) -> None:
+        """Record the first-token latency of a run's first attempt."""
+        self._latencies.append(latency)
+        self._since_update += 1
+
+    def allow(self) -> bool:
+        """Whether the budget allows hedging one more of the recent runs."""
+        allowed = self._hedged_count < self.max_ratio * max(len(self._hedged), self.min_samples)
+        if not allowed:
+            self.budget_exhausted += 1
+        return allowed
+
+    async def race(
+        self,
+        attempt: Callable[[int], Awaitable[T]],
+        discard: Callable[[T], Awaitable[None]],
+        prompt_tokens: Callable[[], int] = lambda: 0,
+    ) -> Tuple[T, int]:
+        """
+        Run ``attempt(0)``, hedged with ``attempt(1)`` if it is slow.
+
+        An attempt returns once it has its first token. The result of the
+        first to return is used and the other attempt is cancelled, or passed
+        to ``discard`` if it returned as well. A failed attempt leaves the
+        other running; if the first fails before the hedge is sent, no hedge
+        is sent.
+
+        Args:
+            attempt: Starts attempt 0 (the primary) or 1 (the hedge)
+            discard: Releases the result of an attempt that lost and counts
+                its tokens in ``wasted_tokens``
+            prompt_tokens: Estimated prompt tokens of an attempt, counted as
+                wasted for the loser of a hedged run
+
+        Returns:
+            The winning result and the index of the attempt that produced it
+
+        Raises:
+            Exception: What the first attempt to fail raised, if all failed
+        """
+        started = time.monotonic()
+        tasks: List[asyncio.Task] = [asyncio.ensure_future(attempt(0))]
+        winner: Optional[asyncio.Task] = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay())
+            if not done and self.allow():
+                tasks.append(asyncio.ensure_future(attempt(1)))
+                self.hedges += 1
+                self.wasted_prompt_tokens += prompt_tokens()
+            self._record_run(len(tasks) > 1)
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=tasks.index):
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    if error is None:
+                        error = task.exception()
+                    logger.debug("Attempt %d failed: %r", tasks.index(task), task.exception())
+                if winner is not None:
+                    break
+            if winner is None:
+                raise error
+            if winner is tasks[0]:
+                self.observe(time.monotonic() - started)
+            # else the primary's latency is only known to be longer; recording
+            # the hedge's would pull the delay down towards hedging every run
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    task.cancel()
+                    task.add_done_callback(lambda task: self._discard(task, discard))
+
+        index = tasks.index(winner)
+        if index:
+            self.hedge_wins += 1
+        return winner.result(), index
+
+    def _record_run(self, hedged: bool) -> None:
+        self.runs += 1
+        if len(self._hedged) == self._hedged.maxlen:
+            self._hedged_count -= self._hedged[0]
+        self._hedged.append(hedged)
+        self._hedged_count += hedged
+
+    @staticmethod
+    def _discard(task: asyncio.Task, discard: Callable[[T], Awaitable[None]]) -> None:
+        if task.cancelled() or task.exception() is not None:
+            return
+        released = asyncio.ensure_future(discard(task.result()))
+        _discards.add(released)
+        released.add_done_callback(_discards.discard)
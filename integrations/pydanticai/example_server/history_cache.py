@@ -0,0 +1,152 @@
+"""
+Incremental conversation-history cache for the /chat endpoint.
+
+The Vercel AI SDK resends the whole conversation on every turn. Converting it
+to Pydantic-AI ``ModelMessage`` objects from scratch each time makes a long
+thread cost quadratic work overall, so converted prefixes are cached here and
+each turn only converts the messages appended since the previous request.
+
+Prefixes are identified by a rolling hash over message fingerprints: the
+role, the ``id`` and what an edit changes (the text of every part, the state
+and call id of tool parts, the ``content`` of messages without parts). The id
+alone is not enough, since the AI SDK keeps it when a message is edited in
+place or a tool part changes state. A fingerprint is a tuple of strings the
+message already holds, so checking a thread costs well under a microsecond
+per message, a fraction of converting it. The conversation id, when the
+client sends one, seeds the hash so identical prefixes of different chats do
+not share entries.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+from pydantic_ai.messages import ModelMessage
+
+
+class CachedHistory(NamedTuple):
+    """A converted message prefix and the approximate source size in bytes."""
+    messages: tuple[ModelMessage, ...]
+    size: int
+
+
+def message_token(msg: Dict[str, Any]) -> Hashable:
+    """
+    Fingerprint of a single Vercel message in a prefix hash.
+
+    Tool inputs and outputs are not compared: the AI SDK only sets them
+    together with a new ``state`` of their part.
+    """
+    parts = msg.get("parts")
+    if parts:
+        body = tuple(
+            (part.get("type"), part.get("text"), part.get("state"), part.get("toolCallId"))
+            for part in parts
+        )
+    else:
+        body = msg.get("content")
+    return msg.get("role"), msg.get("id"), body
+
+
+def message_size(msg: Dict[str, Any]) -> int:
+    """Approximate the memory held for a message by its JSON length."""
+    return len(json.dumps(msg, separators=(",", ":")))
+
+
+class HistoryCache:
+    """
+    LRU cache of converted conversation prefixes with entry and byte limits.
+
+    Args:
+        max_entries: Maximum number of cached prefixes
+        max_bytes: Maximum total approximate size of cached prefixes
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[int, int], CachedHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def prefix_keys(
+        messages: Sequence[Dict[str, Any]],
+        conversation_id: Optional[str] = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        Compute rolling prefix keys for ``messages``.
+
+        Returns:
+            A list of ``len(messages) + 1`` keys where ``keys[k]`` identifies
+            ``messages[:k]``: its length and a hash of the message
+            fingerprints, which is only valid within this process
+        """
+        rolling = hash(conversation_id or "")
+        keys = [(0, rolling)]
+        for length, msg in enumerate(messages, 1):
+            rolling = hash((rolling, message_token(msg)))
+            keys.append((length, rolling))
+        return keys
+
+    def longest_prefix(self, keys: Sequence[Tuple[int, int]]) -> tuple[int, Optional[CachedHistory]]:
+        """
+        Find the longest cached prefix among ``keys``.
+
+        Returns:
+            Tuple of (prefix_length, cached_history); (0, None) on a miss.
+        """
+        with self._lock:
+            for length in range(len(keys) - 1, 0, -1):
+                entry = self._entries.get(keys[length])
+                if entry is not None:
+                    self._entries.move_to_end(keys[length])
+                    self.hits += 1
+                    return length, entry
+            self.misses += 1
+        return 0, None
+
+    def put(
+        self,
+        key: Tuple[int, int],
+        entry: CachedHistory,
+        replaces: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        """
+        Store ``entry`` under ``key``, evicting least recently used prefixes.
+
+        Args:
+            key: Prefix key of the converted messages
+            entry: Converted prefix
+            replaces: Key of a shorter prefix this entry extends; it is dropped
+                so a linear conversation only holds one entry at a time
+        """
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if replaces is not None:
+                self._discard(replaces)
+            self._discard(key)
+            self._entries[key] = entry
+            self.total_bytes += entry.size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _discard(self, key: Tuple[int, int]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
@@ -0,0 +1,82 @@
+"""
+Model built on first use.
+
+Importing the Google SDK takes about half of the server's import time, and
+every worker process pays it. ``LazyModel`` stands in for the Gemini model
+when the agent is created and builds it (importing the SDK and creating the
+provider's client) the first time it is used. ``build`` does that in a
+worker thread; ``warm_up`` starts it as soon as a worker is up, so the worker
+accepts connections without waiting for it.
+"""
+
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Callable, Optional
+
+from pydantic_ai.models import Model
+from pydantic_ai.profiles import ModelProfile, ModelProfileSpec
+from pydantic_ai.models.wrapper import WrapperModel
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(init=False, repr=False)
+class LazyModel(WrapperModel):
+    """
+    Wraps the model returned by ``factory``, calling it once on first use.
+
+    Args:
+        factory: Builds the model
+        model_name: Name of the model, available without building it
+        profile: Profile of the model, or a function of its name returning it;
+            ``Agent`` reads it when created, so without it the agent builds the
+            model
+    """
+
+    def __init__(self, factory: Callable[[], Model], model_name: str, profile: Optional[ModelProfileSpec] = None):
+        Model.__init__(self, profile=profile)
+        self._factory = factory
+        self._model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def wrapped(self) -> Model:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._factory()
+        return self._model
+
+    @property
+    def built(self) -> bool:
+        return self._model is not None
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    @cached_property
+    def profile(self) -> ModelProfile:
+        if self._profile is None:
+            return self.wrapped.profile
+        return self._profile(self._model_name) if callable(self._profile) else self._profile
+
+    async def build(self) -> Model:
+        """Build the model in a worker thread, keeping the event loop free."""
+        if self._model is None:
+            await asyncio.to_thread(lambda: self.wrapped)
+        return self._model
+
+    async def warm_up(self) -> None:
+        """Build the model ahead of its first use; a failure is retried then."""
+        try:
+            await self.build()
+        except Exception:
+            logger.exception("Building the model failed")
+
+    def __repr__(self) -> str:
+        return f"LazyModel({self._model_name!r}, built={self.built})"
@@ -0,0 +1,148 @@
+"""
+Logging pipeline that keeps console I/O off the request path.
+
+``configure_logging`` attaches a ``QueueHandler`` to the ``example_server``
+logger: a call that passes the level check only appends the record to an
+in-memory queue, and a ``QueueListener`` thread formats and writes it. The
+message is rendered from its arguments before the record is queued, since
+they may be mutated once the call returns; the timestamp, JSON encoding and
+traceback are left to the listener thread.
+
+Per-token events use ``token_sampler`` to log one in every N occurrences, and
+``LazyJson`` defers ``json.dumps`` of payloads until a record passes the
+level check. Callers are expected to gate hot-path logging on
+``logger.isEnabledFor`` so a disabled level costs no record at all.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from typing import Any, Optional
+
+PACKAGE_LOGGER = "example_server"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class LazyJson:
+    """Renders ``value`` as JSON only when the log message is rendered."""
+
+    __slots__ = ("value", "indent")
+
+    def __init__(self, value: Any, indent: Optional[int] = None):
+        self.value = value
+        self.indent = indent
+
+    def __str__(self) -> str:
+        if isinstance(self.value, str):
+            return self.value
+        try:
+            return json.dumps(self.value, indent=self.indent, default=str)
+        except (TypeError, ValueError):
+            return repr(self.value)
+
+
+class Sampler:
+    """
+    Pass one in every ``every`` calls (the first call always passes).
+
+    Args:
+        every: Sampling period; 1 passes every call, 0 passes none
+    """
+
+    __slots__ = ("every", "_count")
+
+    def __init__(self, every: int):
+        self.every = every
+        self._count = 0
+
+    def __call__(self) -> bool:
+        if self.every <= 0:
+            return False
+        self._count += 1
+        return self._count % self.every == 1 or self.every == 1
+
+
+# Shared by per-token debug events; its period is set by ``configure_logging``
+token_sampler = Sampler(100)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with time, level, logger and message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue records with their message rendered; the listener thread formats them."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging(
+    level: str = "INFO",
+    json_format: bool = False,
+    token_sample_every: int = 100,
+) -> None:
+    """
+    Route the package's logs through a background listener thread.
+
+    Calling it again replaces the previous pipeline.
+
+    Args:
+        level: Minimum level logged by the package
+        json_format: Write one JSON object per line instead of plain text
+        token_sample_every: Log one in every this many per-token events
+            (0 disables them)
+    """
+    global _listener
+
+    token_sampler.every = token_sample_every
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        JsonFormatter()
+        if json_format
+        else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+
+    if _listener is not None:
+        _listener.stop()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+    logger = logging.getLogger(PACKAGE_LOGGER)
+    for handler in list(logger.handlers):
+        if isinstance(handler, _DeferredQueueHandler):
+            logger.removeHandler(handler)
+    logger.addHandler(_DeferredQueueHandler(log_queue))
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+
+def shutdown_logging() -> None:
+    """Stop the listener thread after it has written every queued record."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,251 @@
+"""
+Resumable streams backed by bounded per-run replay buffers.
+
+A resumable run is driven by its own task, independent of the HTTP
+connection that started it, and every encoded frame is appended to a ring
+buffer under an increasing SSE event id. Clients receive frames with an
+``id:`` line; if the connection drops, repeating the request with a
+``Last-Event-ID`` header resubscribes to the same run and continues after
+that id instead of starting a new run.
+
+A run that loses all subscribers is cancelled after a short grace period, so
+an abandoned tab still stops the model while a client that reconnects
+quickly picks up the run where it left off. A run that was cancelled or
+failed is marked incomplete: its subscribers get an error after the last
+buffered frame instead of a normal end of stream, so a truncated answer is
+never passed off as a whole one. Finished runs are kept for a TTL so late
+reconnects can replay them, and the registry evicts finished runs oldest
+first when its total memory cap is exceeded.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import AsyncIterator, Deque, Optional, Tuple, Union
+
+from .admission import Lease
+from .disconnect import DisconnectStats, StreamMeter
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayGapError(Exception):
+    """The requested event id has already been evicted from the buffer."""
+
+
+class RunIncompleteError(Exception):
+    """The run was cancelled or failed before it finished."""
+
+
+class RunBuffer:
+    """
+    Ring buffer of the encoded frames of one run.
+
+    Args:
+        key: Registry key of the run
+        max_frames: Maximum number of frames kept
+        max_bytes: Maximum total size of frames kept
+        grace: Seconds a run may go without subscribers before it is cancelled
+    """
+
+    def __init__(self, key: str, max_frames: int, max_bytes: int, grace: float):
+        self.key = key
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.frames: Deque[Tuple[int, bytes]] = deque()
+        self.size = 0
+        self.next_id = 0
+        self.done = False
+        self.completed = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._grace_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def first_id(self) -> int:
+        return self.frames[0][0] if self.frames else self.next_id
+
+    def append(self, frame: bytes) -> None:
+        self.frames.append((self.next_id, frame))
+        self.next_id += 1
+        self.size += len(frame)
+        while self.frames and (len(self.frames) > self.max_frames or self.size > self.max_bytes):
+            _, dropped = self.frames.popleft()
+            self.size -= len(dropped)
+        self._notify()
+
+    def finish(self, completed: bool = True) -> None:
+        self.done = True
+        self.completed = completed
+        self.finished_at = time.monotonic()
+        self._cancel_grace_timer()
+        self._notify()
+
+    def can_resume(self, last_event_id: int) -> bool:
+        """Whether every frame after ``last_event_id`` is still buffered."""
+        return last_event_id + 1 >= self.first_id
+
+    async def follow(self, last_event_id: int = -1) -> AsyncIterator[bytes]:
+        """
+        Yield the frames after ``last_event_id`` with SSE ``id:`` lines,
+        waiting for new frames until the run finishes.
+
+        Raises:
+            ReplayGapError: If frames after ``last_event_id`` were evicted
+            RunIncompleteError: After the last frame of a run that was
+                cancelled or failed
+        """
+        self.subscribers += 1
+        self._cancel_grace_timer()
+        try:
+            next_id = last_event_id + 1
+            while True:
+                if next_id < self.first_id:
+                    raise ReplayGapError(f"event {next_id} of run {self.key} is no longer buffered")
+                changed = self._changed
+                pending = list(islice(self.frames, next_id - self.first_id, None))
+                for event_id, frame in pending:
+                    yield b"id: %d\n" % event_id + frame
+                    next_id = event_id + 1
+                if self.done and next_id >= self.next_id:
+                    if not self.completed:
+                        raise RunIncompleteError(f"run {self.key} ended before it finished")
+                    return
+                if not pending:
+                    await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self._grace_timer = asyncio.get_running_loop().call_later(
+                    self.grace, self._cancel_if_abandoned
+                )
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _cancel_grace_timer(self) -> None:
+        if self._grace_timer is not None:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+
+    def _cancel_if_abandoned(self) -> None:
+        self._grace_timer = None
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            logger.info("Cancelling run %s: no subscribers for %.0fs", self.key, self.grace)
+            self.task.cancel()
+
+
+class ReplayRegistry:
+    """
+    Registry of resumable runs.
+
+    Args:
+        max_frames_per_run: Ring buffer length of each run
+        max_bytes_per_run: Ring buffer byte cap of each run
+        max_total_bytes: Cap on the bytes held by all runs; finished runs are
+            evicted oldest first to stay under it
+        ttl: Seconds a finished run stays available for reconnects
+        grace: Seconds a running run may go without subscribers
+        stats: Counters for completed/cancelled runs
+    """
+
+    def __init__(
+        self,
+        max_frames_per_run: int = 4096,
+        max_bytes_per_run: int = 4 * 1024 * 1024,
+        max_total_bytes: int = 256 * 1024 * 1024,
+        ttl: float = 300.0,
+        grace: float = 5.0,
+        stats: Optional[DisconnectStats] = None,
+    ):
+        self.max_frames_per_run = max_frames_per_run
+        self.max_bytes_per_run = max_bytes_per_run
+        self.max_total_bytes = max_total_bytes
+        self.ttl = ttl
+        self.grace = grace
+        self.stats = stats
+        self._runs: "OrderedDict[str, RunBuffer]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(run.size for run in self._runs.values())
+
+    def get(self, key: str) -> Optional[RunBuffer]:
+        self.evict()
+        return self._runs.get(key)
+
+    def start(
+        self,
+        key: str,
+        source: AsyncIterator[Union[str, bytes]],
+        meter: Optional[StreamMeter] = None,
+        lease: Optional[Lease] = None,
+    ) -> RunBuffer:
+        """
+        Start driving ``source`` into a new buffer registered under ``key``.
+
+        A run already registered under ``key`` is replaced; its subscribers
+        keep following it. ``lease`` (the run's admission permit or
+        single-flight subscription) is released when the run ends, even if
+        it is cancelled before it starts.
+        """
+        self.evict()
+        run = RunBuffer(key, self.max_frames_per_run, self.max_bytes_per_run, self.grace)
+        run.task = asyncio.ensure_future(self._drive(run, source, meter))
+        if lease is not None:
+            run.task.add_done_callback(lambda _: lease.release())
+        self._runs.pop(key, None)
+        self._runs[key] = run
+        return run
+
+    def evict(self) -> None:
+        """Drop expired finished runs, then finished runs over the memory cap."""
+        now = time.monotonic()
+        for key, run in list(self._runs.items()):
+            if run.done and now - run.finished_at > self.ttl:
+                del self._runs[key]
+        total = self.total_bytes
+        for key, run in list(self._runs.items()):
+            if total <= self.max_total_bytes:
+                break
+            if run.done:
+                total -= run.size
+                del self._runs[key]
+
+    async def _drive(self, run: RunBuffer, source, meter: Optional[StreamMeter]) -> None:
+        outcome = "cancelled"
+        try:
+            async for frame in source:
+                run.append(frame.encode() if isinstance(frame, str) else frame)
+            outcome = "completed"
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            outcome = "failed"
+            logger.exception("Resumable run %s failed", run.key)
+        finally:
+            run.finish(completed=outcome == "completed")
+            if self.stats is not None:
+                if outcome == "completed":
+                    self.stats.record_completed(meter)
+                else:
+                    self.stats.record_cancelled(meter)
+            if meter is not None:
+                meter.finish(outcome)
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """Parse a ``Last-Event-ID`` header; -1 (replay everything) if absent or invalid."""
+    try:
+        return int(value) if value is not None else -1
+    except ValueError:
+        return -1
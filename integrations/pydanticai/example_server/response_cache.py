@@ -0,0 +1,275 @@
+"""
+Opt-in response cache for deterministic agent runs.
+
+Exact repeats of a request (same normalized messages, tools, model and
+system prompt) replay the SSE frames recorded for the first run instead of
+calling the model again. Frames are stored as one blob per key in a
+pluggable store: ``MemoryResponseStore`` (per process) or
+``SqliteResponseStore`` (a local file shared by every worker on the host).
+Both evict by TTL, LRU and total size.
+
+Per-run identifiers that end up inside recorded frames (such as a message
+id) are swapped for placeholders when storing and for the new run's values
+when replaying.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(**parts: Any) -> str:
+    """Hash the canonical JSON of ``parts`` into a cache key."""
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=_jsonable)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _jsonable(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return str(value)
+
+
+class _Entry(NamedTuple):
+    blob: bytes
+    expires: float
+
+
+class ResponseStore:
+    """
+    Interface of a response store.
+
+    ``blocking`` stores are called from a worker thread.
+    """
+
+    blocking = False
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def put(self, key: str, blob: bytes) -> None:
+        raise NotImplementedError
+
+
+class MemoryResponseStore(ResponseStore):
+    """
+    In-process LRU store.
+
+    Args:
+        ttl: Seconds an entry stays valid
+        max_entries: Maximum number of entries
+        max_bytes: Maximum total size of entries
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.time():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry.blob
+
+    def put(self, key: str, blob: bytes) -> None:
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = _Entry(blob, time.time() + self.ttl)
+            self.total_bytes += len(blob)
+            while self._entries and (
+                len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted.blob)
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= len(entry.blob)
+
+
+class SqliteResponseStore(ResponseStore):
+    """
+    Local on-disk store backed by sqlite.
+
+    Args:
+        path: Database file
+        ttl: Seconds an entry stays valid
+        max_entries: Maximum number of entries
+        max_bytes: Maximum total size of entries
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 3600.0,
+        max_entries: int = 10000,
+        max_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, blob BLOB NOT NULL, size INTEGER NOT NULL,"
+            " expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT blob, expires FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, blob: bytes) -> None:
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, blob, size, expires, accessed)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, blob, len(blob), now + self.ttl, now),
+                )
+                self._db.execute("DELETE FROM responses WHERE expires < ?", (now,))
+                count, total = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+                if count > self.max_entries or total > self.max_bytes:
+                    self._evict_lru(count, total)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _evict_lru(self, count: int, total: int) -> None:
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        doomed = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+
+class ResponseCache:
+    """
+    Records and replays SSE frame sequences.
+
+    Args:
+        store: Backing store
+    """
+
+    def __init__(self, store: ResponseStore):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def lookup(self, key: str, substitutions: Optional[Dict[str, str]] = None) -> Optional[bytes]:
+        """
+        Return the recorded frames for ``key`` with placeholders replaced.
+
+        Args:
+            key: Cache key
+            substitutions: Placeholder -> value of the current run
+        """
+        if self.store.blocking:
+            blob = await asyncio.to_thread(self.store.get, key)
+        else:
+            blob = self.store.get(key)
+        if blob is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        for placeholder, value in (substitutions or {}).items():
+            blob = blob.replace(placeholder.encode(), value.encode())
+        return blob
+
+    async def record(
+        self,
+        key: str,
+        frames: AsyncIterator[Union[str, bytes]],
+        substitutions: Optional[Dict[str, str]] = None,
+    ) -> AsyncIterator[Union[str, bytes]]:
+        """
+        Pass ``frames`` through and store them once the stream completes.
+
+        Nothing is stored if the stream raises or is cancelled.
+
+        Args:
+            key: Cache key
+            frames: Frames of the run being recorded
+            substitutions: Placeholder -> value of the current run; values are
+                replaced by their placeholders before storing
+        """
+        recorded: List[bytes] = []
+        async for frame in frames:
+            recorded.append(frame.encode() if isinstance(frame, str) else frame)
+            yield frame
+
+        blob = b"".join(recorded)
+        for placeholder, value in (substitutions or {}).items():
+            blob = blob.replace(value.encode(), placeholder.encode())
+        try:
+            if self.store.blocking:
+                await asyncio.to_thread(self.store.put, key, blob)
+            else:
+                self.store.put(key, blob)
+            self.stores += 1
+        except Exception:
+            logger.exception("Failed to store cached response")
+
+
+def create_response_cache(
+    backend: str,
+    path: str,
+    ttl: float,
+    max_entries: int,
+    max_bytes: int,
+) -> ResponseCache:
+    """Build a ``ResponseCache`` for the configured backend ("memory" or "sqlite")."""
+    if backend == "memory":
+        store: ResponseStore = MemoryResponseStore(ttl, max_entries, max_bytes)
+    elif backend == "sqlite":
+        store = SqliteResponseStore(path, ttl, max_entries, max_bytes)
+    else:
+        raise ValueError(f"Unknown response cache backend {backend!r}, expected 'memory' or 'sqlite'")
+    return ResponseCache(store)
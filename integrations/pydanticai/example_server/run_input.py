@@ -0,0 +1,263 @@
+"""
+Fast decoding of AG-UI ``RunAgentInput`` request bodies.
+
+AG-UI clients resend the whole thread with every run, so a long thread means
+parsing and validating megabytes of history that the previous run of the same
+``thread_id`` already validated.
+
+``decode_run_input`` validates a body straight from its raw bytes in one pass
+(pydantic-core's JSON parser, no intermediate ``json.loads``). With a
+``ThreadPrefixCache`` it instead parses the body with ``orjson`` (when
+installed) and compares the ``messages`` array with the raw messages of the
+thread's previous run; the common prefix is reused as already validated
+``Message`` objects and only the new messages are validated.
+
+Values derived from messages (such as the upstream message dicts) can be
+cached alongside with ``ThreadPrefixCache.derive``; the values of a reused
+prefix carry over to the thread's next run together with its messages.
+
+With a ``ThreadStore``, ``decode_thread_run_input`` accepts bodies carrying
+only a thread's new messages and merges them onto the stored history.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional fast backend
+    orjson = None
+
+from ag_ui.core import RunAgentInput
+from pydantic import ValidationError
+
+from . import metrics
+from .metrics import Timer
+from .thread_store import ThreadStore, ThreadWrite
+
+T = TypeVar("T")
+
+_parse_seconds = metrics.stage_seconds.labels("parse")
+_validate_seconds = metrics.stage_seconds.labels("validate")
+
+
+def loads(body: bytes) -> Any:
+    """Parse JSON with ``orjson`` if installed; errors are ``json.JSONDecodeError``."""
+    if orjson is not None:
+        return orjson.loads(body)
+    try:
+        return json.loads(body)
+    except UnicodeDecodeError as error:
+        raise json.JSONDecodeError("Invalid UTF-8", body.decode("latin-1"), error.start) from None
+
+
+class CachedThread:
+    """Messages of a thread's latest run, raw and validated."""
+
+    __slots__ = ("raw", "messages", "derived", "size")
+
+    def __init__(self, raw: List[Any], messages: List[Any], size: int, derived: Optional[List[Any]] = None):
+        self.raw = raw
+        self.messages = messages
+        self.derived: List[Any] = derived or []
+        self.size = size
+
+
+class ThreadPrefixCache:
+    """
+    LRU cache of the latest validated messages per thread id.
+
+    Args:
+        max_threads: Maximum number of cached threads
+        max_bytes: Maximum total size of cached threads, approximated by the
+            request body sizes
+    """
+
+    def __init__(self, max_threads: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_messages = 0
+        self._entries: "OrderedDict[str, CachedThread]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, thread_id: str) -> Optional[CachedThread]:
+        with self._lock:
+            entry = self._entries.get(thread_id)
+            if entry is not None:
+                self._entries.move_to_end(thread_id)
+            return entry
+
+    def put(self, thread_id: str, entry: CachedThread) -> None:
+        """Store ``entry`` as the thread's latest run, evicting least recently used threads."""
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(thread_id, None)
+            if previous is not None:
+                self.total_bytes -= previous.size
+            self._entries[thread_id] = entry
+            self.total_bytes += entry.size
+            while self._entries and (
+                len(self._entries) > self.max_threads or self.total_bytes > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+
+    def derive(self, thread_id: str, messages: List[Any], function: Callable[[Any], T]) -> List[T]:
+        """
+        Return ``[function(message) for message in messages]``, reusing the
+        results computed for the thread's earlier runs.
+
+        Only applies to the ``messages`` list ``decode_run_input`` returned
+        for the thread's latest run; any other list is mapped in full.
+        """
+        entry = self.get(thread_id)
+        if entry is None or entry.messages is not messages:
+            return [function(message) for message in messages]
+        entry.derived.extend(function(message) for message in messages[len(entry.derived):])
+        return list(entry.derived)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+def decode_run_input(body: bytes, cache: Optional[ThreadPrefixCache] = None) -> RunAgentInput:
+    """
+    Parse and validate a ``RunAgentInput`` body, timing each stage.
+
+    Args:
+        body: Raw request body
+        cache: Thread cache to reuse validated history from, or None to
+            validate the whole body in one pass
+
+    Raises:
+        json.JSONDecodeError: The body is not valid JSON
+        ValidationError: The body is not a valid ``RunAgentInput``
+    """
+    if cache is None:
+        try:
+            # One pass; parsing is part of the validate stage here
+            with Timer(_validate_seconds):
+                return RunAgentInput.model_validate_json(body)
+        except ValidationError as error:
+            if any(detail["type"] == "json_invalid" for detail in error.errors()):
+                loads(body)  # raises with the position of the error
+            raise
+
+    with Timer(_parse_seconds):
+        payload = loads(body)
+    return validate_run_input(payload, len(body), cache)
+
+
+def validate_run_input(
+    payload: Any,
+    size: int,
+    cache: Optional[ThreadPrefixCache] = None,
+    history: Optional[List[Any]] = None,
+) -> RunAgentInput:
+    """
+    Validate a parsed ``RunAgentInput`` body.
+
+    Args:
+        payload: Parsed request body
+        size: Size of the thread in bytes, for the cache's budget
+        cache: Thread cache to reuse validated history from
+        history: Raw messages to put before the body's messages
+
+    Raises:
+        ValidationError: The body is not a valid ``RunAgentInput``
+    """
+    messages = payload.get("messages") if isinstance(payload, dict) else None
+    if history is not None and isinstance(messages, list):
+        messages = history + messages
+        payload = {**payload, "messages": messages}
+    thread_id = payload.get("threadId") if isinstance(payload, dict) else None
+    if cache is None or not isinstance(messages, list) or not isinstance(thread_id, str):
+        with Timer(_validate_seconds):
+            return RunAgentInput.model_validate(payload)
+
+    entry = cache.get(thread_id)
+    reused = 0
+    if entry is not None:
+        for cached, message in zip(entry.raw, messages):
+            # History merged from a thread store is the very same objects
+            if cached is not message and cached != message:
+                break
+            reused += 1
+
+    with Timer(_validate_seconds):
+        if not reused:
+            cache.misses += 1
+            run_input = RunAgentInput.model_validate(payload)
+        else:
+            cache.hits += 1
+            cache.reused_messages += reused
+            try:
+                run_input = RunAgentInput.model_validate({**payload, "messages": messages[reused:]})
+            except ValidationError:
+                # Validate everything so error locations index the full list
+                return RunAgentInput.model_validate(payload)
+            run_input = run_input.model_copy(
+                update={"messages": entry.messages[:reused] + run_input.messages}
+            )
+
+    # Values derived from the reused messages stay valid for the same objects
+    derived = entry.derived[:reused] if reused else None
+    cache.put(thread_id, CachedThread(messages, run_input.messages, size, derived))
+    return run_input
+
+
+async def decode_thread_run_input(
+    body: bytes,
+    store: ThreadStore,
+    version: Optional[str],
+    cache: Optional[ThreadPrefixCache] = None,
+) -> Tuple[RunAgentInput, Optional[ThreadWrite]]:
+    """
+    Decode a body against its thread's stored history.
+
+    Nothing is stored yet: commit the returned write once the run completed.
+
+    Args:
+        body: Raw request body
+        store: Thread store
+        version: History version the body's messages follow, or None if the
+            body carries the full history
+        cache: Thread cache to reuse validated history from
+
+    Returns:
+        The run input with the merged history and the pending write of the
+        body's messages
+
+    Raises:
+        json.JSONDecodeError: The body is not valid JSON
+        ValidationError: The merged body is not a valid ``RunAgentInput``
+        ThreadVersionConflict: ``version`` is not the stored version
+    """
+    with Timer(_parse_seconds):
+        payload = loads(body)
+    thread_id = messages = None
+    if isinstance(payload, dict):
+        thread_id = payload.get("threadId", payload.get("thread_id"))
+        messages = payload.get("messages")
+    if not isinstance(thread_id, str) or not isinstance(messages, list):
+        # Not a valid RunAgentInput; raises with the usual errors
+        return validate_run_input(payload, len(body)), None
+
+    key = f"agui:{thread_id}"
+    if version is None:
+        run_input = validate_run_input(payload, len(body), cache)
+        return run_input, store.write(key, messages)
+    stored = await store.load(key, version)
+    run_input = validate_run_input(payload, len(body) + stored.size, cache, stored.messages)
+    return run_input, store.write(key, messages, stored)
@@ -0,0 +1,254 @@
+"""
+Tool hosting for the pydantic-ai agent.
+
+pydantic-ai already runs the tool calls of one model turn as concurrent
+tasks and emits each ``FunctionToolResultEvent`` as soon as its task
+finishes, so ``tool-output-available`` frames stream in completion order.
+What it does not do is bound or isolate the work: sync tools go to the
+default executor and nothing ever times out.
+
+``ToolHost`` wraps each tool in a coroutine that runs it where it belongs:
+
+- ``"inline"``: on the event loop (async tools, or trivial sync ones)
+- ``"thread"``: in a bounded thread pool (blocking I/O)
+- ``"process"``: in a bounded process pool (CPU-bound work; the function and
+  its arguments must be picklable)
+
+Every call is subject to a per-tool timeout. A call that times out is
+reported to the model with ``ModelRetry`` so it can answer without the tool;
+a thread that is still running is left to finish in the background.
+
+Tools declared ``pure`` (same arguments, same result) can be memoized in a
+``ToolResultCache``: a repeated call returns the stored result without
+touching an executor. Only results computed by this process are stored;
+tool results sent back by clients in the conversation history are never
+trusted as cache entries.
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic_ai import Agent, ModelRetry
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ("inline", "thread", "process")
+
+tool_timeouts = metrics.registry.counter(
+    "tool_timeouts_total",
+    "Tool calls that exceeded their timeout",
+    ("tool",),
+)
+tool_cache_hits = metrics.registry.counter(
+    "tool_cache_hits_total",
+    "Pure tool calls answered from the result cache",
+    ("tool",),
+)
+tool_cache_misses = metrics.registry.counter(
+    "tool_cache_misses_total",
+    "Pure tool calls that had to run",
+    ("tool",),
+)
+
+_MISSING = object()
+
+
+class ToolResultCache:
+    """
+    LRU cache of pure tool results with a per-entry TTL.
+
+    Args:
+        max_entries: Maximum number of cached results
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(tool_name: str, arguments: Dict[str, Any]) -> str:
+        """Hash of the tool name and its arguments in canonical JSON form."""
+        canonical = json.dumps(
+            [tool_name, arguments],
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> Any:
+        """Return the cached result, or ``_MISSING`` if absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires, result = entry
+            if expires and expires < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, key: str, result: Any, ttl: float = 0.0) -> None:
+        """Store ``result`` for ``ttl`` seconds (0 keeps it until evicted)."""
+        expires = time.monotonic() + ttl if ttl else 0.0
+        with self._lock:
+            self._entries[key] = (expires, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class ToolHost:
+    """
+    Runs agent tools on bounded executors with timeouts.
+
+    Args:
+        thread_workers: Size of the thread pool for ``"thread"`` tools
+        process_workers: Size of the process pool for ``"process"`` tools
+            (0 means one per CPU core)
+        default_executor: Executor of sync tools registered without one
+        default_timeout: Seconds a tool call may take (0 disables)
+        result_cache: Cache for results of pure tools, or None to always run
+            them
+    """
+
+    def __init__(
+        self,
+        thread_workers: int = 8,
+        process_workers: int = 0,
+        default_executor: str = "thread",
+        default_timeout: float = 30.0,
+        result_cache: Optional[ToolResultCache] = None,
+    ):
+        if default_executor not in EXECUTORS:
+            raise ValueError(f"Unknown tool executor {default_executor!r}, expected one of {EXECUTORS}")
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.default_executor = default_executor
+        self.default_timeout = default_timeout
+        self.result_cache = result_cache
+        self.tools: List[Callable[..., Any]] = []
+        self._pools: Dict[str, Executor] = {}
+
+    def tool(
+        self,
+        function: Optional[Callable[..., Any]] = None,
+        *,
+        executor: Optional[str] = None,
+        timeout: Optional[float] = None,
+        pure: bool = False,
+        ttl: float = 0.0,
+    ):
+        """
+        Decorator adding a plain tool (one without ``RunContext``).
+
+        The function itself is returned unchanged, so it stays picklable for
+        the process pool and directly callable. The hosted wrapper keeps its
+        signature and docstring, which pydantic-ai uses for the tool schema.
+
+        Args:
+            function: The tool function
+            executor: ``"inline"``, ``"thread"`` or ``"process"``; defaults
+                to inline for async tools and ``default_executor`` otherwise
+            timeout: Seconds a call may take, overriding ``default_timeout``
+            pure: The result depends only on the arguments, so it may be
+                memoized in the host's result cache
+            ttl: Seconds a memoized result stays valid (0 until evicted)
+        """
+        if function is None:
+            return functools.partial(
+                self.tool, executor=executor, timeout=timeout, pure=pure, ttl=ttl
+            )
+
+        is_async = inspect.iscoroutinefunction(function)
+        if executor is None:
+            executor = "inline" if is_async else self.default_executor
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown tool executor {executor!r}, expected one of {EXECUTORS}")
+        if is_async and executor != "inline":
+            raise ValueError(f"Async tool {function.__name__} can only run inline")
+        limit = self.default_timeout if timeout is None else timeout
+        name = function.__name__
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        async def hosted(*args, **kwargs):
+            cache = self.result_cache if pure else None
+            if cache is None:
+                return await run(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = cache.key(name, bound.arguments)
+            result = cache.get(key)
+            if result is not _MISSING:
+                tool_cache_hits.labels(name).inc()
+                return result
+            tool_cache_misses.labels(name).inc()
+            result = await run(*args, **kwargs)
+            cache.put(key, result, ttl)
+            return result
+
+        async def run(*args, **kwargs):
+            if is_async:
+                call = function(*args, **kwargs)
+            elif executor == "inline":
+                # Cannot be interrupted; inline sync tools are expected to be instant
+                return function(*args, **kwargs)
+            else:
+                loop = asyncio.get_running_loop()
+                call = loop.run_in_executor(
+                    self._pool(executor), functools.partial(function, *args, **kwargs)
+                )
+            try:
+                return await asyncio.wait_for(call, limit or None)
+            except asyncio.TimeoutError:
+                tool_timeouts.labels(name).inc()
+                logger.warning("Tool %s timed out after %.1fs", name, limit)
+                raise ModelRetry(f"Tool {name} timed out after {limit:g}s")
+
+        self.tools.append(hosted)
+        return function
+
+    def register(self, agent: Agent) -> None:
+        """Register every hosted tool as a plain tool of ``agent``."""
+        for hosted in self.tools:
+            agent.tool_plain(hosted)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Shut down the pools; running calls finish first when ``wait`` is set."""
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait, cancel_futures=True)
+        self._pools.clear()
+
+    def _pool(self, executor: str) -> Executor:
+        # Created on first use so a server without process tools never forks
+        pool = self._pools.get(executor)
+        if pool is None:
+            if executor == "thread":
+                pool = ThreadPoolExecutor(self.thread_workers, thread_name_prefix="tool")
+            else:
+                pool = ProcessPoolExecutor(self.process_workers or None)
+            self._pools[executor] = pool
+        return pool
@@ -23,10 +23,12 @@ Run with: fastapi run main.py or fastapi dev main.py
 
 import json
 import logging
+import time
 from typing import Any, Dict, List, Optional
 
 # Pydantic for data validation and models
 from pydantic import BaseModel
+from pydantic_ai import Agent
 from pydantic_ai.messages import (
     ModelMessage,
     ModelRequest,
@@ -40,10 +42,19 @@ from pydantic_ai.messages import (
 
 # Pydantic-AI streaming events
 from pydantic_ai.messages import (
+    FunctionToolCallEvent,
+    FunctionToolResultEvent,
     PartDeltaEvent,
     PartStartEvent,
 )
 
+from .data_stream import DataStreamEncoder, DeltaCoalescer, default_encoder
+from .disconnect import StreamMeter
+from .flush_deadline import iter_with_flush_deadline
+from .metrics import tool_seconds
+from .history_cache import CachedHistory, HistoryCache, message_size
+from .logs import LazyJson, token_sampler
+
 logger = logging.getLogger(__name__)
 
 
@@ -66,17 +77,111 @@ class ChatMessageRequest(BaseModel):
     - parts: Array of message parts (v5 format)
       - type: 'text' for text content, 'tool-call' for tool calls
       - text: The actual text content (for text parts)
+    - id: Chat id (optional), used to scope the history cache
     """
     messages: List[Dict[str, Any]]
+    id: Optional[str] = None
 
 
 # =============================================================================
 # 3. VERCEL AI SDK COMPATIBILITY LAYER
 # =============================================================================
 
+def _text_from_message(msg: Dict[str, Any]) -> Optional[str]:
+    """Join the text parts of a v5 message, falling back to ``content``."""
+    parts = msg.get("parts", [])
+    if parts:
+        return " ".join(p.get("text", "") for p in parts if p.get("type") == "text")
+    if "content" in msg:
+        return msg["content"]
+    return None
+
+
+def convert_vercel_message(msg: Dict[str, Any]) -> List[ModelMessage]:
+    """
+    Convert a single prior Vercel AI SDK message to Pydantic-AI messages.
+
+    A user message becomes one ``ModelRequest``; an assistant message becomes
+    a ``ModelResponse`` followed by a ``ModelRequest`` per tool call whose
+    result is present in the same message.
+
+    Args:
+        msg: Vercel AI SDK message object
+
+    Returns:
+        List of converted messages (empty if nothing to convert)
+    """
+    role = msg.get("role")
+
+    if role == "user":
+        # Convert user message to ModelRequest with UserPromptPart
+        text_content = _text_from_message(msg) or ""
+        return [ModelRequest(parts=[UserPromptPart(content=text_content)])]
+
+    if role != "assistant":
+        return []
+
+    # Convert assistant message to ModelResponse
+    converted: List[ModelMessage] = []
+    parts = []
+    msg_parts = msg.get("parts", [])
+
+    # Handle text parts
+    if msg_parts:
+        text_parts = [
+            p.get("text", "") for p in msg_parts if p.get("type") == "text"
+        ]
+        if text_parts:
+            parts.append(TextPart(content=" ".join(text_parts)))
+    elif "content" in msg:
+        parts.append(TextPart(content=msg["content"]))
+
+    # Handle tool calls and index tool results (v5 format) in a single pass
+    tool_calls = []
+    tool_results = {}
+    for part in msg_parts or []:
+        part_type = part.get("type")
+        if part_type == "tool-call":
+            tool_calls.append(
+                ToolCallPart(
+                    tool_name=part.get("toolName", ""),
+                    args=part.get("input", {}),  # v5 uses 'input'
+                    tool_call_id=part.get("toolCallId", ""),
+                )
+            )
+        elif part_type == "tool-result":
+            # First result wins, matching the previous linear scan
+            tool_results.setdefault(part.get("toolCallId"), part.get("output"))  # v5 uses 'output'
+
+    parts.extend(tool_calls)
+
+    if parts:
+        converted.append(ModelResponse(parts=parts))
+
+        # Add tool return messages for completed tool calls
+        for tool_call in tool_calls:
+            result = tool_results.get(tool_call.tool_call_id)
+            if result is not None:
+                converted.append(
+                    ModelRequest(
+                        parts=[
+                            ToolReturnPart(
+                                tool_name=tool_call.tool_name,
+                                content=result,
+                                tool_call_id=tool_call.tool_call_id,
+                            )
+                        ]
+                    )
+                )
+
+    return converted
+
+
 def convert_vercel_messages_to_pydantic(
     messages: List[Dict[str, Any]],
-    system_prompt_content: Optional[str] = None
+    system_prompt_content: Optional[str] = None,
+    cache: Optional[HistoryCache] = None,
+    conversation_id: Optional[str] = None,
 ) -> tuple[str, List[ModelMessage]]:
     """
     Convert Vercel AI SDK message format to Pydantic-AI format.
@@ -99,14 +204,19 @@ def convert_vercel_messages_to_pydantic(
     - Adding system prompt to the history
     - Handling tool calls and responses
 
+    When a ``cache`` is given, the longest previously converted prefix of the
+    history is reused and only the messages appended since are converted.
+
     Args:
         messages: List of Vercel AI SDK message objects
         system_prompt_content: System prompt to include in history
+        cache: Optional conversation-history cache
+        conversation_id: Chat id sent by the client, used to scope cache keys
 
     Returns:
         Tuple of (latest_user_message, message_history)
     """
-    logger.info(f"Converting {len(messages) if messages else 0} messages")
+    logger.debug("Converting %d messages", len(messages) if messages else 0)
 
     if not messages:
         return "", []
@@ -115,16 +225,7 @@ def convert_vercel_messages_to_pydantic(
     latest_user_message = ""
     for msg in reversed(messages):
         if msg.get("role") == "user":
-            parts = msg.get("parts", [])
-            if parts:
-                # v5 format: extract text from parts
-                text_parts = [
-                    p.get("text", "") for p in parts if p.get("type") == "text"
-                ]
-                latest_user_message = " ".join(text_parts)
-            elif "content" in msg:
-                # Fallback to direct content field
-                latest_user_message = msg["content"]
+            latest_user_message = _text_from_message(msg) or ""
             break
 
     # Convert all previous messages (excluding the latest) to ModelMessage format
@@ -138,89 +239,40 @@ def convert_vercel_messages_to_pydantic(
         message_history.append(system_message)
 
     # Process all messages except the last one (which becomes the prompt)
-    messages_except_last = messages[:-1] if messages else []
-
-    for msg in messages_except_last:
-        role = msg.get("role")
-
-        if role == "user":
-            # Convert user message to ModelRequest with UserPromptPart
-            parts = msg.get("parts", [])
-            text_content = ""
-            if parts:
-                text_parts = [
-                    p.get("text", "") for p in parts if p.get("type") == "text"
-                ]
-                text_content = " ".join(text_parts)
-            elif "content" in msg:
-                text_content = msg["content"]
-
-            user_message = ModelRequest(parts=[UserPromptPart(content=text_content)])
-            message_history.append(user_message)
-
-        elif role == "assistant":
-            # Convert assistant message to ModelResponse
-            parts = []
-            msg_parts = msg.get("parts", [])
-
-            # Handle text parts
-            if msg_parts:
-                text_parts = [
-                    p.get("text", "") for p in msg_parts if p.get("type") == "text"
-                ]
-                if text_parts:
-                    parts.append(TextPart(content=" ".join(text_parts)))
-            elif "content" in msg:
-                parts.append(TextPart(content=msg["content"]))
-
-            # Handle tool calls (v5 format)
-            tool_calls = []
-            if msg_parts:
-                for part in msg_parts:
-                    if part.get("type") == "tool-call":
-                        tool_calls.append(
-                            ToolCallPart(
-                                tool_name=part.get("toolName", ""),
-                                args=part.get("input", {}),  # v5 uses 'input'
-                                tool_call_id=part.get("toolCallId", ""),
-                            )
-                        )
-
-            parts.extend(tool_calls)
-
-            if parts:
-                assistant_message = ModelResponse(parts=parts)
-                message_history.append(assistant_message)
-
-                # Add tool return messages for completed tool calls
-                for tool_call in tool_calls:
-                    # Look for tool results in the message parts
-                    result = None
-                    if msg_parts:
-                        for part in msg_parts:
-                            if (
-                                part.get("type") == "tool-result"
-                                and part.get("toolCallId") == tool_call.tool_call_id
-                            ):
-                                result = part.get("output")  # v5 uses 'output'
-                                break
-
-                    if result is not None:
-                        tool_return = ModelRequest(
-                            parts=[
-                                ToolReturnPart(
-                                    tool_name=tool_call.tool_name,
-                                    content=result,
-                                    tool_call_id=tool_call.tool_call_id,
-                                )
-                            ]
-                        )
-                        message_history.append(tool_return)
+    messages_except_last = messages[:-1]
+
+    if cache is None:
+        for msg in messages_except_last:
+            message_history.extend(convert_vercel_message(msg))
+        return latest_user_message, message_history
+
+    keys = cache.prefix_keys(messages_except_last, conversation_id)
+    start, cached = cache.longest_prefix(keys)
+    converted = list(cached.messages) if cached else []
+    size = cached.size if cached else 0
+
+    for msg in messages_except_last[start:]:
+        converted.extend(convert_vercel_message(msg))
+        size += message_size(msg)
+
+    if start < len(messages_except_last):
+        cache.put(
+            keys[-1],
+            CachedHistory(tuple(converted), size),
+            replaces=keys[start] if cached else None,
+        )
 
+    message_history.extend(converted)
     return latest_user_message, message_history
 
 
-async def to_data_stream_protocol(node, run):
+async def to_data_stream_protocol(
+    node,
+    run,
+    coalescer: Optional[DeltaCoalescer] = None,
+    encoder: Optional[DataStreamEncoder] = None,
+    meter: Optional[StreamMeter] = None,
+):
     """Convert Pydantic AI agent stream node to Vercel AI SDK Data Stream Protocol.
 
     This implementation handles text streaming and tool calls for the math agent,
@@ -229,46 +281,66 @@ async def to_data_stream_protocol(node, run):
     Args:
         node: Agent stream node from agent.iter()
         run: Agent run context
+        coalescer: Optional text-delta coalescer; consecutive deltas are merged
+            into fewer frames within its byte/latency budget
+        encoder: Frame encoder, defaults to the module encoder
+        meter: Optional meter counting model deltas streamed
 
     Yields:
-        str: Data stream protocol formatted chunks
+        bytes: Data stream protocol formatted chunks
     """
-    from pydantic_ai import Agent
-    from pydantic_ai.messages import FunctionToolCallEvent, FunctionToolResultEvent
-
     if not hasattr(run, "_tool_calls_pending"):
         run._tool_calls_pending = {}
     if not hasattr(run, "_tool_name_map"):
         run._tool_name_map = {}
+    if not hasattr(run, "_tool_started"):
+        run._tool_started = {}
+
+    if coalescer is not None and not coalescer.enabled:
+        coalescer = None
+    if encoder is None:
+        encoder = coalescer.encoder if coalescer is not None else default_encoder
 
     if Agent.is_user_prompt_node(node):
         # User prompts are handled by the frontend, skip
         pass
     elif Agent.is_model_request_node(node):
         async with node.stream(run.ctx) as request_stream:
-            async for event in request_stream:
-                logger.info(f"📊 Event type: {type(event).__name__}")
+            events = (
+                iter_with_flush_deadline(request_stream, coalescer)
+                if coalescer is not None and coalescer.max_delay
+                else request_stream
+            )
+            # Checked once per model response, not per token
+            log_events = logger.isEnabledFor(logging.DEBUG)
+            async for event in events:
+                if event is None:
+                    # Latency budget expired while waiting for the model
+                    for frame in coalescer.flush():
+                        yield frame
+                    continue
+
+                if log_events and token_sampler():
+                    logger.debug("Event type: %s", type(event).__name__)
 
                 if isinstance(event, PartStartEvent):
+                    if coalescer is not None:
+                        for frame in coalescer.flush():
+                            yield frame
+
                     if event.part.part_kind == "text":
                         if not hasattr(run, "_text_id"):
                             run._text_id = "text-" + str(id(event))
-                        chunk = "data: {}\n\n".format(
-                            json.dumps({"type": "text-start", "id": run._text_id})
-                        )
-                        yield chunk
+                        yield encoder.text_start(run._text_id)
 
                         # Check if PartStartEvent contains initial content
                         if hasattr(event.part, "content") and event.part.content:
                             initial_content = event.part.content
-                            initial_chunk = "data: {}\n\n".format(
-                                json.dumps({
-                                    "type": "text-delta",
-                                    "id": run._text_id,
-                                    "delta": initial_content,
-                                })
-                            )
-                            yield initial_chunk
+                            if coalescer is not None:
+                                for frame in coalescer.add(run._text_id, initial_content):
+                                    yield frame
+                            else:
+                                yield encoder.text_delta(run._text_id, initial_content)
 
                     elif event.part.part_kind == "tool-call":
                         run._tool_calls_pending[event.part.tool_call_id] = {
@@ -277,42 +349,54 @@ async def to_data_stream_protocol(node, run):
                         }
 
                 elif isinstance(event, PartDeltaEvent):
+                    if meter is not None:
+                        meter.tick()
                     if event.delta.part_delta_kind == "text":
                         if not hasattr(run, "_text_id"):
                             run._text_id = "text-main"
-                        chunk = "data: {}\n\n".format(
-                            json.dumps({
-                                "type": "text-delta",
-                                "id": run._text_id,
-                                "delta": event.delta.content_delta,
-                            })
-                        )
-                        yield chunk
+                        if coalescer is not None:
+                            for frame in coalescer.add(run._text_id, event.delta.content_delta):
+                                yield frame
+                            continue
+                        yield encoder.text_delta(run._text_id, event.delta.content_delta)
+
+            if coalescer is not None:
+                for frame in coalescer.flush():
+                    yield frame
 
     elif Agent.is_call_tools_node(node):
         # Handle tool calls with proper event emission
         async with node.stream(run.ctx) as tool_stream:
             async for event in tool_stream:
                 if isinstance(event, FunctionToolCallEvent):
-                    print(f"🔧 TOOL CALL STARTED: {event.part.tool_name}")
-                    print(f"🔧 TOOL INPUT: {json.dumps(event.part.args, indent=2)}")
+                    logger.debug(
+                        "Tool call started: %s input=%s",
+                        event.part.tool_name,
+                        LazyJson(event.part.args, indent=2),
+                    )
 
                     # Store tool name mapping
                     run._tool_name_map[event.part.tool_call_id] = event.part.tool_name
+                    run._tool_started[event.part.tool_call_id] = time.perf_counter()
 
                     # Emit tool-input-available event
-                    yield "data: {}\n\n".format(
-                        json.dumps({
-                            "type": "tool-input-available",
-                            "toolCallId": event.part.tool_call_id,
-                            "toolName": event.part.tool_name,
-                            "input": event.part.args,
-                        })
+                    yield encoder.tool_input_available(
+                        event.part.tool_call_id,
+                        event.part.tool_name,
+                        event.part.args,
                     )
 
                 elif isinstance(event, FunctionToolResultEvent):
-                    print(f"🔧 TOOL RESULT RECEIVED for call_id: {event.result.tool_call_id}")
-                    print(f"🔧 TOOL OUTPUT: {event.result.content}")
+                    logger.debug(
+                        "Tool result received for call_id %s: %s",
+                        event.result.tool_call_id,
+                        event.result.content,
+                    )
+
+                    started = run._tool_started.pop(event.result.tool_call_id, None)
+                    if started is not None:
+                        tool_name = run._tool_name_map.get(event.result.tool_call_id, "unknown")
+                        tool_seconds.labels(tool_name).observe(time.perf_counter() - started)
 
                     # Emit tool-output-available event
                     result_content = (
@@ -325,21 +409,15 @@ async def to_data_stream_protocol(node, run):
                         )
                     )
 
-                    yield "data: {}\n\n".format(
-                        json.dumps({
-                            "type": "tool-output-available",
-                            "toolCallId": event.result.tool_call_id,
-                            "output": result_content,
-                        })
+                    yield encoder.tool_output_available(
+                        event.result.tool_call_id,
+                        result_content,
                     )
 
     elif Agent.is_end_node(node):
         # Send text-end if we were streaming text
         if hasattr(run, "_text_id"):
-            chunk = "data: {}\n\n".format(
-                json.dumps({"type": "text-end", "id": run._text_id})
-            )
-            yield chunk
+            yield encoder.text_end(run._text_id)
             delattr(run, "_text_id")
 
 
@@ -375,7 +453,7 @@ async def old_to_data_stream_protocol(agent_stream, run_context):
 
     try:
         async for event in agent_stream:
-            logger.info(f"Processing event: {type(event).__name__}")
+            logger.debug("Processing event: %s", type(event).__name__)
 
             if isinstance(event, PartStartEvent):
                 if event.part.part_kind == "text":
@@ -412,7 +490,7 @@ async def old_to_data_stream_protocol(agent_stream, run_context):
             # This is simplified - in the full version, you'd handle tool completion events
 
     except Exception as e:
-        logger.error(f"Stream processing error: {e}")
+        logger.error("Stream processing error: %s", e)
         error_id = "error-text"
         yield f"data: {json.dumps({'type': 'text-start', 'id': error_id})}\n\n"
         yield f"data: {json.dumps({'type': 'text-delta', 'id': error_id, 'delta': f'Error: {str(e)}'})}\n\n"
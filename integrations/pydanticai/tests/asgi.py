@@ -0,0 +1,90 @@
+"""Drive the app over ASGI with a client that leaves early."""
+
+import asyncio
+import json
+from typing import Any, Dict, List
+
+from starlette.requests import ClientDisconnect
+
+
+def post_scope(path: str, spec_version: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": spec_version},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"accept", b"text/event-stream")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+
+
+async def post_and_leave(app, path: str, body: Dict[str, Any], spec_version: str) -> List[dict]:
+    """
+    POST ``body`` to ``path`` and disconnect before the first body chunk.
+
+    Under ASGI 2.3 the client's ``http.disconnect`` arrives while the
+    response start is being written; under 2.4 writing it fails the way a
+    closed socket does.
+
+    Returns:
+        The messages the app sent
+    """
+    received = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+    sent = []
+
+    async def receive() -> dict:
+        return received.pop(0) if received else {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            if spec_version != "2.3":
+                raise OSError("client disconnected")
+            # A slow write; the disconnect is noticed before it completes
+            await asyncio.sleep(0.05)
+        sent.append(message)
+
+    try:
+        await app(post_scope(path, spec_version), receive, send)
+    except (ClientDisconnect, OSError):
+        pass
+    return sent
+
+
+async def post_and_leave_mid_stream(
+    app, path: str, body: Dict[str, Any], chunks: int, spec_version: str
+) -> List[dict]:
+    """
+    POST ``body`` to ``path`` and disconnect once ``chunks`` body chunks
+    have been received.
+
+    Returns:
+        The messages the app sent
+    """
+    received = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+    sent = []
+    left = asyncio.Event()
+
+    async def receive() -> dict:
+        if received:
+            return received.pop(0)
+        await left.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        if left.is_set():
+            raise OSError("client disconnected")
+        sent.append(message)
+        if sum(message["type"] == "http.response.body" for message in sent) >= chunks:
+            left.set()
+
+    try:
+        await app(post_scope(path, spec_version), receive, send)
+    except (ClientDisconnect, OSError):
+        pass
+    return sent
@@ -0,0 +1,8 @@
+import os
+
+# The settings of example_server are read when it is imported
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: runs fresh interpreters; deselect with -m 'not slow'")
@@ -0,0 +1,128 @@
+import asyncio
+
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+from example_server.compaction import SUMMARY_HEADER, HistoryCompactor, ModelMessageFormat, SummaryCache
+
+FORMAT = ModelMessageFormat()
+
+
+def system(text):
+    return ModelRequest(parts=[SystemPromptPart(content=text)])
+
+
+def user(text):
+    return ModelRequest(parts=[UserPromptPart(content=text)])
+
+
+def assistant(text):
+    return ModelResponse(parts=[TextPart(content=text)])
+
+
+def tool_call(name):
+    return ModelResponse(parts=[ToolCallPart(tool_name=name, args="{}", tool_call_id="call")])
+
+
+def tool_result(text):
+    return ModelRequest(parts=[ToolReturnPart(tool_name="lookup", content=text, tool_call_id="call")])
+
+
+def turn(i, tool_output=None):
+    messages = [user(f"question {i}.")]
+    if tool_output is not None:
+        messages += [tool_call("lookup"), tool_result(tool_output)]
+    return messages + [assistant(f"answer {i}.")]
+
+
+def thread(turns, tool_output=None):
+    return [system("be brief"), *(message for i in range(turns) for message in turn(i, tool_output))]
+
+
+def texts(messages):
+    return [FORMAT.text(message) for message in messages]
+
+
+def compactor(**options):
+    options = {"max_tokens": 0, "keep_recent_turns": 2, "summary_block_turns": 2, **options}
+    return HistoryCompactor(FORMAT, **options)
+
+
+def test_short_thread_is_returned_as_is():
+    messages = thread(3)
+    assert asyncio.run(compactor(keep_recent_turns=3).compact(messages)) is messages
+
+
+def test_older_turns_are_summarized_in_blocks_and_the_latest_kept():
+    messages = thread(5, tool_output="x" * 1000)
+    history = compactor(max_tool_output_chars=100)
+    result = asyncio.run(history.compact(messages))
+
+    # system, one summary of turns 0-1, turn 2 with its tool output elided, turns 3-4
+    assert len(result) == 2 + 3 * 4
+    assert texts(result)[0] == "be brief"
+    summary = texts(result)[1]
+    assert summary.startswith(SUMMARY_HEADER)
+    assert "question 1." in summary and "question 2." not in summary
+    assert texts(result)[2:4] == texts(messages)[9:11] and texts(result)[5] == "answer 2."
+    assert "characters elided" in texts(result)[4] and len(texts(result)[4]) < 200
+    assert result[-8:] == messages[-8:]
+    assert history.elided_outputs == 3
+
+
+def test_block_summaries_are_cached_as_the_thread_grows():
+    transcripts = []
+
+    async def summarizer(transcript):
+        transcripts.append(transcript)
+        await asyncio.sleep(0.01)
+        return f"summary {len(transcripts)}"
+
+    cache = SummaryCache()
+
+    async def scenario():
+        history = compactor(summarizer=summarizer, summary_cache=cache)
+        # Concurrent runs of the thread summarize its first block once
+        await asyncio.gather(history.compact(thread(5)), history.compact(thread(5)))
+        return await history.compact(thread(7))
+
+    result = asyncio.run(scenario())
+    assert len(transcripts) == 2
+    assert "question 0." in transcripts[0] and "question 2." in transcripts[1]
+    assert (cache.misses, cache.hits) == (2, 2)
+    assert texts(result)[1] == f"{SUMMARY_HEADER}\n\nsummary 1\n\nsummary 2"
+
+
+def test_over_budget_drops_summaries_then_the_oldest_turns():
+    messages = thread(5)
+    # The system message and three turns fit; the summary does not
+    result = asyncio.run(compactor(max_tokens=42).compact(messages))
+    assert texts(result) == ["be brief", *texts(messages)[5:]]
+
+    history = compactor(max_tokens=30)
+    result = asyncio.run(history.compact(messages))
+    assert texts(result) == ["be brief", *texts(messages)[7:]]
+    assert history.dropped_turns == 1
+
+
+def test_latest_turn_is_kept_whole_over_any_budget():
+    messages = thread(4, tool_output="result")
+    result = asyncio.run(compactor(max_tokens=1).compact(messages))
+    # The tool call stays with its result
+    assert result == [messages[0], *messages[-4:]]
+
+
+def test_failed_summary_keeps_the_turns():
+    async def summarizer(transcript):
+        raise RuntimeError("summarizer down")
+
+    messages = thread(5)
+    result = asyncio.run(compactor(summarizer=summarizer).compact(messages))
+    assert texts(result) == texts(messages)
@@ -0,0 +1,82 @@
+import asyncio
+import importlib
+import zlib
+
+import pytest
+
+from example_server.compression import ResponseCompression, negotiate
+
+# The package's ``compression`` attribute is the configured instance
+compression = importlib.import_module("example_server.compression")
+
+FRAMES = [f'data: {{"type":"text-delta","id":"t1","delta":"token {i} "}}\n\n' for i in range(20)]
+
+
+async def frames():
+    for frame in FRAMES:
+        yield frame
+
+
+async def collect(stream) -> list:
+    return [chunk async for chunk in stream]
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("", None),
+    ("gzip", "gzip"),
+    ("GZIP", "gzip"),
+    ("br;q=0.5, gzip;q=0.8", "gzip"),
+    ("br;q=0.8, gzip;q=0.5", "br"),
+    ("br, gzip", "br"),  # a tie goes to the server's preference
+    ("gzip;q=0", None),
+    ("gzip;q=abc", None),
+    ("deflate", None),
+    ("identity;q=0", None),
+    ("gzip;q=0.5, identity;q=0", "gzip"),
+    ("*", "br"),
+    ("*;q=0.5, br;q=0", "gzip"),
+])
+def test_negotiate_honours_quality_values(accept_encoding, expected):
+    assert negotiate(accept_encoding, ("br", "gzip")) == expected
+
+
+def test_br_is_not_offered_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    responses = ResponseCompression(("br", "gzip"))
+    assert responses.encodings == ("gzip",)
+
+    stream, headers = responses.wrap("br", frames())
+    assert headers == {"Vary": "Accept-Encoding"}
+    assert asyncio.run(collect(stream)) == FRAMES
+
+    stream, headers = responses.wrap("br, gzip;q=0.5", frames())
+    assert headers["Content-Encoding"] == "gzip"
+
+
+def test_gzip_frames_decode_as_they_arrive():
+    responses = ResponseCompression(("gzip",))
+    stream, headers = responses.wrap("gzip", frames())
+    chunks = asyncio.run(collect(stream))
+    assert headers["Content-Encoding"] == "gzip"
+
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # Every flushed chunk decodes to exactly its frame, without waiting for the next
+    decoded = [decoder.decompress(chunk) for chunk in chunks]
+    assert decoded[:-1] == [frame.encode() for frame in FRAMES]
+    assert decoded[-1] == b"" and decoder.eof
+    assert responses.bytes_in == sum(len(frame) for frame in FRAMES)
+    assert responses.bytes_out == sum(len(chunk) for chunk in chunks) < responses.bytes_in
+
+
+def test_brotli_frames_decode_as_they_arrive():
+    brotli = pytest.importorskip("brotli")
+    responses = ResponseCompression(("br",))
+    stream, headers = responses.wrap("br", frames())
+    chunks = asyncio.run(collect(stream))
+    assert headers["Content-Encoding"] == "br"
+
+    decoder = brotli.Decompressor()
+    decoded = [decoder.process(chunk) for chunk in chunks]
+    assert decoded[:-1] == [frame.encode() for frame in FRAMES]
+    assert decoder.is_finished()
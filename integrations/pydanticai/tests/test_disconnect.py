@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from benchmarks.fake_model import FakeModel
+from example_server import admission, agent, app
+from example_server.disconnect import DisconnectStats, StreamMeter, cancel_on_disconnect
+from .asgi import post_and_leave_mid_stream, post_scope
+
+
+class Upstream:
+    """An endless upstream stream that records when it is closed."""
+
+    def __init__(self):
+        self.sent = 0
+        self.closed = False
+
+    async def frames(self):
+        try:
+            while True:
+                await asyncio.sleep(0.005)
+                self.sent += 1
+                yield f"frame {self.sent}"
+        finally:
+            self.closed = True
+
+
+def test_upstream_is_cancelled_when_the_client_disconnects():
+    async def scenario():
+        connected = asyncio.Event()
+        connected.set()
+
+        async def receive() -> dict:
+            if connected.is_set():
+                await asyncio.sleep(3600)
+            return {"type": "http.disconnect"}
+
+        upstream = Upstream()
+        stats = DisconnectStats()
+        request = Request(post_scope("/", "2.4"), receive)
+        relayed = []
+        async for frame in cancel_on_disconnect(
+            request, upstream.frames(), meter=StreamMeter(), poll_interval=0.01, stats=stats
+        ):
+            relayed.append(frame)
+            if len(relayed) == 3:
+                connected.clear()
+        # Let the cancelled producer unwind
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return upstream, stats, relayed
+
+    upstream, stats, relayed = asyncio.run(scenario())
+    assert upstream.closed
+    assert upstream.sent < 50
+    assert stats.cancelled_streams == 1 and stats.completed_streams == 0
+
+
+@pytest.mark.parametrize("spec_version", ["2.3", "2.4"])
+def test_chat_run_is_cancelled_when_the_client_leaves_mid_stream(monkeypatch, spec_version):
+    fake = FakeModel(tokens=1000, token_delay=0.005)
+    monkeypatch.setattr(agent, "model", fake.model)
+    body = {"messages": [{"id": "m0", "role": "user", "parts": [{"type": "text", "text": "Hello"}]}]}
+
+    async def scenario():
+        sent = await post_and_leave_mid_stream(app, "/chat", body, 3, spec_version)
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert sent[0]["status"] == 200
+    assert fake.requests == 1
+    assert fake.active_streams == 0 and fake.aborted_streams == 1
+    assert admission is None or admission.active == 0
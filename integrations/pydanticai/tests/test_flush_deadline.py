@@ -0,0 +1,82 @@
+import asyncio
+
+from example_server.flush_deadline import iter_with_flush_deadline
+
+
+class Batcher:
+    def __init__(self, time_left=None):
+        self._time_left = time_left
+
+    def time_left(self):
+        return self._time_left
+
+
+def test_upstream_cleanup_has_run_when_the_iterator_is_closed():
+    cleaned_up = []
+
+    async def upstream():
+        try:
+            while True:
+                yield b"chunk"
+                await asyncio.sleep(0.01)
+        finally:
+            await asyncio.sleep(0)
+            cleaned_up.append(True)
+
+    async def scenario():
+        chunks = iter_with_flush_deadline(upstream(), Batcher())
+        assert await chunks.__anext__() == b"chunk"
+        await chunks.aclose()
+        return list(cleaned_up)
+
+    assert asyncio.run(scenario()) == [True]
+
+
+def test_pump_reads_only_a_small_window_ahead_of_the_consumer():
+    produced = []
+
+    async def upstream():
+        for index in range(100):
+            produced.append(index)
+            yield index
+
+    async def scenario():
+        chunks = iter_with_flush_deadline(upstream(), Batcher())
+        assert await chunks.__anext__() == 0
+        await asyncio.sleep(0.01)
+        read_ahead = len(produced)
+        await chunks.aclose()
+        return read_ahead
+
+    # One chunk handed out, one queued and one blocked on the full queue
+    assert asyncio.run(scenario()) <= 3
+
+
+def test_deadline_yields_none_while_the_upstream_is_quiet():
+    async def upstream():
+        yield b"a"
+        await asyncio.sleep(0.05)
+        yield b"b"
+
+    async def scenario():
+        return [chunk async for chunk in iter_with_flush_deadline(upstream(), Batcher(0.01))]
+
+    items = asyncio.run(scenario())
+    assert items[0] == b"a" and items[-1] == b"b"
+    assert None in items
+
+
+def test_upstream_error_reaches_the_consumer():
+    async def upstream():
+        yield b"a"
+        raise ValueError("upstream failed")
+
+    async def scenario():
+        return [chunk async for chunk in iter_with_flush_deadline(upstream(), Batcher())]
+
+    try:
+        asyncio.run(scenario())
+    except ValueError as error:
+        assert str(error) == "upstream failed"
+    else:
+        raise AssertionError("expected the upstream error")
@@ -0,0 +1,120 @@
+import asyncio
+
+from example_server.hedging import Hedger
+
+
+def attempts(delays: dict, results: dict = None):
+    """Attempts that return their index after ``delays[index]`` seconds."""
+    started = []
+
+    async def attempt(index: int):
+        started.append(index)
+        await asyncio.sleep(delays[index])
+        if results is not None and isinstance(results.get(index), Exception):
+            raise results[index]
+        return f"attempt-{index}"
+
+    return attempt, started
+
+
+def hedger(**overrides) -> Hedger:
+    options = dict(min_delay=0.01, max_delay=0.02, min_samples=1, max_ratio=1.0)
+    options.update(overrides)
+    return Hedger(**options)
+
+
+def test_fast_primary_wins_without_a_hedge():
+    attempt, started = attempts({0: 0, 1: 0})
+    hedging = hedger()
+
+    async def scenario():
+        return await hedging.race(attempt, lambda result: asyncio.sleep(0))
+
+    assert asyncio.run(scenario()) == ("attempt-0", 0)
+    assert started == [0]
+    assert (hedging.runs, hedging.hedges, hedging.hedge_wins) == (1, 0, 0)
+    assert len(hedging._latencies) == 1
+
+
+def test_slow_primary_wins_against_its_hedge_and_records_its_latency():
+    attempt, started = attempts({0: 0.03, 1: 0.2})
+    hedging = hedger()
+
+    async def scenario():
+        return await hedging.race(attempt, lambda result: asyncio.sleep(0))
+
+    assert asyncio.run(scenario()) == ("attempt-0", 0)
+    assert started == [0, 1]
+    assert (hedging.hedges, hedging.hedge_wins) == (1, 0)
+    assert list(hedging._latencies) and hedging._latencies[0] >= 0.03
+
+
+def test_hedge_wins_and_the_primary_latency_is_not_recorded():
+    attempt, started = attempts({0: 0.5, 1: 0})
+    hedging = hedger()
+
+    async def scenario():
+        return await hedging.race(attempt, lambda result: asyncio.sleep(0))
+
+    assert asyncio.run(scenario()) == ("attempt-1", 1)
+    assert started == [0, 1]
+    assert (hedging.hedges, hedging.hedge_wins) == (1, 1)
+    assert len(hedging._latencies) == 0
+
+
+def test_loser_that_returned_as_well_is_discarded():
+    discarded = []
+
+    async def attempt(index: int):
+        if index == 0:
+            await asyncio.sleep(0.03)
+            return "attempt-0"
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            # Got its first token just as it was cancelled
+            return "attempt-1"
+
+    async def discard(result):
+        discarded.append(result)
+
+    async def scenario():
+        hedging = hedger()
+        result = await hedging.race(attempt, discard)
+        # Discards run on the loser's done callback
+        await asyncio.sleep(0.01)
+        return result
+
+    assert asyncio.run(scenario()) == ("attempt-0", 0)
+    assert discarded == ["attempt-1"]
+
+
+def test_hedge_is_not_sent_once_the_budget_is_exhausted():
+    attempt, started = attempts({0: 0.03, 1: 0})
+    hedging = hedger(max_ratio=0.5, min_samples=2)
+
+    async def scenario():
+        results = []
+        for _ in range(3):
+            results.append(await hedging.race(attempt, lambda result: asyncio.sleep(0)))
+        return results
+
+    results = asyncio.run(scenario())
+    # The first run may hedge (1 < 0.5 * 2), the next two may not
+    assert [index for _, index in results] == [1, 0, 0]
+    assert hedging.hedges == 1
+    assert hedging.budget_exhausted == 2
+
+
+def test_primary_failure_before_the_hedge_is_raised():
+    attempt, started = attempts({0: 0, 1: 0}, {0: RuntimeError("upstream down")})
+    hedging = hedger()
+
+    async def scenario():
+        try:
+            await hedging.race(attempt, lambda result: asyncio.sleep(0))
+        except RuntimeError as error:
+            return str(error)
+
+    assert asyncio.run(scenario()) == "upstream down"
+    assert started == [0]
@@ -0,0 +1,66 @@
+from pydantic_ai.messages import ModelMessagesTypeAdapter
+
+from example_server.history_cache import HistoryCache
+from example_server.vercel_to_pydantic import convert_vercel_messages_to_pydantic
+
+
+def message(id: str, text: str, role: str = "user") -> dict:
+    return {"id": id, "role": role, "parts": [{"type": "text", "text": text}]}
+
+
+def tool_message(id: str, state: str) -> dict:
+    parts = [{"type": "tool-call", "toolCallId": "call-0", "toolName": "roll_dice", "input": {}, "state": state}]
+    if state == "output-available":
+        parts.append({"type": "tool-result", "toolCallId": "call-0", "output": "4", "state": state})
+    return {"id": id, "role": "assistant", "parts": parts}
+
+
+def without_timestamps(value):
+    if isinstance(value, dict):
+        return {key: without_timestamps(item) for key, item in value.items() if key != "timestamp"}
+    if isinstance(value, list):
+        return [without_timestamps(item) for item in value]
+    return value
+
+
+def convert(messages: list, cache=None) -> tuple:
+    """The prompt and history, with the conversion times left out."""
+    prompt, history = convert_vercel_messages_to_pydantic(messages, "Be brief.", cache, "chat-0")
+    return prompt, without_timestamps(ModelMessagesTypeAdapter.dump_python(history))
+
+
+def test_cached_conversion_matches_uncached_turn_by_turn():
+    thread = []
+    for turn in range(5):
+        thread.append(message(f"u{turn}", f"Question {turn}"))
+        thread.append(message(f"a{turn}", f"Answer {turn}", role="assistant"))
+    cache = HistoryCache()
+
+    for end in range(1, len(thread) + 1, 2):
+        assert convert(thread[:end], cache) == convert(thread[:end])
+    assert cache.hits > 0
+
+
+def test_message_edited_in_place_is_converted_again():
+    cache = HistoryCache()
+    thread = [message("u0", "Weather in Paris?"), message("a0", "Sunny.", role="assistant"), message("u1", "Thanks")]
+    convert(thread, cache)
+
+    edited = [message("u0", "Weather in Rome?"), *thread[1:]]
+    assert convert(edited, cache) == convert(edited)
+    assert convert(edited, cache)[1][1]["parts"][0]["content"] == "Weather in Rome?"
+
+
+def test_tool_part_changing_state_is_converted_again():
+    cache = HistoryCache()
+    pending = [message("u0", "Roll a die"), tool_message("a0", "input-available"), message("u1", "And?")]
+    convert(pending, cache)
+
+    answered = [pending[0], tool_message("a0", "output-available"), pending[2]]
+    assert convert(answered, cache) == convert(answered)
+
+
+def test_prefix_keys_depend_on_the_conversation():
+    messages = [message("m0", "Hello")]
+
+    assert HistoryCache.prefix_keys(messages, "chat-0")[1] != HistoryCache.prefix_keys(messages, "chat-1")[1]
@@ -0,0 +1,84 @@
+import importlib
+import json
+import logging
+
+import pytest
+
+from example_server.config import settings
+from example_server.logs import (
+    PACKAGE_LOGGER,
+    LazyJson,
+    Sampler,
+    _DeferredQueueHandler,
+    configure_logging,
+    shutdown_logging,
+)
+
+logs = importlib.import_module("example_server.logs")
+logger = logging.getLogger(f"{PACKAGE_LOGGER}.test")
+
+
+@pytest.fixture(autouse=True)
+def restore_logging():
+    yield
+    configure_logging(settings.log_level, settings.log_json, settings.log_token_sample_every)
+
+
+def written(capsys) -> list:
+    shutdown_logging()
+    return capsys.readouterr().err.splitlines()
+
+
+def test_reconfiguring_replaces_the_pipeline(capsys):
+    configure_logging("INFO")
+    first = logs._listener
+    configure_logging("INFO")
+    logger.info("once")
+
+    # The first listener thread is stopped, not left running next to the new one
+    assert first is not logs._listener and first._thread is None
+    handlers = logging.getLogger(PACKAGE_LOGGER).handlers
+    assert sum(isinstance(handler, _DeferredQueueHandler) for handler in handlers) == 1
+    assert len([line for line in written(capsys) if line.endswith(": once")]) == 1
+
+
+def test_arguments_are_rendered_when_logged(capsys):
+    configure_logging("INFO", json_format=True)
+    payload = {"step": 1}
+    logger.info("payload %s", LazyJson(payload))
+    payload["step"] = 2
+
+    [line] = written(capsys)
+    assert json.loads(line)["message"] == 'payload {"step": 1}'
+
+
+def test_disabled_level_renders_nothing(capsys):
+    rendered = []
+
+    class Probe:
+        def __str__(self):
+            rendered.append(True)
+            return "probe"
+
+    configure_logging("INFO")
+    logger.debug("%s", LazyJson(Probe()))
+    assert written(capsys) == [] and rendered == []
+
+
+def test_json_lines_keep_the_traceback(capsys):
+    configure_logging("INFO", json_format=True)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("failed")
+
+    [line] = written(capsys)
+    entry = json.loads(line)
+    assert entry["message"] == "failed" and "ValueError: boom" in entry["exception"]
+
+
+def test_sampler_passes_one_in_every_n():
+    every_third = Sampler(3)
+    assert [every_third() for _ in range(7)] == [True, False, False, True, False, False, True]
+    assert not any(Sampler(0)() for _ in range(3))
+    assert all(Sampler(1)() for _ in range(3))
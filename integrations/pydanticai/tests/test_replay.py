@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+import pytest
+
+from benchmarks.fake_model import FakeModel
+from example_server import agent, app, replay_registry
+from example_server.backpressure import merge_delta_frames
+from example_server.replay import ReplayRegistry, RunIncompleteError
+
+
+def chat_body() -> dict:
+    return {
+        "id": "chat-replay",
+        "messages": [{"id": "m0", "role": "user", "parts": [{"type": "text", "text": "Hello"}]}],
+    }
+
+
+async def post_chat(headers: dict, check: bool = True) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post("/chat", json=chat_body(), headers=headers)
+        if check:
+            response.raise_for_status()
+        return response
+
+
+async def first_frame_then_wait():
+    yield "data: first\n\n"
+    await asyncio.Event().wait()
+
+
+def test_repeat_without_last_event_id_starts_a_new_run(monkeypatch):
+    assert replay_registry is not None
+    fake = FakeModel(tokens=3, token_delay=0)
+    monkeypatch.setattr(agent, "model", fake.model)
+
+    async def scenario():
+        first = await post_chat({})
+        # A retry or regenerate of the same message
+        second = await post_chat({})
+        # A reconnect replays the run the second request started
+        resumed = await post_chat({"last-event-id": "-1"})
+        return first.text, second.text, resumed.text
+
+    first, second, resumed = asyncio.run(scenario())
+    assert fake.requests == 2
+    assert "lorem" in first and "lorem" in second
+    assert resumed == second
+
+
+def test_followers_of_a_cancelled_run_get_an_error_after_its_frames():
+    async def scenario():
+        registry = ReplayRegistry(grace=0)
+        run = registry.start("run", first_frame_then_wait())
+        await asyncio.sleep(0)
+        run.task.cancel()
+        frames = []
+        with pytest.raises(RunIncompleteError):
+            async for frame in run.follow():
+                frames.append(frame)
+        return frames
+
+    assert asyncio.run(scenario()) == [b"id: 0\ndata: first\n\n"]
+
+
+def test_resuming_a_cancelled_run_is_a_conflict():
+    assert replay_registry is not None
+
+    async def scenario():
+        run = replay_registry.start("chat:chat-replay:m0", first_frame_then_wait())
+        await asyncio.sleep(0)
+        run.task.cancel()
+        await asyncio.sleep(0)
+        return await post_chat({"last-event-id": "0"}, check=False)
+
+    assert asyncio.run(scenario()).status_code == 409
+
+
+def test_frames_with_event_ids_are_merged():
+    first = 'id: 3\ndata: {"type":"text-delta","id":"t","delta":"Hel"}\n\n'
+    second = 'id: 4\ndata: {"type":"text-delta","id":"t","delta":"lo"}\n\n'
+
+    assert merge_delta_frames(first, second) == 'id: 4\ndata: {"type":"text-delta","id":"t","delta":"Hello"}\n\n'
+    assert merge_delta_frames(first.encode(), second.encode()) == merge_delta_frames(first, second).encode()
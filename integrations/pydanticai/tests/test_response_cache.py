@@ -0,0 +1,88 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+from example_server.response_cache import create_response_cache
+
+
+async def frames(*items):
+    for item in items:
+        yield item
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    module = importlib.import_module("example_server.response_cache")
+    monkeypatch.setattr(module, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def make_cache(backend, tmp_path, **limits):
+    limits = {"ttl": 60.0, "max_entries": 100, "max_bytes": 1 << 20, **limits}
+    return create_response_cache(backend, str(tmp_path / "responses.sqlite3"), **limits)
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_recorded_run_is_replayed_with_the_new_run_ids(backend, tmp_path):
+    cache = make_cache(backend, tmp_path)
+
+    async def scenario():
+        assert await cache.lookup("k") is None
+        relayed = [
+            frame async for frame in cache.record("k", frames("id=run-1 ", b"done"), {"@RUN@": "run-1"})
+        ]
+        assert relayed == ["id=run-1 ", b"done"]
+        return await cache.lookup("k", {"@RUN@": "run-2"})
+
+    assert asyncio.run(scenario()) == b"id=run-2 done"
+    assert (cache.hits, cache.misses, cache.stores) == (1, 1, 1)
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_entries_expire_after_the_ttl(backend, tmp_path, clock):
+    cache = make_cache(backend, tmp_path, ttl=10.0)
+
+    async def scenario():
+        [frame async for frame in cache.record("k", frames(b"x"))]
+        clock[0] += 9
+        assert await cache.lookup("k") == b"x"
+        clock[0] += 2
+        return await cache.lookup("k")
+
+    assert asyncio.run(scenario()) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_least_recently_used_entry_is_evicted(backend, tmp_path, clock):
+    cache = make_cache(backend, tmp_path, max_entries=2)
+
+    async def scenario():
+        for key in "ab":
+            [frame async for frame in cache.record(key, frames(key.encode()))]
+            clock[0] += 1
+        await cache.lookup("a")
+        clock[0] += 1
+        [frame async for frame in cache.record("c", frames(b"c"))]
+        return [await cache.lookup(key) for key in "abc"]
+
+    assert asyncio.run(scenario()) == [b"a", None, b"c"]
+
+
+def test_failed_run_is_not_recorded(tmp_path):
+    cache = make_cache("memory", tmp_path)
+
+    async def failing():
+        yield b"partial"
+        raise RuntimeError("upstream failed")
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            [frame async for frame in cache.record("k", failing())]
+        return await cache.lookup("k")
+
+    assert asyncio.run(scenario()) is None
+    assert cache.stores == 0
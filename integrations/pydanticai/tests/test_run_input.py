@@ -0,0 +1,38 @@
+import asyncio
+
+import httpx
+import pytest
+
+import example_server
+from example_server import app, settings
+from example_server.run_input import ThreadPrefixCache
+
+
+async def post(path: str, content: bytes) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post(path, content=content, headers={"content-type": "application/json"})
+
+
+@pytest.mark.parametrize("path", ["/", "/chat"])
+@pytest.mark.parametrize("content", [b'{"threadId": ', b"\xff\xfe", b""])
+def test_malformed_json_is_unprocessable(path, content):
+    response = asyncio.run(post(path, content))
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "json_invalid"
+
+
+def test_malformed_json_is_unprocessable_with_the_thread_cache(monkeypatch):
+    monkeypatch.setattr(example_server, "thread_cache", ThreadPrefixCache())
+    response = asyncio.run(post("/", b'{"threadId": '))
+    assert response.status_code == 422
+
+
+def test_invalid_run_input_is_unprocessable():
+    response = asyncio.run(post("/", b'{"threadId": 1}'))
+    assert response.status_code == 422
+    assert all(detail["loc"][0] == "body" for detail in response.json()["detail"])
+
+
+def test_run_input_is_decoded_in_one_pass_by_default():
+    assert not settings.thread_cache_enabled
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from example_server import serve
+from example_server.config import settings
+
+
+@pytest.fixture
+def uvicorn_run(monkeypatch):
+    calls = []
+    monkeypatch.setattr(serve.uvicorn, "run", lambda app, **options: calls.append((app, options)))
+    monkeypatch.delenv("METRICS_WORKER_LABEL", raising=False)
+    monkeypatch.setenv("PORT", "9123")
+    return calls
+
+
+def test_worker_count_defaults_to_one_per_core(monkeypatch):
+    monkeypatch.setattr(settings, "serve_workers", 0)
+    monkeypatch.setattr(serve.os, "cpu_count", lambda: 6)
+    assert serve.worker_count() == 6
+    monkeypatch.setattr(serve.os, "cpu_count", lambda: None)
+    assert serve.worker_count() == 1
+    monkeypatch.setattr(settings, "serve_workers", 3)
+    assert serve.worker_count() == 3
+
+
+def test_main_runs_uvicorn_with_the_serve_settings(monkeypatch, uvicorn_run):
+    monkeypatch.setattr(settings, "serve_workers", 4)
+    monkeypatch.setattr(settings, "serve_keep_alive_seconds", 11)
+    monkeypatch.setattr(settings, "serve_graceful_shutdown_seconds", 7.5)
+    serve.main()
+
+    [(app, options)] = uvicorn_run
+    assert app == settings.serve_app
+    assert options["port"] == 9123
+    assert options["workers"] == 4
+    assert options["timeout_keep_alive"] == 11
+    assert options["timeout_graceful_shutdown"] == 7.5
+    assert "reload" not in options
+    # Each worker labels its metric series
+    assert os.environ["METRICS_WORKER_LABEL"] == "true"
+
+
+def test_single_worker_keeps_metrics_unlabelled(monkeypatch, uvicorn_run):
+    monkeypatch.setattr(settings, "serve_workers", 1)
+    serve.main()
+
+    assert uvicorn_run[0][1]["workers"] == 1
+    assert "METRICS_WORKER_LABEL" not in os.environ
@@ -0,0 +1,96 @@
+import asyncio
+
+from example_server.single_flight import SingleFlight
+
+
+async def run_frames():
+    for frame in (b"a", b"b", b"c"):
+        await asyncio.sleep(0.01)
+        yield frame
+
+
+async def read_all(frames) -> list:
+    return [frame async for frame in frames]
+
+
+def test_follower_that_starts_reading_after_the_leader_left_gets_the_run():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.start("key", run_frames)
+        follower = flights.join("key")
+        assert follower is not None
+        assert await leader.__anext__() == b"a"
+        await leader.aclose()
+        return await read_all(follower)
+
+    assert asyncio.run(scenario()) == [b"a", b"b", b"c"]
+
+
+def test_run_is_cancelled_once_every_subscriber_left():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.start("key", run_frames)
+        follower = flights.join("key")
+        for frames in (leader, follower):
+            await frames.__anext__()
+            await frames.aclose()
+        await asyncio.sleep(0)
+        return flights
+
+    flights = asyncio.run(scenario())
+    assert len(flights) == 0
+
+
+class Lease:
+    def __init__(self):
+        self.released = 0
+
+    def release(self) -> None:
+        self.released += 1
+
+
+def test_unread_subscription_released_by_its_response_lets_the_run_stop():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.start("key", run_frames)
+        # The follower's client left before its body was ever read
+        follower = flights.join("key")
+        follower.release()
+        await leader.__anext__()
+        await leader.aclose()
+        await asyncio.sleep(0)
+        return flights
+
+    assert len(asyncio.run(scenario())) == 0
+
+
+def test_leader_lease_is_held_by_the_run_and_a_follower_lease_is_freed():
+    async def scenario():
+        flights = SingleFlight()
+        leader_lease, follower_lease = Lease(), Lease()
+        leader = flights.subscribe("key", run_frames, lease=leader_lease)
+        follower = flights.subscribe("key", run_frames, lease=follower_lease)
+        assert follower_lease.released == 1
+        await leader.__anext__()
+        await leader.aclose()
+        # The run goes on for the follower and keeps the leader's slot
+        await asyncio.sleep(0)
+        assert leader_lease.released == 0
+        frames = await read_all(follower)
+        await asyncio.sleep(0)
+        return frames, leader_lease
+
+    frames, leader_lease = asyncio.run(scenario())
+    assert frames == [b"a", b"b", b"c"]
+    assert leader_lease.released == 1
+
+
+def test_lease_is_released_when_the_run_is_cancelled_before_it_starts():
+    async def scenario():
+        flights = SingleFlight()
+        lease = Lease()
+        flights.start("key", run_frames, lease=lease).release()
+        await asyncio.sleep(0)
+        return lease
+
+    assert asyncio.run(scenario()).released == 1
@@ -0,0 +1,22 @@
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.bench_startup import env, import_profile
+
+# Same default as benchmarks/bench_startup.py --budget-ms
+IMPORT_BUDGET_MS = 1200.0
+
+
+@pytest.mark.slow
+def test_import_stays_within_budget():
+    total = min(import_profile()[0] for _ in range(3))
+    assert 0 < total <= IMPORT_BUDGET_MS
+
+
+@pytest.mark.slow
+def test_google_sdk_is_not_imported_with_the_server():
+    code = "import sys, example_server; print(any(m.startswith('google.genai') for m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], env=env(), capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
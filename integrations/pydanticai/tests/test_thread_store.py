@@ -0,0 +1,114 @@
+import asyncio
+
+import httpx
+import pytest
+from pydantic_ai.models.function import FunctionModel
+
+import example_server
+from benchmarks.fake_model import FakeModel
+from example_server import agent, app
+from example_server.admission import AdmissionRejected
+from example_server.thread_store import (
+    VERSION_HEADER,
+    MemoryThreadStore,
+    SqliteThreadStore,
+    ThreadStore,
+    ThreadVersionConflict,
+)
+
+
+def message(index: int) -> dict:
+    return {"id": f"m{index}", "role": "user", "parts": [{"type": "text", "text": f"Hello {index}"}]}
+
+
+async def post_chat(chat_id: str, messages: list, headers: dict) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post("/chat", json={"id": chat_id, "messages": messages}, headers=headers)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = ThreadStore(MemoryThreadStore())
+    monkeypatch.setattr(example_server, "thread_store", store)
+    return store
+
+
+def stored_ids(store: ThreadStore, chat_id: str):
+    thread = store.backend.load(f"chat:{chat_id}")
+    return None if thread is None else [m["id"] for m in thread.messages]
+
+
+def test_new_messages_are_stored_once_the_run_completed(store, monkeypatch):
+    monkeypatch.setattr(agent, "model", FakeModel(tokens=3, token_delay=0).model)
+
+    async def scenario():
+        first = await post_chat("chat-store", [message(0)], {})
+        second = await post_chat("chat-store", [message(1)], {VERSION_HEADER: first.headers[VERSION_HEADER]})
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert second.status_code == 200
+    assert first.headers[VERSION_HEADER] != second.headers[VERSION_HEADER]
+    assert stored_ids(store, "chat-store") == ["m0", "m1"]
+
+
+def test_guessed_version_is_a_conflict_that_does_not_disclose_the_version(store, monkeypatch):
+    monkeypatch.setattr(agent, "model", FakeModel(tokens=3, token_delay=0).model)
+
+    async def scenario():
+        await post_chat("chat-guess", [message(0)], {})
+        return await post_chat("chat-guess", [message(1)], {VERSION_HEADER: "1"})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 409
+    assert VERSION_HEADER not in response.headers
+    assert stored_ids(store, "chat-guess") == ["m0"]
+
+
+def test_failed_run_is_not_stored(store, monkeypatch):
+    async def fail(messages, info):
+        raise RuntimeError("model failed")
+        yield
+
+    monkeypatch.setattr(agent, "model", FunctionModel(stream_function=fail))
+    response = asyncio.run(post_chat("chat-failed", [message(0)], {}))
+    assert "model failed" in response.text
+    assert stored_ids(store, "chat-failed") is None
+
+
+def test_rejected_run_is_not_stored(store, monkeypatch):
+    async def reject(key):
+        raise AdmissionRejected("queue_full", 1.0)
+
+    monkeypatch.setattr(example_server.admission, "acquire", reject)
+    response = asyncio.run(post_chat("chat-rejected", [message(0)], {}))
+    assert response.status_code == 429
+    assert stored_ids(store, "chat-rejected") is None
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_stale_version_is_a_conflict(backend, tmp_path):
+    if backend == "memory":
+        store = ThreadStore(MemoryThreadStore())
+    else:
+        store = ThreadStore(SqliteThreadStore(str(tmp_path / "threads.sqlite3")))
+
+    async def scenario():
+        first = store.write("t", [{"role": "user", "content": "a"}])
+        assert await first.commit()
+        stored = await store.load("t", first.version)
+        # Two tabs continue from the same version; the second one loses
+        tabs = [store.write("t", [{"role": "user", "content": tab}], stored) for tab in "bc"]
+        assert await tabs[0].commit()
+        assert not await tabs[1].commit()
+        with pytest.raises(ThreadVersionConflict):
+            await store.load("t", first.version)
+        with pytest.raises(ThreadVersionConflict):
+            await store.load("t", tabs[1].version)
+        return await store.load("t", tabs[0].version)
+
+    thread = asyncio.run(scenario())
+    assert [m["content"] for m in thread.messages] == ["a", "b"]
+    assert store.conflicts == 3
+    assert ThreadVersionConflict().to_response().status_code == 409
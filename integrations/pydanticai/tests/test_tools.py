@@ -0,0 +1,82 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from pydantic_ai import ModelRetry
+
+from example_server.tools import ToolHost
+
+
+def test_sync_tools_run_on_the_default_executor():
+    host = ToolHost(thread_workers=2, default_executor="thread")
+
+    @host.tool
+    def blocking() -> str:
+        time.sleep(0.01)
+        return threading.current_thread().name
+
+    @host.tool(executor="inline")
+    def instant() -> str:
+        return threading.current_thread().name
+
+    async def scenario():
+        hosted_blocking, hosted_instant = host.tools
+        return await hosted_blocking(), await hosted_instant(), threading.current_thread().name
+
+    try:
+        blocking_thread, instant_thread, loop_thread = asyncio.run(scenario())
+    finally:
+        host.shutdown()
+    assert blocking_thread.startswith("tool")
+    assert instant_thread == loop_thread
+
+
+def process_id() -> int:
+    # Module level, so the process pool can pickle it
+    return os.getpid()
+
+
+def test_process_tools_run_in_the_process_pool():
+    host = ToolHost(process_workers=1)
+    host.tool(executor="process")(process_id)
+
+    try:
+        pid = asyncio.run(host.tools[0]())
+    finally:
+        host.shutdown()
+    assert pid != os.getpid()
+
+
+def test_blocking_calls_run_concurrently_in_the_pool():
+    host = ToolHost(thread_workers=4)
+
+    @host.tool
+    def slow() -> None:
+        time.sleep(0.1)
+
+    async def scenario():
+        started = time.perf_counter()
+        await asyncio.gather(*(host.tools[0]() for _ in range(4)))
+        return time.perf_counter() - started
+
+    try:
+        elapsed = asyncio.run(scenario())
+    finally:
+        host.shutdown()
+    assert elapsed < 0.3
+
+
+def test_timed_out_call_is_retried_by_the_model():
+    host = ToolHost(default_timeout=0.05)
+
+    @host.tool
+    def stuck() -> None:
+        time.sleep(0.5)
+
+    try:
+        with pytest.raises(ModelRetry):
+            asyncio.run(host.tools[0]())
+    finally:
+        host.shutdown(wait=False)
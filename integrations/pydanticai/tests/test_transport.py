@@ -0,0 +1,105 @@
+import asyncio
+import importlib
+
+import httpcore
+import pytest
+
+from example_server.transport import CachingNetworkBackend, CachingResolver, UpstreamTransport
+
+
+class CountingResolver(CachingResolver):
+    """Resolver answering from a fixed table and counting real lookups."""
+
+    def __init__(self, ttl, answers):
+        super().__init__(ttl)
+        self.answers = answers
+        self.lookups = 0
+
+    async def lookup(self, host, port):
+        self.lookups += 1
+        await asyncio.sleep(0.01)
+        return list(self.answers[host])
+
+
+class FakeBackend(httpcore.AsyncNetworkBackend):
+    """Backend that refuses ``refused`` addresses and records every attempt."""
+
+    def __init__(self, refused=()):
+        self.refused = set(refused)
+        self.attempts = []
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self.attempts.append((host, timeout))
+        if host in self.refused:
+            raise httpcore.ConnectError(f"{host} refused")
+        return host
+
+
+def test_pool_uses_the_configured_limits():
+    transport = UpstreamTransport(
+        max_connections=7, max_keepalive_connections=3, keepalive_expiry=12.0, http2=False
+    )
+    pool = transport._pool
+    assert (pool._max_connections, pool._max_keepalive_connections, pool._keepalive_expiry) == (7, 3, 12.0)
+    assert pool._network_backend is transport.network_backend
+    assert not transport.http2
+
+
+def test_http2_falls_back_without_h2(monkeypatch):
+    module = importlib.import_module("example_server.transport")
+    monkeypatch.setattr(module, "http2_available", lambda: False)
+    assert not UpstreamTransport(http2=True).http2
+
+
+def test_dns_answers_are_cached_and_shared():
+    resolver = CountingResolver(60.0, {"api.example": ["10.0.0.1", "10.0.0.2"]})
+
+    async def scenario():
+        answers = await asyncio.gather(*(resolver.resolve("api.example", 443) for _ in range(5)))
+        answers.append(await resolver.resolve("api.example", 443))
+        return answers
+
+    answers = asyncio.run(scenario())
+    assert resolver.lookups == 1
+    assert (resolver.misses, resolver.hits) == (1, 5)
+    # Consecutive connections start with a different address
+    assert {answer[0] for answer in answers} == {"10.0.0.1", "10.0.0.2"}
+
+
+def test_dns_cache_can_be_disabled_and_skips_ip_literals():
+    resolver = CountingResolver(0, {"api.example": ["10.0.0.1"]})
+
+    async def scenario():
+        for _ in range(3):
+            await resolver.resolve("api.example", 443)
+        return await resolver.resolve("127.0.0.1", 443)
+
+    assert asyncio.run(scenario()) == ["127.0.0.1"]
+    assert resolver.lookups == 3
+
+
+def test_connect_tries_the_next_address_and_applies_the_connect_timeout():
+    resolver = CountingResolver(60.0, {"api.example": ["10.0.0.1", "10.0.0.2"]})
+    backend = FakeBackend(refused={"10.0.0.1"})
+    network = CachingNetworkBackend(resolver, connect_timeout=2.5, backend=backend)
+
+    async def scenario():
+        return [await network.connect_tcp("api.example", 443) for _ in range(2)]
+
+    assert asyncio.run(scenario()) == ["10.0.0.2", "10.0.0.2"]
+    assert network.connections_opened == 2
+    assert all(timeout == 2.5 for _, timeout in backend.attempts)
+
+
+def test_answer_is_forgotten_when_no_address_accepts():
+    resolver = CountingResolver(60.0, {"api.example": ["10.0.0.1"]})
+    network = CachingNetworkBackend(resolver, backend=FakeBackend(refused={"10.0.0.1"}))
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(httpcore.ConnectError):
+                await network.connect_tcp("api.example", 443)
+
+    asyncio.run(scenario())
+    assert resolver.lookups == 2
+    assert network.connections_opened == 0